@@ -21,7 +21,9 @@ logger.add("log/preprocess_spikesort_{time}.log", colorize=True,
 
 # Import submodules
 import run_catgt
+import run_common_reference
 import run_artifact_correction
+import run_noise_scan
 import run_overstrike
 import run_kilosort
 import run_bombcell
@@ -57,11 +59,23 @@ def main(input_dir, config_file):
     logger.info('Processed data will be saved to {}.'.format(processed_dir))
     pathlib.Path(processed_dir).mkdir(parents=True, exist_ok=True)
 
+    # Common median referencing by CatGT (-gblcar) or in Python: later stages read the stored re-referenced files
+    if config['common_reference']['engine'] not in ('catgt', 'python'):
+        raise ValueError('Unknown common_reference engine {}, must be catgt or python.'.format(
+            config['common_reference']['engine']))
+
     # Run CatGT
     logger.info('Starting CatGT.')
-    #run_catgt.main(input_dir, processed_dir, config['catgt'])
+    #run_catgt.main(input_dir, processed_dir, config['catgt'], events=config.get('events'),  # only changed events if rerun
+    #               gblcar=config['common_reference']['engine'] == 'catgt')
     logger.info('Finished CatGT in {}.'.format(time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))))
 
+    # Optionally, high-pass filter and common median referencing in Python instead of CatGT
+    if config['common_reference']['engine'] == 'python':
+        logger.info('Starting common median referencing.')
+        run_common_reference.main(input_dir, processed_dir, config['common_reference'])
+        logger.info('Finished common median referencing in {}.'.format(time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))))
+
     # Run TPrime a first time to sync whisker artifact times
     logger.info('Starting artifact correction.')
     #run_artifact_correction.main(processed_dir, config)
@@ -71,26 +85,17 @@ def main(input_dir, config_file):
     perform_overstrike = False
     if perform_overstrike:
 
-        # List of time spans to zero out in recording in secs, relative to start of recording
-        if mouse_name == 'AB105':
-            timespans_list = [(0,24),(1800,1933),(2389,3161)]
-        elif mouse_name == 'AB107':
-            timespans_list = [(1247, 1930)]
-        elif mouse_name == 'AB129':
-            timespans_list = [(5580, 1E9)]
-        elif mouse_name == 'AB142':
-            timespans_list = [(3474, 3892)]
-        elif mouse_name == 'PB191':
-            timespans_list = [(2350, 2373), (2724, 2778)]
-        elif mouse_name == 'AB149':
-            timespans_list = [(3200, 3524)]
-        else:
-            timespans_list = [(), ]
-
+        # Time spans to zero out in recording in secs, relative to start of recording, proposed by the noise scan
+        # (edit noise_timespans.yaml in the catgt_ folder to adjust them, it is not overwritten), plus the curated
+        # timespans of the mouse in config overstrike_overrides
+        logger.info('Starting noise scan.')
+        timespans_list = run_noise_scan.main(processed_dir, config)
+        logger.info('Finished noise scan in {}.'.format(time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))))
 
         # Run overstrike on all probes
         logger.info('Starting OverStrike.')
-        #run_overstrike.main(processed_dir, config['overstrike'], timespans_list=timespans_list)
+        if any(timespans_list.values()):
+            run_overstrike.main(processed_dir, config['overstrike'], timespans_list=timespans_list)
         logger.info('Finished OverStrike in {}.'.format(time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))))
 
     # Run motion estimation
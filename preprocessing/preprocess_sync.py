@@ -40,7 +40,7 @@ def main(input_dir, config_file):
 
     # Run TPrime
     logger.info('Starting Tprime.')
-    #run_tprime.main(input_dir, config['tprime'])
+    #run_tprime.main(input_dir, config['tprime'], events=config.get('events'))
     logger.info('Finished Tprime in {}.'.format(time.strftime('%H:%M:%S', time.gmtime(time.time()-start_time))))
 
     # Run Cwaves
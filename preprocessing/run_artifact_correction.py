@@ -13,111 +13,911 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import time
 import shutil
 import subprocess
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import pathlib
 from loguru import logger
 from utils.ephys_utils import check_if_valid_recording
 
+import matplotlib
+matplotlib.use('Agg')
 from matplotlib import pyplot as plt
 
 # Import readers
 from utils import readSGLX
+from utils import clock_sync
+from utils import event_schema
 
 
-def main(input_dir, config):
+# Artifact replacement strategies
+# Each strategy maps snippets around the artifact windows, of shape (channels x events x samples) with
+# pre_samples of context before the window and post_samples after it, to replacement windows
+# (channels x events x window) in one batched kernel. Snippets are always read from the uncorrected data.
+
+class ArtifactStrategy:
     """
-    Run artifact correction on CatGT-processed ephys data using TPrime-aligned artifact times.
-    This runs T-Prime to get artifact times aligned to probe timebase, and then replaces the artifact times with
-    the mean of the data just before the artifact times.
-    This reduces saturation/neuron-like/extra-filtering artifacts in the data, and is beneficial before spike sorting.
-    :param input_dir:
-    :param config:
-    :return:
+    Base class of artifact replacement strategies.
     """
+    name = None
 
-    epoch_name = os.listdir(input_dir)[0]
-    run_name = epoch_name[6:]
-    probe_folders = [f for f in os.listdir(os.path.join(input_dir, epoch_name)) if 'imec' in f]
+    def __init__(self, window_samples, sample_rate):
+        """
+        :param window_samples: (int) number of samples of the artifact window
+        :param sample_rate: (float) sampling rate in Hz
+        """
+        self.window_samples = window_samples
+        self.sample_rate = sample_rate
+        self.pre_samples = 0
+        self.post_samples = 0
 
-    for probe_folder in probe_folders:
-        probe_id = int(probe_folder.split('imec')[-1])
+    def snippets(self, raw_data, artifact_samples):
+        """
+        Read context and artifact windows of a batch of events.
+        :param raw_data: (np.memmap or readSGLX.CompressedRaw) uncorrected data
+        :param artifact_samples: (np.ndarray) sorted artifact onsets in samples
+        :return: (np.ndarray) int16 snippets (channels x events x samples)
+        """
+        return readSGLX.ExtractSnippets(raw_data, artifact_samples, preSamp=self.pre_samples,
+                                        postSamp=self.window_samples + self.post_samples, padMode='edge')
 
-        # Check if probe recording is valid
-        mouse_id = epoch_name.split('_')[1]
-        if not check_if_valid_recording(config, mouse_id, probe_id):
-            continue
+    def window(self, snippets):
+        """Artifact window part of snippets."""
+        return snippets[:, :, self.pre_samples:self.pre_samples + self.window_samples]
 
-        probe_path = os.path.join(input_dir, epoch_name, probe_folder)
+    def fit(self, raw_data, artifact_samples, batch_size=1024):
+        """
+        Estimate parameters shared across events, if any.
+        :param raw_data: (np.memmap or readSGLX.CompressedRaw) uncorrected data
+        :param artifact_samples: (np.ndarray) sorted artifact onsets in samples
+        :param batch_size: (int) number of events read at once
+        :return:
+        """
+        return
 
-        # Get ap-band binary data
-        ap_bin_filename = [f for f in os.listdir(probe_path) if 'ap.bin' in f][0]
-        ap_meta_filename = [f for f in os.listdir(probe_path) if 'ap.meta' in f][0]
-        ap_bin_path = pathlib.Path(probe_path, ap_bin_filename)
-        ap_meta_dict = readSGLX.readMeta(pathlib.Path(probe_path, ap_meta_filename))
+    def kernel(self, snippets):
+        """
+        Batched replacement kernel.
+        :param snippets: (np.ndarray) int16 snippets (channels x events x samples)
+        :return: (np.ndarray) replacement windows (channels x events x window)
+        """
+        raise NotImplementedError
 
-        # Create a copy of the meta file with the corrected name (needed by SpikeGLX to read the binary file)
-        new_meta_file_name = ap_meta_filename.replace('tcat', 'tcat_corrected')
-        new_meta_file_path = pathlib.Path(probe_path, new_meta_file_name)
-        with open(new_meta_file_path, 'w') as f:
-            for key, val in ap_meta_dict.items():
-                if key in ['imroTbl', 'muxTbl', 'snsChanMap', 'snsShankMap', 'snsGeomMap']:
-                    f.write('~{}={}\n'.format(key, val))
-                else:
-                    f.write('{}={}\n'.format(key, val))
+    def replace(self, raw_data, artifact_samples, batch_size=1024):
+        """
+        Compute the int16 replacement windows of a set of events, in batches.
+        :param raw_data: (np.memmap or readSGLX.CompressedRaw) uncorrected data
+        :param artifact_samples: (np.ndarray) sorted artifact onsets in samples
+        :param batch_size: (int) number of events processed at once
+        :return: (np.ndarray) int16 replacement windows (channels x events x window)
+        """
+        replacement = np.empty((raw_data.shape[0], artifact_samples.size, self.window_samples), dtype='int16')
+        for batch_start in range(0, artifact_samples.size, batch_size):
+            batch = slice(batch_start, batch_start + batch_size)
+            values = self.kernel(self.snippets(raw_data, artifact_samples[batch]))
+            if values.dtype != np.int16:
+                values = np.clip(np.rint(values), -32768, 32767)
+            replacement[:, batch] = values
+        return replacement
 
-        # Read the binary data as a memory-mapped file
-        ap_raw_data = readSGLX.makeMemMapRaw(ap_bin_path, ap_meta_dict)
 
-        # Run TPrime to get artifact times aligned to probe timebase
-        nidq_stream_idx = 10 # arbitrary index number
-        syncperiod = config['tprime']['syncperiod']
-        tostream_probe_edges_file = '{}_tcat.imec{}.ap.xd_{}_6_500.txt'.format(run_name, probe_id, int(ap_meta_dict['nSavedChans'])-1)
+class MeanReplacement(ArtifactStrategy):
+    """
+    Replace the window by the mean of the preceding window of the same duration, per channel.
+    """
+    name = 'mean'
+
+    def __init__(self, window_samples, sample_rate):
+        super().__init__(window_samples, sample_rate)
+        self.pre_samples = window_samples
+
+    def kernel(self, snippets):
+        ch_means = snippets[:, :, :self.pre_samples].mean(axis=2, keepdims=True)
+        # truncated to int16, as with a memmap assignment
+        return np.broadcast_to(ch_means.astype('int16'), snippets.shape[:2] + (self.window_samples,))
+
+
+class LinearReplacement(ArtifactStrategy):
+    """
+    Replace the window by a straight line between the mean values just before and just after it, per channel.
+    """
+    name = 'linear'
+
+    def __init__(self, window_samples, sample_rate, edge_ms=0.2):
+        super().__init__(window_samples, sample_rate)
+        self.pre_samples = max(int(edge_ms * sample_rate / 1000), 1)
+        self.post_samples = self.pre_samples
+        self.ramp = (np.arange(1, window_samples + 1, dtype='float32') / (window_samples + 1))
+
+    def kernel(self, snippets):
+        start = snippets[:, :, :self.pre_samples].mean(axis=2, dtype='float32', keepdims=True)
+        stop = snippets[:, :, -self.post_samples:].mean(axis=2, dtype='float32', keepdims=True)
+        return start + (stop - start) * self.ramp
+
+
+class TemplateSubtraction(ArtifactStrategy):
+    """
+    Subtract the average artifact waveform of each channel, estimated over all events after removing the baseline
+    of each event (mean of the preceding window). Spikes overlapping the window are kept.
+    """
+    name = 'template'
+
+    def __init__(self, window_samples, sample_rate):
+        super().__init__(window_samples, sample_rate)
+        self.pre_samples = window_samples
+        self.template = None
+
+    def fit(self, raw_data, artifact_samples, batch_size=1024):
+        template_sum = np.zeros((raw_data.shape[0], self.window_samples), dtype='float64')
+        for batch_start in range(0, artifact_samples.size, batch_size):
+            snippets = self.snippets(raw_data, artifact_samples[batch_start:batch_start + batch_size])
+            baseline = snippets[:, :, :self.pre_samples].mean(axis=2, dtype='float32', keepdims=True)
+            template_sum += (self.window(snippets) - baseline).sum(axis=1)
+        self.template = (template_sum / max(artifact_samples.size, 1)).astype('float32')[:, np.newaxis, :]
+        return
+
+    def kernel(self, snippets):
+        return self.window(snippets) - self.template
+
+
+class TaperedBlanking(ArtifactStrategy):
+    """
+    Blank the window to the mean of the preceding window, then return to the data with a cosine taper over the
+    last taper_ms of the window, to avoid a step at its end. The window starts at the artifact onset, so it is
+    blanked from its first sample.
+    """
+    name = 'taper'
+
+    def __init__(self, window_samples, sample_rate, taper_ms=1.0):
+        super().__init__(window_samples, sample_rate)
+        self.pre_samples = window_samples
+        n_taper = min(max(int(taper_ms * sample_rate / 1000), 1), window_samples)
+        self.weight = np.ones(window_samples, dtype='float32')  # 1 = fully blanked
+        self.weight[window_samples - n_taper:] = 0.5 * (1 + np.cos(np.pi * (np.arange(n_taper) + 1) / (n_taper + 1)))
+
+    def kernel(self, snippets):
+        baseline = snippets[:, :, :self.pre_samples].mean(axis=2, dtype='float32', keepdims=True)
+        window = self.window(snippets)
+        return window + (baseline - window) * self.weight
+
+
+ARTIFACT_STRATEGIES = {strategy.name: strategy for strategy in
+                       [MeanReplacement, LinearReplacement, TemplateSubtraction, TaperedBlanking]}
+
+
+def make_strategy(name, window_samples, sample_rate, **params):
+    """
+    Build an artifact replacement strategy by name.
+    :param name: (str) key of ARTIFACT_STRATEGIES: 'mean', 'linear', 'template' or 'taper'
+    :param window_samples: (int) number of samples of the artifact window
+    :param sample_rate: (float) sampling rate in Hz
+    :param params: strategy parameters, e.g. edge_ms for 'linear' or taper_ms for 'taper'
+    :return: (ArtifactStrategy)
+    """
+    if name not in ARTIFACT_STRATEGIES:
+        raise ValueError('unrecognized artifact correction strategy: {}'.format(name))
+    return ARTIFACT_STRATEGIES[name](window_samples, sample_rate, **params)
+
+
+# Artifact detection
+# Transients are found without NI events from the median over channels, which keeps common-mode artifacts
+# (e.g. coil stimulation, licks, movement) and removes local spikes, and from samples at the ADC rails.
+
+def merge_intervals(intervals, gap=0):
+    """
+    Merge overlapping intervals, and intervals closer than gap.
+    :param intervals: (np.ndarray) [start, stop) sample intervals (n x 2)
+    :param gap: (int) intervals separated by at most gap samples are merged
+    :return: (np.ndarray) sorted, disjoint int64 intervals (m x 2)
+    """
+    intervals = np.asarray(intervals, dtype='int64').reshape(-1, 2)
+    if intervals.shape[0] == 0:
+        return intervals
+    intervals = intervals[np.argsort(intervals[:, 0], kind='stable')]
+    stops = np.maximum.accumulate(intervals[:, 1])
+    new_start = np.ones(intervals.shape[0], dtype=bool)
+    new_start[1:] = intervals[1:, 0] > stops[:-1] + gap
+    starts_idx = np.flatnonzero(new_start)
+    stops_idx = np.append(starts_idx[1:], intervals.shape[0]) - 1
+    return np.stack([intervals[starts_idx, 0], stops[stops_idx]], axis=1)
+
+
+def detect_artifacts(raw_data, sample_rate, channels=slice(None), chunk_samples=131072, threshold=10.,
+                     min_scale=1., saturation_level=None, saturation_fraction=0.1, pad_ms=0.5, merge_ms=1.):
+    """
+    Detect artifacts chunk by chunk: samples where the median over channels deviates from its chunk median by
+    more than threshold robust standard deviations (MAD), or where at least saturation_fraction of the channels
+    are at the ADC rails. Detected samples are padded by pad_ms and merged into intervals.
+    :param raw_data: (np.memmap or readSGLX.CompressedRaw) data (channels x time)
+    :param sample_rate: (float) sampling rate in Hz
+    :param channels: (slice or list) channels used for detection, e.g. without the sync channel
+    :param chunk_samples: (int) number of samples per chunk
+    :param threshold: (float) threshold on the channel median, in robust standard deviations
+    :param min_scale: (float) lower bound of the robust standard deviation, in bits
+    :param saturation_level: (int) absolute value at which a sample is saturated, None to skip saturation
+    :param saturation_fraction: (float) fraction of channels saturated at the same time to flag a sample
+    :param pad_ms: (float) padding added before and after each detected run, in ms
+    :param merge_ms: (float) runs closer than merge_ms are merged
+    :return: (np.ndarray) sorted, disjoint [start, stop) sample intervals (n x 2)
+    """
+    n_samples = raw_data.shape[1]
+    pad = int(round(pad_ms * sample_rate / 1000))
+    runs = []
+    for chunk_start in range(0, n_samples, chunk_samples):
+        chunk = np.asarray(raw_data[:, chunk_start:min(chunk_start + chunk_samples, n_samples)])[channels]
+
+        # Common-mode signal and its robust spread in this chunk
+        common = np.median(chunk, axis=0)
+        center = np.median(common)
+        scale = max(1.4826 * np.median(np.abs(common - center)), min_scale)
+        flagged = np.abs(common - center) > threshold * scale
+
+        if saturation_level is not None:
+            n_saturated = np.count_nonzero((chunk >= saturation_level) | (chunk <= -saturation_level), axis=0)
+            flagged |= n_saturated >= saturation_fraction * chunk.shape[0]
+
+        # Runs of flagged samples, as [start, stop) intervals
+        edges = np.diff(flagged.astype('int8'), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        stops = np.flatnonzero(edges == -1)
+        if starts.size:
+            runs.append(np.stack([starts, stops], axis=1) + chunk_start)
+
+    if not runs:
+        return np.zeros((0, 2), dtype='int64')
+    intervals = np.concatenate(runs)
+    intervals[:, 0] = np.maximum(intervals[:, 0] - pad, 0)
+    intervals[:, 1] = np.minimum(intervals[:, 1] + pad, n_samples)
+    intervals = merge_intervals(intervals, gap=int(round(merge_ms * sample_rate / 1000)))
+    logger.info('Detected {} artifact intervals ({:.1f} ms in total).'.format(
+        intervals.shape[0], (intervals[:, 1] - intervals[:, 0]).sum() * 1000 / sample_rate))
+    return intervals
+
+
+def undo_log_path(output_path):
+    """
+    Path of the undo log written by the in-place artifact correction.
+    :param output_path: (Path) path to the corrected .ap.bin file
+    :return: (Path)
+    """
+    output_path = pathlib.Path(output_path)
+    return output_path.with_name(output_path.stem + '.undo.npz')
+
+
+def undo_artifact_correction(output_path):
+    """
+    Restore the samples overwritten by an in-place artifact correction and rename the file back to its source name.
+    :param output_path: (Path) path to the corrected .ap.bin file
+    :return: (Path) path to the restored .ap.bin file
+    """
+    output_path = pathlib.Path(output_path)
+    undo_path = undo_log_path(output_path)
+    undo = np.load(undo_path)
+    source_path = output_path.with_name(str(undo['source_name']))
+
+    data = np.memmap(output_path, dtype='int16', mode='r+', order='F',
+                     shape=(int(undo['n_chans']), int(undo['n_samples'])))
+    intervals = undo['intervals']
+    original = undo['original']
+    offset = 0
+    for start, stop in intervals:
+        length = stop - start
+        stop = min(stop, data.shape[1])
+        data[:, start:stop] = original[:, offset:offset + stop - start]
+        offset += length
+    data.flush()
+    del data
+
+    os.replace(output_path, source_path)
+    os.remove(undo_path)
+    logger.info('Restored {} from undo log.'.format(source_path.name))
+    return source_path
+
+
+def qc_report_paths(output_path):
+    """
+    Paths of the QC report of an artifact correction: summary JSON, per-channel arrays NPZ and summary figure.
+    :param output_path: (Path) path to the corrected .ap.bin file
+    :return: (dict) 'json', 'npz' and 'png' paths
+    """
+    output_path = pathlib.Path(output_path)
+    return {ext: output_path.with_name(output_path.stem + '.qc.' + ext) for ext in ('json', 'npz', 'png')}
+
+
+class ArtifactQC:
+    """
+    Before/after statistics of an artifact correction, accumulated chunk by chunk during the streaming pass:
+    per-channel RMS inside and outside artifact windows, peak-to-peak in each artifact window and
+    event-triggered averages (ETA) around artifact onsets.
+    """
+
+    def __init__(self, n_chans, artifact_samples, window_samples, sample_rate, eta_ms=(-5., 15.), block_samples=8192):
+        """
+        :param n_chans: (int) number of channels
+        :param artifact_samples: (np.ndarray) sorted artifact onsets in samples
+        :param window_samples: (int) number of samples of the artifact window
+        :param sample_rate: (float) sampling rate in Hz
+        :param eta_ms: (tuple) start and stop of the ETA window relative to artifact onsets, in ms
+        :param block_samples: (int) number of samples converted to float at once for the RMS
+        """
+        self.artifact_samples = artifact_samples
+        self.window_samples = window_samples
+        self.sample_rate = sample_rate
+        self.eta_start = int(round(eta_ms[0] * sample_rate / 1000))
+        self.eta_stop = int(round(eta_ms[1] * sample_rate / 1000))
+        self.block_samples = block_samples
+
+        n_events = artifact_samples.size
+        n_lags = self.eta_stop - self.eta_start
+        self.sum_sq_total = np.zeros(n_chans)
+        self.n_total = 0
+        self.n_window = 0
+        self.sum_sq_window = {stage: np.zeros(n_chans) for stage in ('before', 'after')}
+        self.peak_max = {stage: np.full((n_chans, n_events), -32768, dtype='int16') for stage in ('before', 'after')}
+        self.peak_min = {stage: np.full((n_chans, n_events), 32767, dtype='int16') for stage in ('before', 'after')}
+        self.eta_sum = {stage: np.zeros((n_chans, n_lags)) for stage in ('before', 'after')}
+        self.eta_count = np.zeros(n_lags)
+
+    def _events_in(self, chunk_start, chunk_stop, start, stop):
+        """Range of events whose [onset + start, onset + stop) window overlaps the chunk."""
+        return np.searchsorted(self.artifact_samples, [chunk_start - stop + 1, chunk_stop - start])
+
+    def update(self, chunk, chunk_start, stage):
+        """
+        Accumulate the statistics of a chunk.
+        :param chunk: (np.ndarray) int16 data (channels x time)
+        :param chunk_start: (int) first sample of the chunk
+        :param stage: (str) 'before' or 'after' correction
+        :return:
+        """
+        chunk_stop = chunk_start + chunk.shape[1]
+
+        # RMS of the whole chunk, outside windows is the same before and after correction
+        if stage == 'before':
+            for block_start in range(0, chunk.shape[1], self.block_samples):
+                block = chunk[:, block_start:block_start + self.block_samples].astype('float64')
+                self.sum_sq_total += np.einsum('ij,ij->i', block, block)
+            self.n_total += chunk.shape[1]
+
+        # Artifact windows: RMS and peak-to-peak
+        in_window = np.zeros(chunk.shape[1], dtype=bool)
+        first, last = self._events_in(chunk_start, chunk_stop, 0, self.window_samples)
+        for i in range(first, last):
+            start = max(self.artifact_samples[i], chunk_start) - chunk_start
+            stop = min(self.artifact_samples[i] + self.window_samples, chunk_stop) - chunk_start
+            if stop <= start:
+                continue
+            in_window[start:stop] = True
+            window = chunk[:, start:stop]
+            np.maximum(self.peak_max[stage][:, i], window.max(axis=1), out=self.peak_max[stage][:, i])
+            np.minimum(self.peak_min[stage][:, i], window.min(axis=1), out=self.peak_min[stage][:, i])
+        if in_window.any():
+            window = chunk[:, in_window].astype('float64')
+            self.sum_sq_window[stage] += np.einsum('ij,ij->i', window, window)
+            if stage == 'before':
+                self.n_window += window.shape[1]
+
+        # Event-triggered averages, each (event, lag) pair falls in exactly one chunk
+        first, last = self._events_in(chunk_start, chunk_stop, self.eta_start, self.eta_stop)
+        for i in range(first, last):
+            eta_onset = self.artifact_samples[i] + self.eta_start
+            start = max(eta_onset, chunk_start)
+            stop = min(self.artifact_samples[i] + self.eta_stop, chunk_stop)
+            self.eta_sum[stage][:, start - eta_onset:stop - eta_onset] += chunk[:, start - chunk_start:stop - chunk_start]
+            if stage == 'before':
+                self.eta_count[start - eta_onset:stop - eta_onset] += 1
+        return
+
+    def results(self):
+        """
+        Final statistics.
+        :return: (dict) per-channel arrays
+        """
+        rms_before = np.sqrt(self.sum_sq_window['before'] / max(self.n_window, 1))
+        rms_after = np.sqrt(self.sum_sq_window['after'] / max(self.n_window, 1))
+        n_outside = max(self.n_total - self.n_window, 1)
+        rms_outside = np.sqrt(np.maximum(self.sum_sq_total - self.sum_sq_window['before'], 0) / n_outside)
+        eta_count = np.maximum(self.eta_count, 1)
+        return {
+            'rms_artifact_before': rms_before,
+            'rms_artifact_after': rms_after,
+            'rms_outside': rms_outside,
+            'p2p_before': self.peak_max['before'].astype('int32') - self.peak_min['before'],
+            'p2p_after': self.peak_max['after'].astype('int32') - self.peak_min['after'],
+            'eta_before': self.eta_sum['before'] / eta_count,
+            'eta_after': self.eta_sum['after'] / eta_count,
+            'eta_lags_ms': np.arange(self.eta_start, self.eta_stop) * 1000 / self.sample_rate,
+            'artifact_samples': self.artifact_samples,
+        }
+
+    def save(self, output_path, strategy_name):
+        """
+        Write the QC report next to the corrected file: summary JSON, per-channel arrays NPZ and a summary figure.
+        :param output_path: (Path) path to the corrected .ap.bin file
+        :param strategy_name: (str) name of the replacement strategy
+        :return: (dict) summary
+        """
+        paths = qc_report_paths(output_path)
+        results = self.results()
+        np.savez(paths['npz'], **results)
+
+        n_events = self.artifact_samples.size
+        p2p_before = np.median(results['p2p_before'], axis=1) if n_events else np.zeros(0)
+        p2p_after = np.median(results['p2p_after'], axis=1) if n_events else np.zeros(0)
+        summary = {
+            'strategy': strategy_name,
+            'n_events': int(n_events),
+            'window_ms': self.window_samples * 1000 / self.sample_rate,
+            'median_rms_artifact_before': float(np.median(results['rms_artifact_before'])),
+            'median_rms_artifact_after': float(np.median(results['rms_artifact_after'])),
+            'median_rms_outside': float(np.median(results['rms_outside'])),
+            'median_p2p_before': float(np.median(p2p_before)) if n_events else None,
+            'median_p2p_after': float(np.median(p2p_after)) if n_events else None,
+        }
+        with open(paths['json'], 'w') as f:
+            json.dump(summary, f, indent=2)
+
+        # Summary figure: ETA averaged over channels, RMS and residual peak-to-peak per channel
+        fig, axs = plt.subplots(1, 3, figsize=(12, 4), dpi=150)
+        axs[0].plot(results['eta_lags_ms'], results['eta_before'].mean(axis=0), c='grey', label='before')
+        axs[0].plot(results['eta_lags_ms'], results['eta_after'].mean(axis=0), c='k', label='after')
+        axs[0].axvspan(0, summary['window_ms'], color='r', alpha=0.1)
+        axs[0].set_title('Event-triggered average')
+        axs[0].set_xlabel('Time from artifact (ms)')
+        axs[0].set_ylabel('Mean over channels (a.u.)')
+        axs[0].legend(frameon=False)
 
+        channels = np.arange(results['rms_outside'].size)
+        axs[1].plot(channels, results['rms_artifact_before'], c='grey', label='artifact, before')
+        axs[1].plot(channels, results['rms_artifact_after'], c='k', label='artifact, after')
+        axs[1].plot(channels, results['rms_outside'], c='C0', label='outside artifacts')
+        axs[1].set_title('RMS')
+        axs[1].set_xlabel('Channel')
+        axs[1].legend(frameon=False)
+
+        if n_events:
+            axs[2].plot(channels, p2p_before, c='grey', label='before')
+            axs[2].plot(channels, p2p_after, c='k', label='after')
+            axs[2].legend(frameon=False)
+        axs[2].set_title('Median peak-to-peak in artifact window')
+        axs[2].set_xlabel('Channel')
+
+        fig.tight_layout()
+        fig.savefig(paths['png'], dpi='figure', bbox_inches='tight')
+        plt.close(fig)
+
+        logger.info('Artifact QC: RMS in artifact windows {:.1f} -> {:.1f} (outside {:.1f}), report in {}.'.format(
+            summary['median_rms_artifact_before'], summary['median_rms_artifact_after'],
+            summary['median_rms_outside'], paths['json'].name))
+        return summary
+
+
+def artifact_groups(artifact_samples, window_samples, n_samples, detected_intervals=None):
+    """
+    Artifact windows to correct, grouped by length: the windows at artifact onsets and the detected intervals are
+    merged, and each merged interval is corrected as one window of its own length, so that windows never overlap nor
+    run past their interval, and their context is read before and after the whole interval. Windows of the same
+    length are corrected in one batch.
+    :param artifact_samples: (np.ndarray) sorted artifact onsets in samples
+    :param window_samples: (int) number of samples of the artifact window, 0 to only correct detected intervals
+    :param n_samples: (int) number of samples of the recording
+    :param detected_intervals: (np.ndarray) detected [start, stop) intervals (n x 2), see detect_artifacts
+    :return: (list) (onsets, window length) of each group
+    """
+    intervals = np.stack([artifact_samples, artifact_samples + window_samples], axis=1)
+    if detected_intervals is not None and len(detected_intervals):
+        intervals = merge_intervals(np.concatenate([intervals, detected_intervals]))
+    intervals = intervals[intervals[:, 1] > intervals[:, 0]]
+    if intervals.shape[0] == 0:
+        return [(np.zeros(0, dtype='int64'), window_samples)]
+
+    lengths = intervals[:, 1] - intervals[:, 0]
+    groups = []
+    for length in np.unique(lengths):
+        onsets = intervals[lengths == length, 0]
+        groups.append((np.minimum(onsets, n_samples - 1), int(length)))
+    return groups
+
+
+class TimedLock:
+    """
+    Lock limiting concurrent disk writers, recording the time spent waiting to acquire it.
+    """
+
+    def __init__(self, lock=None):
+        """
+        :param lock: (multiprocessing.Semaphore) semaphore limiting concurrent disk writers, None for no limit
+        """
+        self.lock = lock or contextlib.nullcontext()
+        self.wait_seconds = 0.
+
+    def __enter__(self):
+        start_time = time.time()
+        self.lock.__enter__()
+        self.wait_seconds += time.time() - start_time
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.lock.__exit__(*exc_info)
+
+
+def correct_artifacts(ap_bin_path, ap_meta, artifact_times, window_ms, output_path, mode='stream',
+                      chunk_samples=131072, write_lock=None, strategy='mean', strategy_params=None, qc=False,
+                      detect=False, detect_params=None):
+    """
+    Write a version of an .ap.bin file where each artifact window is replaced using a replacement strategy,
+    by default the mean of the data just before it (see ARTIFACT_STRATEGIES).
+    Modes:
+        - 'stream': read the source once in large chunks, patch the windows in memory and write the output sequentially
+        - 'inplace': patch the source file, keeping the overwritten samples in an undo log, then rename it to output_path
+        - 'copy': copy the whole file, then patch the windows through a memmap of the copy
+    :param ap_bin_path: (Path) path to .ap.bin file
+    :param ap_meta: (readSGLX.MetaInfo) metadata of the .ap.bin file
+    :param artifact_times: (np.ndarray) artifact times in seconds, in the probe timebase
+    :param window_ms: (float) duration of the artifact window in ms
+    :param output_path: (Path) path to the corrected .ap.bin file, overwritten if it exists
+    :param mode: (str) 'stream', 'inplace' or 'copy'
+    :param chunk_samples: (int) number of samples per chunk in stream mode
+    :param write_lock: (multiprocessing.Semaphore) held while writing to disk, to limit concurrent writers. In stream
+        mode it is held for the write of each chunk only, so that reads and replacements overlap across probes.
+    :param strategy: (str) replacement strategy, key of ARTIFACT_STRATEGIES
+    :param strategy_params: (dict) parameters of the strategy
+    :param qc: (bool) accumulate before/after statistics during the stream pass and write a QC report (see ArtifactQC)
+    :param detect: (bool) also correct artifacts detected in the data (see detect_artifacts)
+    :param detect_params: (dict) parameters of detect_artifacts
+    :return: (float) time spent waiting for write_lock, in s
+    """
+    if mode not in ('stream', 'inplace', 'copy'):
+        raise ValueError('unrecognized artifact correction mode: {}'.format(mode))
+    if mode != 'stream' and readSGLX.IsCompressed(ap_bin_path):
+        logger.warning('{} is compressed, using stream mode for artifact correction.'.format(ap_bin_path.name))
+        mode = 'stream'
+    if qc and mode != 'stream':
+        logger.warning('Artifact QC is computed during the stream pass, skipping it in {} mode.'.format(mode))
+        qc = False
+
+    ap_raw_data = readSGLX.openRaw(ap_bin_path, ap_meta.raw)
+    n_chans, n_samples = ap_raw_data.shape
+    fs = ap_meta.sampRate
+    artifact_samples = np.clip((np.asarray(artifact_times) * fs).round().astype(int), 0, n_samples - 1)
+    artifact_samples = np.sort(artifact_samples)
+
+    # Compute correction window
+    window_samples = int(window_ms * fs / 1000)
+
+    # Detect other artifacts on the neural channels, without the sync channel
+    detected_intervals = None
+    if detect:
+        detect_params = dict(detect_params or {})
+        if ap_meta.isImec:
+            detect_params.setdefault('channels', slice(0, readSGLX.ChannelCountsIM(ap_meta.raw)[0]))
+            detect_params.setdefault('saturation_level', int(ap_meta.raw.get('imMaxInt', 512)) - 1)
+        detected_intervals = detect_artifacts(ap_raw_data, fs, **detect_params)
+
+    # Fit the replacement strategy of each group of windows on the uncorrected data
+    groups = []
+    for onsets, length in artifact_groups(artifact_samples, window_samples, n_samples, detected_intervals):
+        group_strategy = make_strategy(strategy, length, fs, **(strategy_params or {}))
+        group_strategy.fit(ap_raw_data, onsets)
+        groups.append((onsets, length, group_strategy))
+    write_lock = TimedLock(write_lock)
+
+    if mode == 'stream':
+        # One sequential pass: read chunk, patch windows overlapping it, append to the output
+        artifact_qc = ArtifactQC(n_chans, artifact_samples, window_samples, fs) if qc else None
+        logger.info('Writing a corrected copy of the .ap.bin file (single pass).')
+        tmp_path = output_path.with_name(output_path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            for chunk_start in range(0, n_samples, chunk_samples):
+                chunk_stop = min(chunk_start + chunk_samples, n_samples)
+                chunk = np.array(ap_raw_data[:, chunk_start:chunk_stop])  # channels x time, copy of the source
+                if artifact_qc is not None:
+                    artifact_qc.update(chunk, chunk_start, 'before')
+
+                # Replacement of the windows overlapping the chunk, computed from the source
+                for onsets, length, group_strategy in groups:
+                    first, last = np.searchsorted(onsets, [chunk_start - length + 1, chunk_stop])
+                    if last > first:
+                        replacement = group_strategy.replace(ap_raw_data, onsets[first:last])
+                    for i in range(first, last):
+                        start = max(onsets[i], chunk_start)
+                        stop = min(onsets[i] + length, chunk_stop)
+                        offset = start - onsets[i]
+                        chunk[:, start - chunk_start:stop - chunk_start] = \
+                            replacement[:, i - first, offset:offset + stop - start]
+                if artifact_qc is not None:
+                    artifact_qc.update(chunk, chunk_start, 'after')
+
+                with write_lock:
+                    chunk.T.tofile(f)  # time-major, as in SpikeGLX files
+        if hasattr(ap_raw_data, 'close'):
+            ap_raw_data.close()
+        del ap_raw_data
+        os.replace(tmp_path, output_path)
+        if artifact_qc is not None:
+            artifact_qc.save(output_path, strategy)
+        return write_lock.wait_seconds
+
+    # Replacement of all windows, computed before anything is written
+    replacements = [group_strategy.replace(ap_raw_data, onsets) for onsets, length, group_strategy in groups]
+
+    if mode == 'inplace':
+        # Keep the samples about to be overwritten, then patch the source file itself
+        logger.info('Correcting the .ap.bin file in place, with an undo log.')
+        intervals = np.concatenate([np.stack([onsets, onsets + length], axis=1) for onsets, length, _ in groups])
+        original = np.concatenate([readSGLX.ExtractSnippets(ap_raw_data, onsets, preSamp=0, postSamp=length,
+                                                            padMode='zero').reshape(n_chans, -1)
+                                   for onsets, length, _ in groups], axis=1)
+        del ap_raw_data
+        data_path = ap_bin_path
+
+    with write_lock:
+        if mode == 'inplace':
+            undo_path = undo_log_path(output_path)
+            tmp_path = undo_path.with_name(undo_path.name + '.tmp.npz')
+            np.savez(tmp_path, intervals=intervals, original=original,
+                     n_chans=n_chans, n_samples=n_samples, source_name=pathlib.Path(ap_bin_path).name)
+            os.replace(tmp_path, undo_path)
+        else:
+            # Create a copy of the memmap file
+            logger.info('Writing a corrected copy of the .ap.bin file.')
+            shutil.copyfile(ap_bin_path, output_path)  # Always overwrite
+            data_path = output_path
+
+        data = np.memmap(data_path, dtype='int16', mode='r+', shape=(n_chans, n_samples), order='F')
+
+        for (onsets, length, _), replacement in zip(groups, replacements):
+            for i, artifact_sample in enumerate(onsets):
+                stop = min(artifact_sample + length, n_samples)
+                data[:, artifact_sample:stop] = replacement[:, i, :stop - artifact_sample]
+
+        data.flush()  # Ensures all writes are committed
+        del data  # Close memmap explicitly to avoid memory issues
+
+    if mode == 'inplace':
+        os.replace(ap_bin_path, output_path)
+    return write_lock.wait_seconds
+
+
+# Limit on concurrent disk writers, shared with the worker processes
+_WRITE_LOCK = None
+
+
+def _init_worker(write_lock):
+    """
+    Initialize an artifact correction worker process.
+    :param write_lock: (multiprocessing.Semaphore) semaphore limiting concurrent disk writers
+    :return:
+    """
+    global _WRITE_LOCK
+    _WRITE_LOCK = write_lock
+    return
+
+
+def artifact_times_key(input_paths, syncperiod, engine):
+    """
+    Content hash of the inputs of the artifact time alignment.
+    :param input_paths: (list) paths to the event and sync edge files
+    :param syncperiod: sync period in seconds
+    :param engine: clock alignment engine ('python' or 'tprime')
+    :return: (str) hex digest
+    """
+    return event_schema.inputs_key(input_paths, float(syncperiod), engine)
+
+
+def load_cached_artifact_times(cache_path, key):
+    """
+    Load aligned artifact times from the cache sidecar if it was written for the same inputs.
+    :param cache_path: path to the .npz sidecar
+    :param key: content hash of the inputs, see artifact_times_key
+    :return: (np.ndarray) artifact times, or None if the cache is missing or stale
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cached:
+            if str(cached['key']) == key:
+                return cached['artifact_times']
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning('Could not read artifact time cache {}: {}'.format(cache_path, e))
+    return None
+
+
+def align_artifact_times(events_path, fromstream_edges_path, tostream_edges_path, output_path, syncperiod,
+                         tprime_config):
+    """
+    Align NI artifact times to a probe timebase, with the native clock alignment or a TPrime pass.
+    Aligned times are cached next to output_path and reused if the event and edge files and syncperiod have not changed.
+    :param events_path: path to NI artifact times
+    :param fromstream_edges_path: path to NI sync edge times
+    :param tostream_edges_path: path to probe sync edge times
+    :param output_path: path to aligned artifact times (.txt)
+    :param syncperiod: sync period in seconds
+    :param tprime_config: tprime config dict
+    :return: (np.ndarray) artifact times in the probe timebase
+    """
+    engine = tprime_config.get('engine', 'python')
+    cache_path = str(pathlib.Path(output_path).with_suffix('.npz'))
+    cache_key = artifact_times_key([events_path, fromstream_edges_path, tostream_edges_path], syncperiod, engine)
+    artifact_times = load_cached_artifact_times(cache_path, cache_key)
+    if artifact_times is not None:
+        logger.info('Using cached aligned artifact times {}.'.format(cache_path))
+        return artifact_times
+
+    if engine == 'python':
+        artifact_times = clock_sync.align_events(events_path, fromstream_edges_path, tostream_edges_path, output_path,
+                                                 sync_period=syncperiod)
+    else:
+        nidq_stream_idx = 10 # arbitrary index number
         command = ['TPrime',
                      '-syncperiod={}'.format(syncperiod),
-                     '-tostream={}'.format(os.path.join(probe_path, tostream_probe_edges_file)),
-                     '-fromstream={},{}'.format(nidq_stream_idx, os.path.join(input_dir, epoch_name, run_name + '_tcat.nidq.xa_0_0.txt')),
-                     '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, epoch_name, '{}_tcat.nidq.xa_3_0.txt'.format(run_name)),
-                                  os.path.join(probe_path, 'whisker_stim_times_to_imec{}.txt'.format(probe_id))),
+                     '-tostream={}'.format(tostream_edges_path),
+                     '-fromstream={},{}'.format(nidq_stream_idx, fromstream_edges_path),
+                     '-events={},{},{}'.format(nidq_stream_idx, events_path, output_path),
              ]
-        logger.info('TPrime pass to sync whisker artifact times to IMEC probe {} timebase.'.format(probe_id))
-        subprocess.run(command, shell=True, cwd=config['tprime']['tprime_path'])
+        logger.info('TPrime pass with command: {}'.format(command))
+        start_time = time.time()
+        result = subprocess.run(command, shell=True, cwd=tprime_config['tprime_path'])
+
+        # Check TPrime wrote the output, so that a file of a previous run is not cached as valid
+        if result.returncode != 0:
+            raise RuntimeError('TPrime failed with exit code {}, see {}.'.format(
+                result.returncode, os.path.join(tprime_config['tprime_path'], 'Tprime.log')))
+        if not os.path.exists(output_path) or os.path.getmtime(output_path) < int(start_time):
+            raise RuntimeError('TPrime did not write {}.'.format(output_path))
 
         # Read artifact times
-        artifact_times = np.loadtxt(os.path.join(probe_path, 'whisker_stim_times_to_imec{}.txt'.format(probe_id)))
-        fs = float(ap_meta_dict['imSampRate'])
-        indices = np.clip((artifact_times * fs).round().astype(int), 0, ap_raw_data.shape[1] - 1)
+        artifact_times = np.loadtxt(output_path, ndmin=1)
+    np.savez(cache_path, key=cache_key, artifact_times=artifact_times)
+    return artifact_times
 
-        # Compute correction window
-        window_samples = int(config['artifact_correction']['window_ms'] * fs / 1000)
-        indices = np.array([np.arange(i, i + window_samples) for i in indices])
 
-        # Optimize by replacing only affected segments
-        before_indices = np.maximum(indices - window_samples, 0)
+def correct_probe(input_dir, epoch_name, probe_folder, config):
+    """
+    Run artifact correction for one probe: artifact times aligned to the probe timebase, then correction.
+    :param input_dir: path to CatGT-processed data
+    :param epoch_name: name of the catgt_ epoch folder
+    :param probe_folder: name of the probe folder
+    :param config: config dict
+    :return: (dict) probe id, duration and throughput of the correction
+    """
+    start_time = time.time()
+    run_name = epoch_name[6:]
+    probe_id = int(probe_folder.split('imec')[-1])
+    probe_path = os.path.join(input_dir, epoch_name, probe_folder)
 
-        # Compute mean of pre-artifact data (vectorized)
-        ch_means = np.mean(ap_raw_data[:, before_indices], axis=2, keepdims=True)
+    # Restore the source file of a previous in-place correction
+    correction_mode = config['artifact_correction'].get('mode', 'stream')
+    for f in os.listdir(probe_path):
+        if f.endswith('.undo.npz'):
+            undo_artifact_correction(pathlib.Path(probe_path, f.replace('.undo.npz', '.bin')))
 
-        # Generate new values and replace in-place
-        new_values = np.tile(ch_means, (1, 1, window_samples))
+    # Get ap-band binary data
+    ap_bin_filename = [f.replace('.cbin', '.bin') for f in os.listdir(probe_path)
+                       if ('ap.bin' in f or 'ap.cbin' in f) and 'corrected' not in f][0]  # also compressed
+    ap_meta_filename = [f for f in os.listdir(probe_path) if 'ap.meta' in f and 'corrected' not in f][0]
+    ap_bin_path = pathlib.Path(probe_path, ap_bin_filename)
+    ap_meta = readSGLX.readMetaInfo(pathlib.Path(probe_path, ap_meta_filename))
+    ap_meta_dict = ap_meta.raw
 
-        # Create a copy of the memmap file, if it does not exist
-        new_ap_file_name = ap_bin_filename.replace('tcat', 'tcat_corrected')
-        new_ap_file_path = pathlib.Path(probe_path, new_ap_file_name)
-        logger.info('Writing a corrected copy of the .ap.bin file.')
-        shutil.copyfile(ap_bin_path, new_ap_file_path)  # Always overwrite
+    # Create a copy of the meta file with the corrected name (needed by SpikeGLX to read the binary file)
+    new_meta_file_name = ap_meta_filename.replace('tcat', 'tcat_corrected')
+    new_meta_file_path = pathlib.Path(probe_path, new_meta_file_name)
+    with open(new_meta_file_path, 'w') as f:
+        for key, val in ap_meta_dict.items():
+            if key in ['imroTbl', 'muxTbl', 'snsChanMap', 'snsShankMap', 'snsGeomMap']:
+                f.write('~{}={}\n'.format(key, val))
+            else:
+                f.write('{}={}\n'.format(key, val))
 
-        data = np.memmap(new_ap_file_path, dtype=ap_raw_data.dtype, mode='r+', shape=ap_raw_data.shape, order='F')
+    # Artifact times aligned to probe timebase
+    syncperiod = config['tprime']['syncperiod']
+    tostream_probe_edges_file = '{}_tcat.imec{}.ap.xd_{}_6_500.txt'.format(run_name, probe_id, ap_meta.nSavedChans - 1)
+    schema = event_schema.load_event_schema(config.get('events'), run_name)
+    fromstream_edges_path = os.path.join(input_dir, epoch_name,
+                                         event_schema.event_file_name(run_name, schema[event_schema.SYNC_EVENT]))
+    whisker_stim_path = os.path.join(input_dir, epoch_name,
+                                     event_schema.event_file_name(run_name, schema['whisker_stim_times']))
+    aligned_stim_path = os.path.join(probe_path, 'whisker_stim_times_to_imec{}.txt'.format(probe_id))
 
-        for i in range(new_values.shape[1]):  # batch-process
-            idx = indices[i]  # Get index chunk
-            data[:, idx] = new_values[:, i]  # vectorized batch write
+    # Without NI events, only correct artifacts detected in the data
+    detect = config['artifact_correction'].get('detect', False)
+    if detect and not os.path.exists(whisker_stim_path):
+        logger.warning('No whisker stim times for IMEC probe {}, correcting detected artifacts only.'.format(probe_id))
+        artifact_times = np.zeros(0)
+    else:
+        logger.info('Syncing whisker artifact times to IMEC probe {} timebase.'.format(probe_id))
+        artifact_times = align_artifact_times(whisker_stim_path, fromstream_edges_path,
+                                              os.path.join(probe_path, tostream_probe_edges_file), aligned_stim_path,
+                                              syncperiod, config['tprime'])
 
-        data.flush()  # Ensures all writes are committed
-        del data  # Close memmap explicitly to avoid memory issues
-        logger.info('Artifact correction completed for probe {}.'.format(probe_id))
+    # Write the corrected .ap.bin file
+    new_ap_file_name = ap_bin_filename.replace('tcat', 'tcat_corrected')
+    new_ap_file_path = pathlib.Path(probe_path, new_ap_file_name)
+    correction_start_time = time.time()
+    wait_seconds = correct_artifacts(ap_bin_path, ap_meta, artifact_times, config['artifact_correction']['window_ms'],
+                                     new_ap_file_path, mode=correction_mode, write_lock=_WRITE_LOCK,
+                                     strategy=config['artifact_correction'].get('strategy', 'mean'),
+                                     strategy_params=config['artifact_correction'].get('strategy_params'),
+                                     qc=config['artifact_correction'].get('qc', False), detect=detect,
+                                     detect_params=config['artifact_correction'].get('detect_params'))
 
-    return
+    # Throughput of the correction, over the bytes read and written, without the wait for other writers
+    elapsed = max(time.time() - correction_start_time - wait_seconds, 1e-6)
+    megabytes = 2 * ap_meta.fileSizeBytes / 2 ** 20
+    logger.info('Artifact correction completed for probe {} in {:.1f} s ({:.1f} MB/s), {:.1f} s waiting for '
+                'other writers.'.format(probe_id, elapsed, megabytes / elapsed, wait_seconds))
+    return {'probe_id': probe_id, 'seconds': elapsed, 'wait_seconds': wait_seconds,
+            'total_seconds': time.time() - start_time, 'megabytes': megabytes, 'mb_per_s': megabytes / elapsed}
+
+
+def main(input_dir, config):
+    """
+    Run artifact correction on CatGT-processed ephys data using TPrime-aligned artifact times.
+    This aligns artifact times to probe timebase (natively, or with TPrime if tprime.engine is 'tprime'), and then replaces the artifact times with
+    the mean of the data just before the artifact times.
+    This reduces saturation/neuron-like/extra-filtering artifacts in the data, and is beneficial before spike sorting.
+    Probes are corrected in parallel with artifact_correction.n_workers processes, with at most
+    artifact_correction.max_writers of them writing to disk at the same time. If any probe fails, a RuntimeError is
+    raised once the other probes are done, as in the serial case.
+    :param input_dir:
+    :param config:
+    :return: (list) per-probe duration and throughput
+    """
+
+    epoch_name = os.listdir(input_dir)[0]
+    probe_folders = [f for f in os.listdir(os.path.join(input_dir, epoch_name)) if 'imec' in f]
+
+    probe_folders_to_correct = []
+    for probe_folder in probe_folders:
+        probe_id = int(probe_folder.split('imec')[-1])
+
+        # Check if probe recording is valid
+        mouse_id = epoch_name.split('_')[1]
+        if not check_if_valid_recording(config, mouse_id, probe_id):
+            continue
+
+        probe_folders_to_correct.append(probe_folder)
+
+    # Correct probes in parallel, with a limit on the number of concurrent disk writers
+    n_workers = min(config['artifact_correction'].get('n_workers', 1), max(len(probe_folders_to_correct), 1))
+    max_writers = config['artifact_correction'].get('max_writers', 1)
+    start_time = time.time()
+    results = []
+    if n_workers > 1:
+        logger.info('Correcting {} probes with {} workers and at most {} concurrent writers.'.format(
+            len(probe_folders_to_correct), n_workers, max_writers))
+        ctx = multiprocessing.get_context('spawn')
+        write_lock = ctx.BoundedSemaphore(max_writers)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=(write_lock,)) as executor:
+            futures = {executor.submit(correct_probe, input_dir, epoch_name, probe_folder, config): probe_folder
+                       for probe_folder in probe_folders_to_correct}
+            failed = {}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error('Artifact correction failed for {}: {}'.format(futures[future], e))
+                    failed[futures[future]] = e
+        if failed:
+            raise RuntimeError('Artifact correction failed for {} probe(s): {}'.format(
+                len(failed), '; '.join('{}: {}'.format(name, e) for name, e in sorted(failed.items()))))
+    else:
+        for probe_folder in probe_folders_to_correct:
+            results.append(correct_probe(input_dir, epoch_name, probe_folder, config))
+
+    # Report per-probe throughput
+    for res in sorted(results, key=lambda r: r['probe_id']):
+        logger.info('Probe {}: {:.1f} s in total, correction {:.1f} s for {:.0f} MB read/written ({:.1f} MB/s), '
+                    '{:.1f} s waiting for other writers.'.format(res['probe_id'], res['total_seconds'], res['seconds'],
+                                                                 res['megabytes'], res['mb_per_s'],
+                                                                 res['wait_seconds']))
+    logger.info('Artifact correction of {} probes took {:.1f} s.'.format(len(results), time.time() - start_time))
+
+    return results
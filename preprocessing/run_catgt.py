@@ -9,21 +9,162 @@
 
 # Imports
 import os
+import re
 import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import time
+import datetime
 import subprocess
 from utils.ephys_utils import flatten_list
-import webbrowser
 from loguru import logger
 
-def main(input_dir, output_dir, config):
+from utils import event_schema
+import run_event_extraction
+
+# CatGT log line: [Thd <thread> CPU <cpu> <MM/DD/YY HH:MM:SS.mmm>] <message>
+_LOG_LINE = re.compile(r'^\[Thd \d+ CPU \d+ (\d\d/\d\d/\d\d \d\d:\d\d:\d\d(?:\.\d+)?)\]\s*(.*)$')
+# Durations reported in a message, e.g. 'Pass 1 took 12.3 s' or 'Run time: 45.6 seconds'
+_LOG_DURATION = re.compile(r'^(.*?)[\s:=]+(\d+(?:\.\d+)?)\s*(?:s|sec|secs|seconds)\b', re.IGNORECASE)
+
+
+def parse_catgt_log(log_path):
+    """
+    Parse a CatGT log file into structured timings: start and end of the run from the line timestamps, durations
+    reported by CatGT, and error and warning lines.
+    :param log_path: path to CatGT.log
+    :return: (dict) start, end (ISO format), elapsed_s, durations (list of (label, seconds)), errors and warnings
+    """
+    timestamps, durations, errors, warnings = [], [], [], []
+    with open(log_path, 'r', errors='replace') as f:
+        for line in f:
+            match = _LOG_LINE.match(line.strip())
+            message = match.group(2) if match else line.strip()
+            if match:
+                timestamps.append(datetime.datetime.strptime(match.group(1).split('.')[0], '%m/%d/%y %H:%M:%S'))
+            duration = _LOG_DURATION.match(message)
+            if duration:
+                durations.append((duration.group(1).strip(), float(duration.group(2))))
+            if 'error' in message.lower():
+                errors.append(message)
+            elif 'warning' in message.lower():
+                warnings.append(message)
+
+    return {'start': timestamps[0].isoformat() if timestamps else None,
+            'end': timestamps[-1].isoformat() if timestamps else None,
+            'elapsed_s': (timestamps[-1] - timestamps[0]).total_seconds() if timestamps else None,
+            'durations': durations,
+            'errors': errors,
+            'warnings': warnings}
+
+
+class DiskRate:
+    """
+    System-wide disk throughput (read + write) since the previous call, from psutil if it is installed.
+    """
+
+    def __init__(self):
+        try:
+            import psutil
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+        self._last = self._sample()
+
+    def _sample(self):
+        if self._psutil is None:
+            return None
+        counters = self._psutil.disk_io_counters()
+        return time.time(), counters.read_bytes + counters.write_bytes
+
+    def rate(self):
+        """Disk throughput in MB/s since the previous call, or None without psutil."""
+        sample = self._sample()
+        if sample is None:
+            return None
+        (last_time, last_bytes), self._last = self._last, sample
+        return (sample[1] - last_bytes) / 2 ** 20 / max(sample[0] - last_time, 1e-3)
+
+
+def run_catgt_jobs(jobs, catgt_path, log_dir, max_jobs=1, max_disk_mb_s=None, job_mb_s=200., poll_s=0.5):
+    """
+    Run CatGT jobs in parallel, each in its own folder so that their CatGT.log files are kept apart.
+    A job is started when fewer than max_jobs run and, with max_disk_mb_s, when the current disk throughput plus that
+    expected of one more job stays under the cap. The throughput expected of a job is the mean of the finished jobs,
+    else job_mb_s. Without psutil, the current disk throughput is estimated as job_mb_s per running job.
+    :param jobs: list of (name, CatGT arguments, megabytes of input data)
+    :param catgt_path: path to CatGT installation
+    :param log_dir: folder of the job folders
+    :param max_jobs: maximum number of jobs running at the same time
+    :param max_disk_mb_s: disk throughput cap in MB/s (read + write), None for no cap
+    :param job_mb_s: expected disk throughput of one job in MB/s, before any has finished
+    :param poll_s: interval between checks of the running jobs, in s
+    :return: (dict) job name to returncode, seconds, megabytes, mb_per_s and parsed log (see parse_catgt_log)
+    """
+    executable = os.path.join(catgt_path, 'CatGT')
+    disk_rate = DiskRate()
+    pending = list(jobs)
+    running = {}
+    results = {}
+    while pending or running:
+
+        # Collect finished jobs
+        for name, (process, start_time, megabytes, job_dir, out_file) in list(running.items()):
+            if process.poll() is None:
+                continue
+            out_file.close()
+            seconds = time.time() - start_time
+            log_path = os.path.join(job_dir, 'CatGT.log')
+            results[name] = {'returncode': process.returncode,
+                             'seconds': seconds,
+                             'megabytes': megabytes,
+                             'mb_per_s': 2 * megabytes / seconds,  # read and written
+                             'log': parse_catgt_log(log_path) if os.path.exists(log_path) else None}
+            logger.info('CatGT job {} finished with exit code {} in {:.1f} s ({:.1f} MB/s).'.format(
+                name, process.returncode, seconds, results[name]['mb_per_s']))
+            del running[name]
+
+        # Start jobs within the concurrency and disk throughput caps
+        current_mb_s = disk_rate.rate()
+        while pending and len(running) < max_jobs:
+            if max_disk_mb_s and running:
+                finished = [res['mb_per_s'] for res in results.values()]
+                expected_mb_s = sum(finished) / len(finished) if finished else job_mb_s
+                load_mb_s = current_mb_s if current_mb_s is not None else job_mb_s * len(running)
+                if load_mb_s + expected_mb_s > max_disk_mb_s:
+                    break
+            name, args, megabytes = pending.pop(0)
+            job_dir = os.path.join(log_dir, name)
+            os.makedirs(job_dir, exist_ok=True)
+            command = [executable] + list(flatten_list(args))
+            logger.info('CatGT job {} will run: {}'.format(name, command))
+            out_file = open(os.path.join(job_dir, 'CatGT.out'), 'w')
+            process = subprocess.Popen(command, shell=True, cwd=job_dir, stdout=out_file, stderr=subprocess.STDOUT)
+            running[name] = (process, time.time(), megabytes, job_dir, out_file)
+            current_mb_s = None if current_mb_s is None else current_mb_s + job_mb_s
+
+        if running:
+            time.sleep(poll_s)
+    return results
+
+
+def main(input_dir, output_dir, config, events=None, gblcar=True):
     """
     Run CatGT on raw ephys data and save to output directory.
+    With config parallel, one CatGT job per probe and one for the NI stream run in parallel (see run_catgt_jobs),
+    otherwise a single job processes all streams. Job timings are saved to catgt_jobs.json in the epoch folder.
+    NI events are extracted from the event schema, by CatGT or in Python from the CatGT nidq.bin file (config engine).
+    If the probes were already processed, only the events that are missing or whose parameters changed are extracted
+    again, without a CatGT pass in Python or in a CatGT pass on the NI stream only.
     :param input_dir: path to raw ephys data
+    :param output_dir: path to processed ephys data
     :param config: config dict
+    :param events: config events section, see event_schema.load_event_schema
+    :param gblcar: apply CatGT global common median referencing, else see run_common_reference
     :return:
+    :raises RuntimeError: if a CatGT job exits with a non-zero code
     """
 
     # Get epoch number and run name
@@ -31,50 +172,93 @@ def main(input_dir, output_dir, config):
     epoch_number = epoch_name[-1]
     run_name = epoch_name[0:-3]
 
-    # Write CatGT command line
-    command = ['CatGT',
-               '-dir={}'.format(input_dir),
-               '-run={}'.format(run_name),
-               '-prb_fld',
-               '-prb_miss_ok',
-               '-g={}'.format(epoch_number),
-               '-t=0,0',
-               '-t_miss_ok',
-               '-startsecs=0.0',
-               #'-maxsecs=2998.0',    # TODO: remove (for supercat)
-               #'-pass1_force_ni_ob_bin',# TODO: remove (for supercat)
-               '-ni',
-               '-lf',
-               '-ap',
-               '-prb=0:5',
-               '-xa=0,0,0,1,0,0',               # Square wave pulse from IMEC slot (on by default)
-               '-xa=0,0,1,4,0,0',               # Trial start
-               '-xa=0,0,2,1,1,0',               # Auditory stimulus (does not work)
-               '-xa=0,0,3,1,1,0',               # Whisker stimulus
-               #'-xa=0,0,4,2,0,0',               # Valve opening #TODO: for AB mice
-               #'-xa=0,0,4,2,0,0',               # Context transition TTL epoch start #TODO: PB mice
-               #'-xia=0,0,4,2,0,0',               # Context transition TTL epoch end#TODO: PB mice
-               '-xa=0,0,5,2,0,0',               # Behaviour camera 0 frame times
-               '-xa=0,0,6,2,0,0',               # Behaviour camera 1 frame times
-               '-xa=0,0,7,0.005,0.010,0',       # Piezo lick sensor
-               '-gblcar',                       # global common median referencing (default), never applied to LFP
-               '-dest={}'.format(output_dir),
-               '-out_prb_fld'
-               ]
-    if epoch_name.startswith('AB'):
-        command.append(['-xa=0,0,4,2,0,0']) # valve opening times
-    elif epoch_name.startswith('PB'):
-        command.append(['-xa=0,0,4,2,0,0',  # context transition TTL epoch start
-                        '-xia=0,0,4,2,0,0']) # context transition TTL epoch end
-
-
-
-    logger.info('CatGT command line will run: {}'.format(list(flatten_list(command))))
-
-    logger.info('Running CatGT on {}.'.format(epoch_name))
-    subprocess.run(list(flatten_list(command)), shell=True, cwd=config['catgt_path'])
-
-    logger.info('Opening CatGT log file at: {}'.format(os.path.join(config['catgt_path'], 'CatGT.log')))
-    webbrowser.open(os.path.join(config['catgt_path'], 'CatGT.log'))
+    # Events to extract, and whether probes were already processed
+    schema = event_schema.load_event_schema(events, epoch_name)
+    catgt_dir = os.path.join(output_dir, 'catgt_{}'.format(epoch_name))
+    manifest_path = os.path.join(catgt_dir, event_schema.EXTRACTION_MANIFEST)
+    probes_done = os.path.isdir(catgt_dir) and any(
+        f.endswith('.ap.bin') for probe_folder in os.listdir(catgt_dir) if 'imec' in probe_folder
+        for f in os.listdir(os.path.join(catgt_dir, probe_folder)))
+    event_names = event_schema.changed_events(schema, manifest_path, catgt_dir, epoch_name)
+    if probes_done and not event_names:
+        logger.info('CatGT outputs of {} are up to date, skipping CatGT.'.format(epoch_name))
+        return
+    engine = config.get('engine', 'catgt')
+    if probes_done and engine == 'python':
+        logger.info('Probes of {} already processed, extracting NI events only.'.format(epoch_name))
+        run_event_extraction.extract_session_events(catgt_dir, epoch_name, schema, event_names,
+                                                    chunk_samples=config.get('chunk_samples', 1048576))
+        return
+
+    # Write CatGT command lines
+    common_args = ['-dir={}'.format(input_dir),
+                   '-run={}'.format(run_name),
+                   '-g={}'.format(epoch_number),
+                   '-t=0,0',
+                   '-t_miss_ok',
+                   '-startsecs=0.0',
+                   #'-maxsecs=2998.0',    # TODO: remove (for supercat)
+                   #'-pass1_force_ni_ob_bin',# TODO: remove (for supercat)
+                   '-dest={}'.format(output_dir),
+                   ]
+    if probes_done:
+        logger.info('Probes of {} already processed, extracting NI events only.'.format(epoch_name))
+    else:
+        event_names = list(schema)
+    if engine == 'python':
+        event_names = []  # extracted from the CatGT nidq.bin file below
+    ni_args = ['-ni'] + [event_schema.catgt_arg(schema[name]) for name in event_names]
+
+    def probe_args(probe_list):
+        args = ['-prb_fld', '-prb_miss_ok', '-lf', '-ap', '-prb={}'.format(probe_list), '-out_prb_fld']
+        if gblcar:
+            args.append('-gblcar')   # global common median referencing (default), never applied to LFP
+        return args
+
+    # Input data of each stream, in MB
+    epoch_path = os.path.join(input_dir, epoch_name)
+    ni_megabytes = sum(os.path.getsize(os.path.join(epoch_path, f)) for f in os.listdir(epoch_path)
+                       if f.endswith('.nidq.bin')) / 2 ** 20
+    probe_megabytes = {}
+    for probe_folder in [f for f in os.listdir(epoch_path) if '_imec' in f]:
+        probe_path = os.path.join(epoch_path, probe_folder)
+        probe_megabytes[int(probe_folder.split('imec')[-1])] = sum(
+            os.path.getsize(os.path.join(probe_path, f)) for f in os.listdir(probe_path) if f.endswith('.bin')) / 2 ** 20
+
+    if probes_done:
+        jobs = [('nidq', common_args + ni_args, ni_megabytes)]
+    elif config.get('parallel', False):
+        jobs = [('nidq', common_args + ni_args, ni_megabytes)]
+        jobs.extend([('imec{}'.format(probe_id), common_args + probe_args(probe_id), megabytes)
+                     for probe_id, megabytes in sorted(probe_megabytes.items())])
+    else:
+        jobs = [('all', common_args + ni_args + probe_args('0:5'), ni_megabytes + sum(probe_megabytes.values()))]
+
+    logger.info('Running CatGT on {} ({} job(s)).'.format(epoch_name, len(jobs)))
+    start_time = time.time()
+    os.makedirs(catgt_dir, exist_ok=True)
+    results = run_catgt_jobs(jobs, config['catgt_path'], os.path.join(catgt_dir, 'catgt_logs'),
+                             max_jobs=config.get('max_jobs', 1) if len(jobs) > 1 else 1,
+                             max_disk_mb_s=config.get('max_disk_mb_s'),
+                             job_mb_s=config.get('job_mb_s', 200.))
+    with open(os.path.join(catgt_dir, 'catgt_jobs.json'), 'w') as f:
+        json.dump({'seconds': time.time() - start_time, 'jobs': results}, f, indent=2)
+    logger.info('CatGT logs and timings in {}.'.format(os.path.join(catgt_dir, 'catgt_logs')))
+
+    failed = {name: res['returncode'] for name, res in results.items() if res['returncode'] != 0}
+    if failed:
+        raise RuntimeError('CatGT failed on {}: {} (job: exit code), see {}.'.format(
+            epoch_name, failed, os.path.join(catgt_dir, 'catgt_logs')))
+    logger.info('CatGT on {} took {:.1f} s.'.format(epoch_name, time.time() - start_time))
+
+    if engine == 'python':
+        run_event_extraction.extract_session_events(catgt_dir, epoch_name, schema,
+                                                    chunk_samples=config.get('chunk_samples', 1048576))
+        return
+
+    # Record the parameters of the extracted events
+    event_schema.update_manifest(manifest_path, {name: event_schema.spec_key(schema[name]) for name in event_names
+                                                 if os.path.exists(os.path.join(
+                                                     catgt_dir, event_schema.event_file_name(epoch_name, schema[name])))})
 
     return
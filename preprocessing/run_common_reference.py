@@ -0,0 +1,124 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: EphysUtils
+@file: run_common_reference.py
+@time: 10/16/2026 8:10 PM
+@description: Common median referencing, optionally after a high-pass filter, of the raw AP files of each probe into
+the CatGT output files, in place of CatGT -gblcar, so that changing these options does not require a new CatGT pass.
+"""
+
+# Imports
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import pathlib
+import yaml
+from loguru import logger
+
+from utils import readSGLX
+from utils import common_reference
+
+
+def common_reference_params(config):
+    """
+    Parameters of the stage that change its output. By default, no filter is applied, as CatGT -gblcar only
+    re-references the data.
+    :param config: common_reference config dict
+    :return: (dict)
+    """
+    return {'reference': config.get('reference', 'median'),
+            'highpass_hz': config.get('highpass_hz'),
+            'order': config.get('order', 3)}
+
+
+def common_reference_manifest_path(ap_bin_path):
+    """
+    Path of the record of the filter and reference applied to an .ap.bin file.
+    :param ap_bin_path: path to .ap.bin file
+    :return: (Path)
+    """
+    ap_bin_path = pathlib.Path(ap_bin_path)
+    return ap_bin_path.with_name(ap_bin_path.stem + '.car.yaml')
+
+
+def reference_probe(raw_bin_path, output_bin_path, config):
+    """
+    Filter and re-reference the raw AP file of one probe into the CatGT output file, through a temporary file.
+    :param raw_bin_path: path to the raw SpikeGLX .ap.bin file (or compressed)
+    :param output_bin_path: path to the CatGT .ap.bin file, replaced
+    :param config: common_reference config dict
+    :return: (float) throughput in MB/s
+    """
+    raw_meta = readSGLX.readMetaInfo(raw_bin_path)
+    output_meta = readSGLX.readMetaInfo(output_bin_path)
+    if raw_meta.nFileSamp != output_meta.nFileSamp or raw_meta.nSavedChans != output_meta.nSavedChans:
+        raise ValueError('{} ({} samples, {} channels) does not match the CatGT output {} ({} samples, {} channels).'
+                         .format(raw_bin_path.name, raw_meta.nFileSamp, raw_meta.nSavedChans, output_bin_path.name,
+                                 output_meta.nFileSamp, output_meta.nSavedChans))
+
+    params = common_reference_params(config)
+    sos = common_reference.highpass_sos(raw_meta.sampRate, params['highpass_hz'], params['order'])
+    chunk_samples = int(config.get('chunk_s', 1.) * raw_meta.sampRate)
+    overlap_samples = int(config.get('overlap_ms', 100.) * raw_meta.sampRate / 1000)
+
+    start_time = time.time()
+    chunks = readSGLX.StreamChunks(raw_bin_path, raw_meta.raw, chunk_samples, overlapSamp=overlap_samples)
+    tmp_path = output_bin_path.with_name(output_bin_path.name + '.tmp')
+    n_samples = common_reference.write_filtered(chunks, tmp_path, n_neural=raw_meta.chanCounts[0], sos=sos,
+                                                reference=params['reference'],
+                                                n_workers=config.get('n_workers', 4))
+    if n_samples != raw_meta.nFileSamp:
+        os.remove(tmp_path)
+        raise ValueError('Wrote {} samples out of {} for {}.'.format(n_samples, raw_meta.nFileSamp, raw_bin_path))
+    os.replace(tmp_path, output_bin_path)
+
+    with open(common_reference_manifest_path(output_bin_path), 'w') as f:
+        yaml.safe_dump(dict(params, source=str(raw_bin_path), date=time.strftime('%Y-%m-%d %H:%M:%S')), f,
+                       sort_keys=False)
+    return 2 * output_meta.fileSizeBytes / 2 ** 20 / (time.time() - start_time)
+
+
+def main(input_dir, output_dir, config):
+    """
+    Filter and re-reference the raw AP file of each probe into the CatGT output files, unless they already were
+    with the same parameters. Artifact correction must be run again on re-referenced files.
+    :param input_dir: path to raw ephys data
+    :param output_dir: path to processed ephys data
+    :param config: common_reference config dict
+    :return:
+    """
+    epoch_name = [f for f in os.listdir(input_dir) if '_g' in f][0]
+    catgt_dir = os.path.join(output_dir, 'catgt_{}'.format(epoch_name))
+    params = common_reference_params(config)
+    probe_folders = [f for f in os.listdir(catgt_dir) if 'imec' in f]
+
+    for probe_folder in probe_folders:
+        probe_path = os.path.join(catgt_dir, probe_folder)
+        output_bin_path = pathlib.Path(probe_path, [f for f in os.listdir(probe_path)
+                                                    if f.endswith('.ap.bin') and 'corrected' not in f][0])
+
+        # Skip files already filtered and re-referenced with the same parameters
+        manifest_path = common_reference_manifest_path(output_bin_path)
+        if manifest_path.exists():
+            with open(manifest_path, 'r') as f:
+                applied = yaml.safe_load(f)
+            if all(applied.get(key) == val for key, val in params.items()):
+                logger.info('{} already re-referenced with {}, skipping.'.format(output_bin_path.name, params))
+                continue
+
+        # Raw SpikeGLX file of the probe, also compressed
+        raw_probe_path = os.path.join(input_dir, epoch_name, probe_folder)
+        raw_bin_path = pathlib.Path(raw_probe_path, [f.replace('.cbin', '.bin') for f in os.listdir(raw_probe_path)
+                                                     if f.endswith('.ap.bin') or f.endswith('.ap.cbin')][0])
+
+        logger.info('Re-referencing {} into {} with {}.'.format(raw_bin_path.name, output_bin_path.name, params))
+        mb_per_s = reference_probe(raw_bin_path, output_bin_path, config)
+        logger.info('Re-referenced {} ({:.1f} MB/s).'.format(output_bin_path.name, mb_per_s))
+        if any('corrected' in f for f in os.listdir(probe_path)):
+            logger.warning('{} was re-referenced: run artifact correction again.'.format(output_bin_path.name))
+
+    return
@@ -0,0 +1,107 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: EphysUtils
+@file: run_event_extraction.py
+@time: 10/16/2026 7:15 PM
+@description: Extract NI event times from the CatGT nidq.bin file in one pass over all channels of the event schema,
+with the -xa/-xia semantics of CatGT, without the CatGT executable.
+"""
+
+# Imports
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import pathlib
+import numpy as np
+from loguru import logger
+
+from utils import readSGLX
+from utils import event_schema
+
+
+def extract_events(nidq_bin_path, schema, event_names=None, chunk_samples=1048576, tolerance=0.2):
+    """
+    Extract event times from an NI binary file, reading it once for all events.
+    :param nidq_bin_path: path to nidq.bin file
+    :param schema: (dict) event name to parameters, see event_schema.load_event_schema
+    :param event_names: (list) events to extract, default all events of the schema
+    :param chunk_samples: number of samples read at once
+    :param tolerance: relative tolerance on the pulse duration of events with ms > 0
+    :return: (dict) event name to event times in s
+    """
+    nidq_bin_path = pathlib.Path(nidq_bin_path)
+    meta = readSGLX.readMetaInfo(nidq_bin_path)
+    if event_names is None:
+        event_names = list(schema)
+    for name in event_names:
+        if schema[name]['word'] >= meta.nSavedChans:
+            raise ValueError('Event {}: channel {} not in {} ({} saved channels).'.format(
+                name, schema[name]['word'], nidq_bin_path.name, meta.nSavedChans))
+
+    pulse_specs = [(schema[name]['word'], schema[name]['thresh1'], schema[name]['thresh2'], schema[name]['ms'],
+                    schema[name]['kind'] == 'xia') for name in event_names]
+    pulse_times = readSGLX.ExtractAnalogPulses(nidq_bin_path, meta.raw, pulse_specs, chunkSamp=chunk_samples,
+                                               tolerance=tolerance)
+    return dict(zip(event_names, pulse_times))
+
+
+def extract_session_events(catgt_dir, run_name, schema, event_names=None, chunk_samples=1048576):
+    """
+    Extract event times of a session and write them to the files CatGT would write, then record their parameters
+    in the extraction manifest.
+    :param catgt_dir: path to the catgt_ epoch folder
+    :param run_name: run name with gate index, e.g. MOUSENAME_gX
+    :param schema: (dict) event name to parameters, see event_schema.load_event_schema
+    :param event_names: (list) events to extract, default all events of the schema
+    :param chunk_samples: number of samples read at once
+    :return: (dict) event name to event times in s
+    """
+    nidq_bin_path = pathlib.Path(catgt_dir, '{}_tcat.nidq.bin'.format(run_name))
+    if event_names is None:
+        event_names = list(schema)
+
+    start_time = time.time()
+    event_times = extract_events(nidq_bin_path, schema, event_names, chunk_samples)
+    for name, times in event_times.items():
+        np.savetxt(os.path.join(catgt_dir, event_schema.event_file_name(run_name, schema[name])), times, fmt='%.6f')
+        logger.info('Event {} ({}): {} pulses.'.format(name, event_schema.event_suffix(schema[name]), times.size))
+
+    megabytes = nidq_bin_path.stat().st_size / 2 ** 20
+    elapsed = time.time() - start_time
+    logger.info('Extracted {} events from {} in {:.1f} s ({:.1f} MB/s).'.format(
+        len(event_times), nidq_bin_path.name, elapsed, megabytes / max(elapsed, 1e-6)))
+
+    event_schema.update_manifest(os.path.join(catgt_dir, event_schema.EXTRACTION_MANIFEST),
+                                 {name: event_schema.spec_key(schema[name]) for name in event_names})
+    return event_times
+
+
+def main(input_dir, config, events=None, overwrite=False):
+    """
+    Extract the NI events of the event schema from CatGT-processed data, only those missing or whose parameters
+    changed since they were extracted unless overwrite is set.
+    :param input_dir: path to CatGT-processed ephys data
+    :param config: catgt config dict
+    :param events: config events section, see event_schema.load_event_schema
+    :param overwrite: extract all events again
+    :return: (dict) event name to event times in s
+    """
+    epoch_name = [f for f in os.listdir(input_dir) if f.startswith('catgt_')][0]
+    run_name = epoch_name[6:]  # MOUSENAME_gX
+    catgt_dir = os.path.join(input_dir, epoch_name)
+
+    schema = event_schema.load_event_schema(events, run_name)
+    if overwrite:
+        event_names = list(schema)
+    else:
+        event_names = event_schema.changed_events(schema, os.path.join(catgt_dir, event_schema.EXTRACTION_MANIFEST),
+                                                  catgt_dir, run_name)
+    if not event_names:
+        logger.info('NI events of {} are up to date.'.format(run_name))
+        return {}
+    return extract_session_events(catgt_dir, run_name, schema, event_names,
+                                  chunk_samples=config.get('chunk_samples', 1048576))
@@ -47,8 +47,8 @@ def main(input_dir, config):
         pathlib.Path(os.path.join(probe_path, 'kilosort2')).mkdir(parents=True, exist_ok=True)
 
         meta_file_name = [f for f in os.listdir(probe_path) if 'ap.meta' in f][0]
-        ap_meta_config = readSGLX.readMeta(pathlib.Path(probe_path, meta_file_name))
-        fs = float(ap_meta_config['imSampRate'])
+        ap_meta = readSGLX.readMetaInfo(pathlib.Path(probe_path, meta_file_name))
+        fs = ap_meta.sampRate
 
         # Start MATLAB engine
         sys.path.append(config['kilosort']['matlab_path'])
@@ -422,9 +422,9 @@ def main(input_dir, config):
                                      '{}_tcat.imec{}.lf.meta'.format(epoch_name, probe_id))  # for LFP info
 
         # Get LFP metadata
-        lfp_meta = readSGLX.readMeta(Path(lfp_meta_file))
-        num_channels = int(lfp_meta['nSavedChans'])
-        lfp_sample_rate = float(lfp_meta['imSampRate'])
+        lfp_meta = readSGLX.readMetaInfo(Path(lfp_meta_file))
+        num_channels = lfp_meta.nSavedChans
+        lfp_sample_rate = lfp_meta.sampRate
         reference_channels = [191]  # default for Neuropixels 1.0 probes
         ephys_params = {
             'num_channels': num_channels,
@@ -432,10 +432,11 @@ def main(input_dir, config):
             'reference_channels': reference_channels
         }
 
-        # Load LFP band data and reshape
-        lfp_data_file = os.path.join(path_to_probe_folder, '{}_tcat.imec{}.lf.bin'.format(epoch_name, probe_id))
-        raw_data_lfp = np.memmap(lfp_data_file, dtype='int16', mode='r')
-        lfp_data = np.reshape(raw_data_lfp, (int(raw_data_lfp.size / num_channels), num_channels))
+        # Load LFP band data as (N samples x M channels), optionally from a channel-major copy
+        lfp_data_file = Path(path_to_probe_folder, '{}_tcat.imec{}.lf.bin'.format(epoch_name, probe_id))
+        raw_data_lfp = readSGLX.makeMemMapBest(lfp_data_file, lfp_meta.raw, access='channel',
+                                               makeCopy=config.get('lfp_analysis', {}).get('chan_major_cache', False))
+        lfp_data = raw_data_lfp.T
 
         # Get probe channel coordinates
         coords = MetaToCoords(metaFullPath=Path(ap_meta_file),
@@ -47,8 +47,8 @@ def main(input_dir):
         # Get sampling rate
         metafile_name = '{}_tcat.imec{}.ap.meta'.format(epoch_name, probe_id)
         apbin_metafile_path = os.path.join(input_dir, probe_folder, metafile_name)
-        ap_meta_dict = readSGLX.readMeta(pathlib.Path(apbin_metafile_path))
-        imSampRate = float(ap_meta_dict['imSampRate'])  # probe-specific
+        ap_meta = readSGLX.readMetaInfo(pathlib.Path(apbin_metafile_path))
+        imSampRate = ap_meta.sampRate  # probe-specific
 
         # Load mean waveform data from C_waves
         path_mean_waveforms = os.path.join(path_cwave_output, 'mean_waveforms.npy')
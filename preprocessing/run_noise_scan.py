@@ -0,0 +1,238 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: EphysUtils
+@file: run_noise_scan.py
+@time: 10/16/2026 5:10 PM
+@description: Scan corrected .ap.bin files for noisy epochs, and propose timespans to zero-out with OverStrike.
+"""
+
+# Imports
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import pathlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import yaml
+from loguru import logger
+from utils.ephys_utils import check_if_valid_recording
+
+# Import readers
+from utils import readSGLX
+
+
+def scan_seconds(ap_bin_path, first_second, last_second, line_freq=50., line_max_hz=1000., rms_stride=2):
+    """
+    Noise metrics of each second of an .ap.bin file, per channel: robust RMS (interquartile range / 1.349) and
+    fraction of the power in the harmonics of the line frequency.
+    :param ap_bin_path: path to .ap.bin file
+    :param first_second: first second to scan
+    :param last_second: last second to scan, excluded
+    :param line_freq: line frequency in Hz
+    :param line_max_hz: highest harmonic of the line frequency included, in Hz
+    :param rms_stride: the robust RMS is computed on every rms_stride-th sample
+    :return: (tuple) robust RMS and line-noise fraction (channels x seconds)
+    """
+    ap_bin_path = pathlib.Path(ap_bin_path)
+    meta = readSGLX.readMetaInfo(ap_bin_path)
+    raw_data = readSGLX.openRaw(ap_bin_path, meta.raw)
+    fs = meta.sampRate
+    n_chans = readSGLX.ChannelCountsIM(meta.raw)[0] if meta.isImec else meta.nSavedChans  # without sync channel
+
+    # Projection basis on the line-noise harmonics of a 1-second segment
+    n_second = int(round(fs))
+    harmonics = np.arange(line_freq, min(line_max_hz, fs / 2) + 1, line_freq)
+    phase = 2 * np.pi * np.outer(np.arange(n_second) / fs, harmonics)
+    basis = np.concatenate([np.cos(phase), np.sin(phase)], axis=1).astype('float32')
+
+    n_seconds = last_second - first_second
+    rms = np.zeros((n_chans, n_seconds), dtype='float32')
+    line_fraction = np.zeros((n_chans, n_seconds), dtype='float32')
+    for i, second in enumerate(range(first_second, last_second)):
+        start = int(round(second * fs))
+        stop = min(start + n_second, raw_data.shape[1])
+        segment = np.asarray(raw_data[:n_chans, start:stop])
+        n = segment.shape[1]
+        if n < 2:
+            continue
+
+        # Robust RMS from the interquartile range, on a subsample of the second
+        subsample = np.ascontiguousarray(segment[:, ::rms_stride])
+        q = [subsample.shape[1] // 4, 3 * subsample.shape[1] // 4]
+        quartiles = np.partition(subsample, q, axis=1)[:, q].astype('float32')
+        rms[:, i] = (quartiles[:, 1] - quartiles[:, 0]) / 1.349
+
+        # Line-noise power from the projection on the harmonics, relative to the total power (Parseval)
+        segment = segment.astype('float32')
+        segment -= segment.mean(axis=1, keepdims=True)
+        projection = segment @ basis[:n]
+        total_power = np.einsum('ij,ij->i', segment, segment)
+        line_power = 2 * (projection ** 2).sum(axis=1) / n
+        line_fraction[:, i] = line_power / np.maximum(total_power, 1)
+
+    if hasattr(raw_data, 'close'):
+        raw_data.close()
+    return rms, line_fraction
+
+
+def flag_noisy_epochs(rms, line_fraction, rms_factor=3., line_fraction_max=0.5, merge_gap_s=2, pad_s=1,
+                      min_duration_s=1):
+    """
+    Flag noisy seconds and merge them into timespans. A second is noisy if the median over channels of its RMS,
+    relative to each channel's median RMS over the recording, exceeds rms_factor, or if the median over channels
+    of its line-noise fraction exceeds line_fraction_max.
+    :param rms: (np.ndarray) robust RMS (channels x seconds)
+    :param line_fraction: (np.ndarray) line-noise fraction (channels x seconds)
+    :param rms_factor: threshold on the relative RMS
+    :param line_fraction_max: threshold on the line-noise fraction
+    :param merge_gap_s: noisy epochs separated by at most merge_gap_s seconds are merged
+    :param pad_s: seconds added before and after each epoch
+    :param min_duration_s: epochs shorter than min_duration_s seconds (before padding) are dropped
+    :return: (list) (start, end) timespans in seconds
+    """
+    n_seconds = rms.shape[1]
+    baseline = np.median(rms, axis=1, keepdims=True)
+    relative_rms = np.median(rms / np.maximum(baseline, 1e-6), axis=0)
+    noisy = (relative_rms > rms_factor) | (np.median(line_fraction, axis=0) > line_fraction_max)
+
+    timespans = []
+    edges = np.diff(noisy.astype('int8'), prepend=0, append=0)
+    for start, end in zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)):
+        if timespans and start - timespans[-1][1] <= merge_gap_s:
+            timespans[-1] = (timespans[-1][0], int(end))
+        else:
+            timespans.append((int(start), int(end)))
+    return [(max(start - pad_s, 0), min(end + pad_s, n_seconds)) for start, end in timespans
+            if end - start >= min_duration_s]
+
+
+def noise_timespans_path(input_dir):
+    """
+    Path of the proposed timespans to zero-out, in the catgt_ epoch folder.
+    :param input_dir: path to CatGT-processed ephys data
+    :return: (str)
+    """
+    epoch_name = [f for f in os.listdir(input_dir) if f.startswith('catgt_')][0]
+    return os.path.join(input_dir, epoch_name, 'noise_timespans.yaml')
+
+
+def load_noise_timespans(input_dir):
+    """
+    Load proposed timespans, as accepted by run_overstrike.main.
+    :param input_dir: path to CatGT-processed ephys data
+    :return: (dict) probe id to list of (start, end) tuples in seconds
+    """
+    with open(noise_timespans_path(input_dir), 'r') as f:
+        timespans = yaml.safe_load(f) or {}
+    return {int(probe_id): [tuple(span) for span in spans] for probe_id, spans in timespans.items()}
+
+
+def merge_timespans(timespans, extra_timespans):
+    """
+    Union of two lists of timespans, overlapping or touching timespans on all channels merged. Timespans restricted
+    to some channels, (start, end, chans), are kept as they are.
+    :param timespans: (list) (start, end) or (start, end, chans) tuples in seconds
+    :param extra_timespans: (list) (start, end) or (start, end, chans) tuples in seconds
+    :return: (list) (start, end) tuples sorted and disjoint, then (start, end, chans) tuples
+    """
+    spans = [tuple(span) for span in list(timespans) + list(extra_timespans)]
+    merged = []
+    for start, end in sorted(span for span in spans if len(span) == 2):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged + [span for span in spans if len(span) == 3]
+
+
+def apply_overrides(timespans, overrides, mouse_id):
+    """
+    Add the curated timespans of a mouse (config overstrike_overrides) to the timespans of each probe.
+    :param timespans: (dict) probe id to list of (start, end) tuples in seconds
+    :param overrides: (dict) mouse name to list of (start, end) timespans in seconds, zeroed on all probes
+    :param mouse_id: mouse name
+    :return: (dict) probe id to list of (start, end) tuples in seconds
+    """
+    curated = (overrides or {}).get(mouse_id)
+    if not curated:
+        return timespans
+    logger.info('Adding curated timespans of {} to the noise scan proposals: {}'.format(mouse_id, curated))
+    return {probe_id: merge_timespans(spans, curated) for probe_id, spans in timespans.items()}
+
+
+def main(input_dir, config, overwrite=False):
+    """
+    Scan the corrected .ap.bin file of each probe for noisy epochs, and write the proposed timespans to zero-out
+    to noise_timespans.yaml in the epoch folder. Per-second metrics are saved next to each file (.noise_scan.npz).
+    Existing proposals are reused unless overwrite is set, so they can be edited by hand before zeroing.
+    Curated timespans of the mouse in config overstrike_overrides are added to the proposals of all probes.
+    :param input_dir: path to CatGT-processed ephys data
+    :param config: config dict
+    :param overwrite: scan again even if proposed timespans exist
+    :return: (dict) probe id to list of (start, end) tuples in seconds
+    """
+    epoch_name = [f for f in os.listdir(input_dir) if f.startswith('catgt_')][0]
+    mouse_id = epoch_name.split('_')[1]
+    if os.path.exists(noise_timespans_path(input_dir)) and not overwrite:
+        logger.info('Using proposed noisy timespans from {}.'.format(noise_timespans_path(input_dir)))
+        return apply_overrides(load_noise_timespans(input_dir), config.get('overstrike_overrides'), mouse_id)
+
+    scan_config = config['noise_scan']
+    probe_folders = [f for f in os.listdir(os.path.join(input_dir, epoch_name)) if 'imec' in f]
+
+    ap_bin_paths = {}
+    for probe_folder in probe_folders:
+        probe_id = int(probe_folder.split('imec')[-1])
+
+        # Check if probe recording is valid
+        if not check_if_valid_recording(config, mouse_id, probe_id):
+            continue
+
+        probe_path = os.path.join(input_dir, epoch_name, probe_folder)
+        ap_bin_file_name = [f for f in os.listdir(probe_path) if f.endswith('ap.bin') and 'corrected' in f][0]
+        ap_bin_paths[probe_id] = pathlib.Path(probe_path, ap_bin_file_name)
+
+    # Scan blocks of seconds of all probes in parallel
+    block_s = scan_config.get('block_s', 60)
+    scan_params = {'line_freq': scan_config.get('line_freq', 50.),
+                   'line_max_hz': scan_config.get('line_max_hz', 1000.),
+                   'rms_stride': scan_config.get('rms_stride', 2)}
+    start_time = time.time()
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=scan_config.get('n_workers', 4), mp_context=ctx) as executor:
+        futures = {}
+        for probe_id, ap_bin_path in ap_bin_paths.items():
+            meta = readSGLX.readMetaInfo(ap_bin_path)
+            n_seconds = int(np.ceil(meta.nFileSamp / meta.sampRate))
+            futures[probe_id] = [executor.submit(scan_seconds, ap_bin_path, first, min(first + block_s, n_seconds),
+                                                 **scan_params)
+                                 for first in range(0, n_seconds, block_s)]
+
+        timespans = {}
+        for probe_id, probe_futures in futures.items():
+            results = [future.result() for future in probe_futures]
+            rms = np.concatenate([res[0] for res in results], axis=1)
+            line_fraction = np.concatenate([res[1] for res in results], axis=1)
+            ap_bin_path = ap_bin_paths[probe_id]
+            np.savez(ap_bin_path.with_name(ap_bin_path.stem + '.noise_scan.npz'), rms=rms, line_fraction=line_fraction)
+
+            timespans[probe_id] = flag_noisy_epochs(rms, line_fraction,
+                                                    rms_factor=scan_config.get('rms_factor', 3.),
+                                                    line_fraction_max=scan_config.get('line_fraction', 0.5),
+                                                    merge_gap_s=scan_config.get('merge_gap_s', 2),
+                                                    pad_s=scan_config.get('pad_s', 1),
+                                                    min_duration_s=scan_config.get('min_duration_s', 1))
+            logger.info('Probe {}: {} noisy timespans ({} s) out of {} s: {}'.format(
+                probe_id, len(timespans[probe_id]), sum(end - start for start, end in timespans[probe_id]),
+                rms.shape[1], timespans[probe_id]))
+    logger.info('Noise scan of {} probes took {:.1f} s.'.format(len(ap_bin_paths), time.time() - start_time))
+
+    with open(noise_timespans_path(input_dir), 'w') as f:
+        yaml.safe_dump({probe_id: [list(span) for span in spans] for probe_id, spans in timespans.items()}, f,
+                       default_flow_style=None)
+    return apply_overrides(timespans, config.get('overstrike_overrides'), mouse_id)
@@ -12,69 +12,211 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+import pathlib
 import subprocess
+import numpy as np
 from utils.ephys_utils import flatten_list
-import webbrowser
 import yaml
 from loguru import logger
 
+from utils import readSGLX
 
-def main(input_dir, config, timespans_list):
+
+def parse_channels(chans, n_chans):
+    """
+    Channel subset of a timespan, as a sorted tuple of saved channel indices.
+    :param chans: None (all channels), list of channel indices or OverStrike -chans string e.g. '0:300,310'
+    :param n_chans: number of saved channels
+    :return: (tuple) channel indices, or None for all channels
+    """
+    if chans is None:
+        return None
+    if isinstance(chans, str):
+        chan_list = []
+        for chan_range in chans.split(','):
+            bounds = chan_range.split(':')
+            chan_list.extend(range(int(bounds[0]), int(bounds[-1]) + 1))  # inclusive, as in OverStrike
+        chans = chan_list
+    chans = tuple(sorted(set(int(c) for c in chans)))
+    if any(c < 0 or c >= n_chans for c in chans):
+        raise ValueError('Channels {} out of range for {} saved channels.'.format(chans, n_chans))
+    if len(chans) == n_chans:
+        return None
+    return chans
+
+
+def merge_timespans(timespans, sample_rate, n_samples, n_chans):
+    """
+    Convert timespans in seconds to sample intervals, and merge overlapping or adjacent intervals that strike the
+    same channels.
+    :param timespans: list of (start, end) or (start, end, chans) tuples in seconds, see parse_channels for chans
+    :param sample_rate: sampling rate in Hz
+    :param n_samples: number of samples in the file
+    :param n_chans: number of saved channels
+    :return: (list) (start, stop, chans) intervals in samples sorted by start, stop excluded
+    """
+    by_chans = {}
+    for timespan in timespans:
+        start = int(np.clip(round(timespan[0] * sample_rate), 0, n_samples))
+        stop = int(np.clip(round(timespan[1] * sample_rate), 0, n_samples))
+        chans = parse_channels(timespan[2] if len(timespan) > 2 else None, n_chans)
+        if stop > start:
+            by_chans.setdefault(chans, []).append((start, stop))
+
+    merged = []
+    for chans, intervals in by_chans.items():
+        intervals.sort()
+        current_start, current_stop = intervals[0]
+        for start, stop in intervals[1:]:
+            if start <= current_stop:
+                current_stop = max(current_stop, stop)
+            else:
+                merged.append((current_start, current_stop, chans))
+                current_start, current_stop = start, stop
+        merged.append((current_start, current_stop, chans))
+    return sorted(merged, key=lambda interval: interval[0])
+
+
+def overstrike_manifest_path(ap_bin_path):
+    """
+    Path of the manifest listing what was struck in an .ap.bin file.
+    :param ap_bin_path: path to .ap.bin file
+    :return: (Path)
+    """
+    ap_bin_path = pathlib.Path(ap_bin_path)
+    return ap_bin_path.with_name(ap_bin_path.stem + '.overstrike.yaml')
+
+
+def strike_timespans(ap_bin_path, ap_meta, timespans, chunk_samples=262144):
+    """
+    Zero-out timespans of an .ap.bin file in place, in one sequential pass through a memmap of the file, and
+    append what was struck to the manifest next to it.
+    :param ap_bin_path: path to .ap.bin file
+    :param ap_meta: (readSGLX.MetaInfo) metadata of the .ap.bin file
+    :param timespans: list of (start, end) or (start, end, chans) tuples in seconds
+    :param chunk_samples: number of samples zeroed at once
+    :return: (list) manifest entries of the struck intervals
+    """
+    ap_bin_path = pathlib.Path(ap_bin_path)
+    n_chans, n_samples = ap_meta.nSavedChans, ap_meta.nFileSamp
+    intervals = merge_timespans(timespans, ap_meta.sampRate, n_samples, n_chans)
+
+    data = np.memmap(ap_bin_path, dtype='int16', mode='r+', shape=(n_chans, n_samples), order='F')
+    for start, stop, chans in intervals:
+        chan_index = slice(None) if chans is None else list(chans)
+        for chunk_start in range(start, stop, chunk_samples):
+            data[chan_index, chunk_start:min(chunk_start + chunk_samples, stop)] = 0
+        data.flush()
+    del data
+
+    # Record struck intervals
+    entries = [{'start_s': start / ap_meta.sampRate,
+                'end_s': stop / ap_meta.sampRate,
+                'start_sample': start,
+                'end_sample': stop,
+                'chans': 'all' if chans is None else list(chans)} for start, stop, chans in intervals]
+    manifest_path = overstrike_manifest_path(ap_bin_path)
+    manifest = []
+    if manifest_path.exists():
+        with open(manifest_path, 'r') as f:
+            manifest = yaml.safe_load(f) or []
+    manifest.append({'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                     'file': ap_bin_path.name,
+                     'n_samples': n_samples,
+                     'timespans': entries})
+    with open(manifest_path, 'w') as f:
+        yaml.safe_dump(manifest, f, sort_keys=False, default_flow_style=None)
+
+    logger.info('Struck {} intervals ({:.1f} s) in {}.'.format(
+        len(entries), sum(e['end_s'] - e['start_s'] for e in entries), ap_bin_path.name))
+    return entries
+
+
+def run_overstrike_exe(ap_bin_path, timespans, overstrike_path):
     """
-    Run OverStrike on raw ephys data and save to output directory.
-    :param input_dir: path to raw ephys data
-    :param output_dir: path to output directory
+    Zero-out timespans of an .ap.bin file with the OverStrike executable, one call per timespan.
+    :param ap_bin_path: path to .ap.bin file
+    :param timespans: list of (start, end) or (start, end, chans) tuples in seconds, chans as a -chans string
+    :param overstrike_path: path to OverStrike installation
+    :return:
+    """
+    for timespan in timespans:
+
+        # Write OverStrike command line
+        command = ['OverStrike',
+                   '-file={}'.format(ap_bin_path),
+                   '-secs={},{}'.format(timespan[0], timespan[1])
+                   ]
+        if len(timespan) > 2:
+            chans = timespan[2] if isinstance(timespan[2], str) else ','.join(str(c) for c in timespan[2])
+            command.append('-chans={}'.format(chans))
+        logger.info('OverStrike command line will run: {}'.format(list(flatten_list(command))))
+
+        # Run OverStrike
+        subprocess.run(list(flatten_list(command)), shell=True, cwd=overstrike_path)
+
+    logger.info('OverStrike log file at: {}'.format(os.path.join(overstrike_path, 'OverStrike.log')))
+    return
+
+
+def main(input_dir, config, timespans_list, probe_ids=None):
+    """
+    Zero-out timespans of the artifact-corrected ephys data of each probe, natively or with OverStrike (config engine).
+    :param input_dir: path to CatGT-processed ephys data
     :param config: config dict
-    :param timespans_list: list of timespans to zero-out
+    :param timespans_list: list of (start, end) or (start, end, chans) tuples in seconds to zero-out on all probes,
+                           or dict of probe id to such a list
+    :param probe_ids: list of probe ids to strike, default all probes
     :return:
     """
 
     epoch_name = os.listdir(input_dir)[0]
     probe_folders = [f for f in os.listdir(os.path.join(input_dir, epoch_name)) if 'imec' in f]
     n_probes = len(probe_folders)
+    if probe_ids is None:
+        probe_ids = range(n_probes)
 
-    # Check timespans_list is a list of tuples
-    try:
-        assert isinstance(timespans_list, list)
-        assert all(isinstance(timespan, tuple) for timespan in timespans_list)
+    # Timespans per probe
+    if isinstance(timespans_list, dict):
+        timespans_per_probe = {probe_id: timespans_list.get(probe_id, []) for probe_id in probe_ids}
+    else:
+        timespans_per_probe = {probe_id: timespans_list for probe_id in probe_ids}
 
-    except AssertionError:
-        logger.error('Timespans_list must be a list of tuples. Skipping OverStrike.')
-        raise TypeError('Timespans_list must be a list of tuples. Skipping OverStrike...')
+    # Check timespans are lists of tuples
+    for probe_id, timespans in timespans_per_probe.items():
+        try:
+            assert isinstance(timespans, list)
+            assert all(isinstance(timespan, tuple) and len(timespan) in (2, 3) for timespan in timespans)
+
+        except AssertionError:
+            logger.error('Timespans_list must be a list of (start, end) or (start, end, chans) tuples. Skipping OverStrike.')
+            raise TypeError('Timespans_list must be a list of (start, end) or (start, end, chans) tuples. Skipping OverStrike...')
 
     # Check not empty
     try:
-        assert len(timespans_list) > 0
+        assert any(len(timespans) > 0 for timespans in timespans_per_probe.values())
     except AssertionError:
         logger.error('Timespans_list cannot be empty. Skipping OverStrike.')
         raise ValueError('Timespans_list cannot be empty. Skipping OverStrike...')
 
-    logger.info('Striking timespans: {}'.format(timespans_list))
-    for probe_id in range(n_probes):
-        if probe_id != 4:
-            print('Skipping OverStrike of probe {}'.format(probe_id))
+    engine = config.get('engine', 'python')
+    for probe_id, timespans in timespans_per_probe.items():
+        if not timespans:
+            logger.info('No timespans to strike for probe {}.'.format(probe_id))
             continue
+        logger.info('Striking timespans of probe {}: {}'.format(probe_id, timespans))
+
         probe_folder = '{}_imec{}'.format(epoch_name.replace('catgt_', ''), probe_id)
         probe_path = os.path.join(input_dir, epoch_name, probe_folder)
         ap_bin_file_name = [f for f in os.listdir(probe_path) if 'ap.bin' in f and 'corrected' in f][0]
         ap_bin_path = os.path.join(probe_path, ap_bin_file_name)
 
-        # Iterate over timespans to zero-out
-        for timespan in timespans_list:
-
-            # Write OverStrike command line
-            command = ['OverStrike',
-                       '-file={}'.format(ap_bin_path),
-                       #'-chans=0:300', #optionally specify channels here, default all
-                       '-secs={},{}'.format(timespan[0], timespan[1])
-                       ]
-            logger.info('OverStrike command line will run: {}'.format(list(flatten_list(command))))
-
-            # Run OverStrike
-            subprocess.run(list(flatten_list(command)), shell=True, cwd=config['overstrike_path'])
-
-            logger.info('Opening OverStrike log file at: {}'.format(os.path.join(config['overstrike_path'], 'OverStrike.log')))
-            webbrowser.open(os.path.join(config['overstrike_path'], 'OverStrike.log'))
+        if engine == 'python':
+            ap_meta = readSGLX.readMetaInfo(pathlib.Path(ap_bin_path))
+            strike_timespans(ap_bin_path, ap_meta, timespans)
+        else:
+            run_overstrike_exe(ap_bin_path, timespans, config['overstrike_path'])
 
     # Save overstrike information
     overstrike_info = {'timespans_list': timespans_list}
@@ -82,4 +224,3 @@ def main(input_dir, config, timespans_list):
         yaml.dump(overstrike_info, f)
 
     return
-
@@ -12,22 +12,27 @@ import sys
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
 import subprocess
-import webbrowser
 import pathlib
 import numpy as np
 from loguru import logger
 
 from utils import readSGLX
-from utils.ephys_utils import flatten_list
+from utils import clock_sync
+from utils import event_store
+from utils import sync_qc
+from utils import event_schema
 
 
-def main(input_dir, config):
+def main(input_dir, config, events=None):
     """
     Run TPrime on processed and spike-sorted/curated ephys data.
-    This aligns task events and spike times to the same time base.
+    This aligns task events and spike times to the same time base, natively or with TPrime (config engine).
+    Events whose input and sync edge files have not changed since the last run are taken from the event store.
     :param input_dir:  path to CatGT processed ephys data
     :param config:  config dict
+    :param events: config events section, see event_schema.load_event_schema
     :return:
     """
 
@@ -42,13 +47,13 @@ def main(input_dir, config):
 
     # Get synchronization period
     sglx_metafile_path = os.path.join(input_dir, '{}_tcat.nidq.meta'.format(epoch_name))
-    sglx_meta_dict = readSGLX.readMeta(pathlib.Path(sglx_metafile_path))
+    sglx_meta = readSGLX.readMetaInfo(pathlib.Path(sglx_metafile_path))
 
     # Use specified syncperiod if available, otherwise use default
-    if sglx_meta_dict['syncSourcePeriod'] is None:
+    if sglx_meta.syncPeriod is None:
         syncperiod = float(config['syncperiod'])
     else:
-        syncperiod = float(sglx_meta_dict['syncSourcePeriod'])
+        syncperiod = sglx_meta.syncPeriod
 
     # Get number of probes
     probe_folders = [f for f in os.listdir(input_dir) if 'imec' in f]
@@ -59,8 +64,8 @@ def main(input_dir, config):
         probe_folder = '{}_imec{}'.format(epoch_name, probe_id)
         metafile_name = '{}_tcat_corrected.imec{}.ap.meta'.format(epoch_name, probe_id)
         apbin_metafile_path = os.path.join(input_dir, probe_folder, metafile_name)
-        ap_meta_dict = readSGLX.readMeta(pathlib.Path(apbin_metafile_path))
-        imSampRate = float(ap_meta_dict['imSampRate'])  # probe-specific
+        ap_meta = readSGLX.readMetaInfo(pathlib.Path(apbin_metafile_path))
+        imSampRate = ap_meta.sampRate  # probe-specific
 
         try:
             logger.info('Converting IMEC probe {} spike times to seconds.'.format(probe_id))
@@ -78,7 +83,7 @@ def main(input_dir, config):
         except FileNotFoundError as e:
             logger.warning('No spike times for IMEC probe {}: either spike sorting missing or invalid recording.'.format(probe_id))
 
-    # Write TPrime command line
+    # Streams to align: stream index -> sync edge times file
     nidq_stream_idx = 10  # arbitrary index number
 
     ## Set path to reference alignment probe
@@ -91,14 +96,19 @@ def main(input_dir, config):
     path_ref_probe = os.path.join(input_dir, '{}_imec{}'.format(epoch_name, default_tostream_probe))
     ref_probe_edges_file = '{}_tcat.imec{}.ap.xd_{}_6_500.txt'.format(epoch_name,
                                                                       default_tostream_probe,
-                                                                      int(ap_meta_dict['nSavedChans']) - 1)
-    # Set reference streams
-    command = ['Tprime',
-               '-syncperiod={}'.format(syncperiod),                                         # arg: reference data stream edge times (IMEC 0)
-               '-tostream={}'.format(os.path.join(path_ref_probe, ref_probe_edges_file)),   # arg: stream index, sync pulse edge times
-               '-fromstream={},{}'.format(nidq_stream_idx,
-                                          os.path.join(input_dir, epoch_name + '_tcat.nidq.xa_0_0.txt'))
-               ]
+                                                                      ap_meta.nSavedChans - 1)
+    tostream_edges_path = os.path.join(path_ref_probe, ref_probe_edges_file)
+    schema = event_schema.load_event_schema(events, epoch_name)
+    fromstreams = {nidq_stream_idx: os.path.join(input_dir,
+                                                 event_schema.event_file_name(epoch_name,
+                                                                              schema[event_schema.SYNC_EVENT]))}
+
+    # Events to align: (stream index, input file, output file), names of the outputs in the event store, and
+    # copies of outputs written from the same aligned times
+    event_files = []
+    store_names = {}
+    output_copies = {}
+    spike_clusters = {}
 
     # Add edge times & spike times for included each probe
     for probe_id in valid_probes:
@@ -108,75 +118,181 @@ def main(input_dir, config):
         probe_folder_path = os.path.join(input_dir, probe_folder)
 
         probe_edgetime_files = [f for f in os.listdir(probe_folder_path) if 'ap.xd' in f]
+        fromstreams[probe_id] = os.path.join(probe_folder_path, probe_edgetime_files[0])  # stream index, edge times (probe)
 
-        command.append('-fromstream={},{}'.format(probe_id,
-                                                  os.path.join(probe_folder_path,
-                                                               probe_edgetime_files[
-                                                                   0])))  # stream index, edge times (probe)
-
-        command.append('-events={},{},{}'.format(probe_id,
-                                                 os.path.join(probe_folder_path, kilosort_folder, 'spike_times_sec.npy'),
-                                                 os.path.join(probe_folder_path,  # save in original imec folder
-                                                              '{}_imec{}_spike_times_sec_sync.npy'.format(epoch_name,
-                                                                                                          probe_id))))  # stream index, spike times
-        command.append('-events={},{},{}'.format(probe_id,
-                                                 os.path.join(probe_folder_path, kilosort_folder, 'spike_times_sec.npy'),
-                                                 os.path.join(path_dest,  # save AGAIN along other aligned event times
-                                                              '{}_imec{}_spike_times_sec_sync.npy'.format(epoch_name,
-                                                                                                          probe_id))))
-
-# Add behaviour and video frame times
-    command.append([
-        '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_1_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'trial_start_times.txt')),
-        '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_2_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'auditory_stim_times.txt')),
-        '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_3_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'whisker_stim_times.txt')),
-        #'-events={},{},{}'.format(nidq_stream_idx,
-        #                          os.path.join(input_dir, '{}_tcat.nidq.xa_4_0.txt'.format(epoch_name)),
-        #                          os.path.join(path_dest, 'valve_times.txt')), #TODO: for AB mice
-        #'-events={},{},{}'.format(nidq_stream_idx,
-        #                          os.path.join(input_dir, '{}_tcat.nidq.xa_4_0.txt'.format(epoch_name)),
-        #                          os.path.join(path_dest, 'context_transition_on.txt')), # TODO: for PB mice
-        #'-events={},{},{}'.format(nidq_stream_idx,
-        #                          os.path.join(input_dir, '{}_tcat.nidq.xia_4_0.txt'.format(epoch_name)),
-        #                          os.path.join(path_dest, 'context_transition_off.txt')),  # TODO: for PB mice
-         '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_5_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'cam0_frame_times.txt')),
-         '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_6_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'cam1_frame_times.txt')),
-         '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_7_0.txt'.format(epoch_name)), # Note: this works weirdly
-                                  os.path.join(path_dest, 'piezo_licks.txt'))
-
-    ])
-    if epoch_name.startswith('AB'):
-        command.append(['-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_4_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'valve_times.txt'))
-                        ])
-    elif epoch_name.startswith('PB'):
-        command.append(['-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xa_4_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'context_transition_on.txt')),
-                        '-events={},{},{}'.format(nidq_stream_idx,
-                                  os.path.join(input_dir, '{}_tcat.nidq.xia_4_0.txt'.format(epoch_name)),
-                                  os.path.join(path_dest, 'context_transition_off.txt'))
-                        ])
-
-    logger.info('TPrime command line will run: {}'.format(list(flatten_list(command))))
+        spike_times_file = os.path.join(probe_folder_path, kilosort_folder, 'spike_times_sec.npy')
+        spike_times_sync_file = '{}_imec{}_spike_times_sec_sync.npy'.format(epoch_name, probe_id)
+        spike_times_sync_path = os.path.join(probe_folder_path, spike_times_sync_file)  # save in original imec folder
+        event_files.append((probe_id, spike_times_file, spike_times_sync_path))
+        output_copies[spike_times_sync_path] = os.path.join(path_dest, spike_times_sync_file)  # save AGAIN along other aligned event times
+        store_names[spike_times_sync_path] = 'imec{}_spike_times'.format(probe_id)
 
-    logger.info('Running TPrime to align task events and spike times.')
-    subprocess.run(list(flatten_list(command)), shell=True, cwd=config['tprime_path'])
+        # Cluster index of each spike
+        spike_clusters_file = os.path.join(probe_folder_path, kilosort_folder, 'spike_clusters.npy')
+        if os.path.exists(spike_clusters_file):
+            spike_clusters['imec{}_spike_clusters'.format(probe_id)] = np.load(spike_clusters_file).ravel()
 
-    logger.info('Opening TPrime log file at: {}'.format(os.path.join(config['tprime_path'], 'Tprime.log')))
-    webbrowser.open(os.path.join(config['tprime_path'], 'Tprime.log'))
+    # Add behaviour and video frame times from the event schema
+    for name, spec in schema.items():
+        if not spec['align']:
+            continue
+        output_file = os.path.join(path_dest, '{}.txt'.format(name))
+        event_files.append((nidq_stream_idx, os.path.join(input_dir, event_schema.event_file_name(epoch_name, spec)),
+                       output_file))
+        store_names[output_file] = name
+
+    # Check sync quality before aligning anything, fails if out of tolerance
+    stream_names = {stream_idx: 'nidq' if stream_idx == nidq_stream_idx else 'imec{}'.format(stream_idx)
+                    for stream_idx in fromstreams}
+    sync_qc.run_sync_qc(tostream_edges_path,
+                        {stream_names[stream_idx]: edges_path for stream_idx, edges_path in fromstreams.items()},
+                        syncperiod,
+                        os.path.join(path_dest, '{}_sync_qc.json'.format(epoch_name)),
+                        max_residual_ms=config.get('max_residual_ms', 0.5),
+                        min_matched_fraction=config.get('min_matched_fraction', 0.99))
+
+    # Skip events whose inputs have not changed since the last run
+    engine = config.get('engine', 'python')
+    legacy_outputs = config.get('legacy_outputs', False)
+    write_files = engine != 'python' or legacy_outputs  # TPrime always writes its output files
+    store_path = os.path.join(path_dest, '{}_events.npz'.format(epoch_name))
+    manifest_path = os.path.join(path_dest, 'sync_events.json')
+    event_files, reused, keys = unchanged_events(event_files, fromstreams, tostream_edges_path, syncperiod, engine,
+                                                 store_names, store_path, manifest_path, write_files)
+
+    if not event_files:
+        aligned = {}
+    elif engine == 'python':
+        aligned = run_clock_sync(tostream_edges_path, fromstreams, event_files, syncperiod, write_files=write_files)
+    else:
+        start_time = time.time()
+        returncode = run_tprime(tostream_edges_path, fromstreams, event_files, syncperiod, config['tprime_path'])
+        if returncode != 0:
+            raise RuntimeError('TPrime failed with exit code {}, see {}.'.format(
+                returncode, os.path.join(config['tprime_path'], 'Tprime.log')))
+        not_written = [output_file for _, input_file, output_file in event_files if os.path.exists(input_file)
+                       and (not os.path.exists(output_file) or os.path.getmtime(output_file) < int(start_time))]
+        if not_written:
+            raise RuntimeError('TPrime did not write {}.'.format(not_written))
+        aligned = {output_file: clock_sync.load_event_times(output_file) for _, _, output_file in event_files
+                   if os.path.exists(output_file)}
+
+    # Copies of aligned outputs (spike times in sync_event_times), written from the times aligned once
+    if legacy_outputs:
+        for output_file, copy_file in output_copies.items():
+            if output_file in aligned:
+                clock_sync.save_event_times(copy_file, aligned[output_file])
+            elif store_names[output_file] in reused and not os.path.exists(copy_file):
+                clock_sync.save_event_times(copy_file, reused[store_names[output_file]])
+
+    # Write all aligned event times of the session to one event store
+    store = {store_names[output_file]: times for output_file, times in aligned.items() if output_file in store_names}
+    store.update(reused)
+    store.update(spike_clusters)
+    event_store.write_event_store(store_path, store)
+    logger.info('Wrote {} aligned event arrays to {} ({} unchanged).'.format(len(store), store_path, len(reused)))
+
+    # Record the inputs of the aligned events
+    event_schema.update_manifest(manifest_path, {os.path.basename(output_file): keys[output_file]
+                                                 for _, _, output_file in event_files
+                                                 if output_file in keys and output_file in aligned})
 
     return
 
+
+def unchanged_events(events, fromstreams, tostream_edges_path, syncperiod, engine, store_names, store_path,
+                     manifest_path, write_files=True):
+    """
+    Split events into those to align and those unchanged since the last run, i.e. whose input and sync edge files
+    hash to the key recorded in the manifest, and whose aligned times are still in the event store.
+    :param events: list of (stream index, input file, output file)
+    :param fromstreams: dict of stream index to sync edge times file
+    :param tostream_edges_path: path to sync edge times of the reference stream
+    :param syncperiod: sync period in seconds
+    :param engine: clock alignment engine ('python' or 'tprime')
+    :param store_names: dict of output file to name in the event store
+    :param store_path: path to the event store of the last run
+    :param manifest_path: path to the alignment manifest
+    :param write_files: whether output files are written, then they must exist to skip an event
+    :return: (tuple) events to align, dict of store name to reused times, dict of output file to key
+    """
+    manifest = event_schema.load_manifest(manifest_path)
+    previous_store = event_store.load_event_store(store_path, mmap=False) if os.path.exists(store_path) else {}
+
+    to_align, reused, keys = [], {}, {}
+    for stream_idx, input_file, output_file in events:
+        if not os.path.exists(input_file):
+            to_align.append((stream_idx, input_file, output_file))
+            continue
+        keys[output_file] = event_schema.inputs_key([input_file, fromstreams[stream_idx], tostream_edges_path],
+                                                    float(syncperiod), engine)
+        name = store_names.get(output_file)
+        unchanged = (manifest.get(os.path.basename(output_file)) == keys[output_file]
+                     and (name is None or name in previous_store)
+                     and (os.path.exists(output_file) or not write_files))
+        if not unchanged:
+            to_align.append((stream_idx, input_file, output_file))
+        elif name is not None:
+            reused[name] = previous_store[name]
+    if reused:
+        logger.info('Inputs unchanged since last alignment: {}.'.format(sorted(reused)))
+    return to_align, reused, keys
+
+
+def run_clock_sync(tostream_edges_path, fromstreams, events, syncperiod, write_files=True):
+    """
+    Align event files to the reference stream with the native clock alignment (no TPrime subprocess).
+    :param tostream_edges_path: path to sync edge times of the reference stream
+    :param fromstreams: dict of stream index to sync edge times file
+    :param events: list of (stream index, input file, output file)
+    :param syncperiod: sync period in seconds
+    :param write_files: write each aligned output file, as TPrime does
+    :return: (dict) output file to aligned event times
+    """
+    logger.info('Aligning task events and spike times to reference stream.')
+    tostream_edges = clock_sync.load_edges(tostream_edges_path)
+    clock_maps = {stream_idx: clock_sync.fit_clock_map(clock_sync.load_edges(edges_path), tostream_edges, syncperiod)
+                  for stream_idx, edges_path in fromstreams.items()}
+    for stream_idx, clock_map in clock_maps.items():
+        logger.info('Stream {}: {} sync edges matched, drift {:.2f} ppm.'.format(stream_idx, clock_map.n_edges,
+                                                                                clock_map.drift_ppm))
+
+    aligned = {}
+    for stream_idx, input_file, output_file in events:
+        if not os.path.exists(input_file):
+            logger.warning('No event file {}, skipping.'.format(input_file))
+            continue
+        times = clock_sync.load_event_times(input_file)
+        aligned[output_file] = clock_sync.map_times(times, clock_maps[stream_idx])
+        if write_files:
+            clock_sync.save_event_times(output_file, aligned[output_file])
+    return aligned
+
+
+def run_tprime(tostream_edges_path, fromstreams, events, syncperiod, tprime_path):
+    """
+    Align event files to the reference stream with a TPrime subprocess.
+    :param tostream_edges_path: path to sync edge times of the reference stream
+    :param fromstreams: dict of stream index to sync edge times file
+    :param events: list of (stream index, input file, output file)
+    :param syncperiod: sync period in seconds
+    :param tprime_path: path to TPrime installation
+    :return: (int) TPrime exit code
+    """
+    # Set reference streams
+    command = ['Tprime',
+               '-syncperiod={}'.format(syncperiod),            # arg: reference data stream edge times (IMEC 0)
+               '-tostream={}'.format(tostream_edges_path),     # arg: stream index, sync pulse edge times
+               ]
+    command.extend(['-fromstream={},{}'.format(stream_idx, edges_path) for stream_idx, edges_path in fromstreams.items()])
+    command.extend(['-events={},{},{}'.format(stream_idx, input_file, output_file)
+                    for stream_idx, input_file, output_file in events])
+
+    logger.info('TPrime command line will run: {}'.format(command))
+
+    logger.info('Running TPrime to align task events and spike times.')
+    result = subprocess.run(command, shell=True, cwd=tprime_path)
+
+    logger.info('TPrime log file at: {}'.format(os.path.join(tprime_path, 'Tprime.log')))
+
+    return result.returncode
@@ -24,6 +24,9 @@ from loguru import logger
 from tqdm import tqdm
 import platform
 
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from utils import session_index
+
 # ---------------- CONFIG ----------------
 
 EXPERIMENTER = 'Axel_Bisi'
@@ -63,6 +66,10 @@ LOG_ROOT.mkdir(exist_ok=True)
 
 MAX_WORKERS = 6
 
+# Discover sessions from a session index of each mouse folder (data_root/<mouse_id>/session_index.json)
+USE_SESSION_INDEX = False
+SESSION_INDEX_MAX_AGE_HOURS = 24
+
 # Mice to process
 INPUTS = ["AB164"]
 
@@ -79,6 +86,27 @@ logger.add(LOG_ROOT / "master_log.txt", rotation="5 MB", backtrace=True, diagnos
 
 # -------- JOB DISCOVERY HELPERS --------
 
+_SESSION_INDEXES = {}
+
+
+def find_indexed_sessions(data_root: Path, mouse_id: str, processed: bool):
+    """
+    Find session folders for a mouse from the session index of its folder in a data root (built/updated if stale).
+    Only that mouse folder is walked. Sessions whose files fail size validation against their metadata are skipped,
+    sessions without binary files are kept.
+    """
+    if (data_root, mouse_id) not in _SESSION_INDEXES:
+        _SESSION_INDEXES[data_root, mouse_id] = session_index.get_session_index(
+            data_root, max_age_hours=SESSION_INDEX_MAX_AGE_HOURS, mouse_id=mouse_id)
+    index = _SESSION_INDEXES[data_root, mouse_id]
+
+    invalid = set(session_index.query_sessions(index, mouse_id=mouse_id, processed=processed, valid_only=False)) \
+              - set(session_index.query_sessions(index, mouse_id=mouse_id, processed=processed))
+    for session in sorted(invalid):
+        logger.warning(f"{session}: binary file sizes do not match metadata, skipping.")
+    return session_index.query_sessions(index, mouse_id=mouse_id, processed=processed)
+
+
 def find_processed_sessions(mouse_id: str):
     """
     Find processed session folders for a mouse.
@@ -86,6 +114,9 @@ def find_processed_sessions(mouse_id: str):
     Example returned path:
       M:\analysis\Axel_Bisi\data\<mouse_id>\<session_id>\Ephys\catgt_...
     """
+    if USE_SESSION_INDEX:
+        return find_indexed_sessions(BASE_DIR, mouse_id, processed=True)
+
     mouse_dir = BASE_DIR / mouse_id
     if not mouse_dir.exists():
         logger.warning(f"{mouse_id} not found under {BASE_DIR}")
@@ -108,6 +139,9 @@ def find_raw_sessions(mouse_id: str):
     Example:
       M:\data\<mouse_id>\Recording\<session_id>\Ephys
     """
+    if USE_SESSION_INDEX:
+        return find_indexed_sessions(RAW_DIR, mouse_id, processed=False)
+
     mouse_dir = RAW_DIR / mouse_id / "Recording"
     if not mouse_dir.exists() or not mouse_dir.is_dir():
         logger.warning(f"{mouse_id}/Recording not found under {RAW_DIR}")
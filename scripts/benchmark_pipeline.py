@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+"""
+Benchmark of pipeline steps on synthetic SpikeGLX recordings.
+
+Features:
+- synthetic recordings of configurable duration, channel count and probe models (utils/synthetic_sglx.py)
+- one fresh worker process per benchmark, to measure its peak RSS
+- throughput in MB/s of binary data processed
+- JSON report, and comparison against a previous report to flag regressions
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from loguru import logger
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'preprocessing'))
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# ---------------- MEMORY ----------------
+
+def _rss_mb():
+    """Current resident set size of this process in MB, None if unknown."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2 ** 20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, None if unknown."""
+    if psutil is not None and hasattr(psutil.Process().memory_info(), 'peak_wset'):
+        return psutil.Process().memory_info().peak_wset / 2 ** 20  # Windows
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10  # bytes on macOS, kB on Linux
+
+
+# ---------------- BENCHMARKS ----------------
+# Each benchmark takes the synthetic recording paths and returns the number of bytes of binary data processed
+# and the number of items processed (chunks, blocks, snippets, files, waveforms).
+
+def bench_read_sequential(paths):
+    from utils import readSGLX
+    n_bytes, n_items = 0, 0
+    for ap_bin in paths['ap_bins']:
+        meta = readSGLX.readMeta(Path(ap_bin))
+        for chunk in readSGLX.StreamChunks(Path(ap_bin), meta, chunkSamp=65536):
+            n_bytes += chunk.data.nbytes
+            n_items += 1
+    return n_bytes, n_items
+
+
+def bench_read_random_blocks(paths, n_blocks=200, block_s=0.1):
+    import numpy as np
+    from utils import readSGLX
+    rng = np.random.default_rng(0)
+    n_bytes = 0
+    for ap_bin in paths['ap_bins']:
+        meta = readSGLX.readMeta(Path(ap_bin))
+        n_samp = int(meta['fileSizeBytes']) // (2 * int(meta['nSavedChans']))
+        block_samp = int(block_s * readSGLX.SampRate(meta))
+        for first in rng.integers(0, max(n_samp - block_samp, 1), n_blocks):
+            n_bytes += readSGLX.ReadBlock(Path(ap_bin), meta, int(first), int(first) + block_samp - 1).nbytes
+    return n_bytes, n_blocks * len(paths['ap_bins'])
+
+
+def bench_gain_correction(paths, n_blocks=50, block_s=0.1):
+    import numpy as np
+    from utils import readSGLX
+    n_bytes = 0
+    for ap_bin in paths['ap_bins']:
+        meta = readSGLX.readMeta(Path(ap_bin))
+        n_samp = int(meta['fileSizeBytes']) // (2 * int(meta['nSavedChans']))
+        block_samp = int(block_s * readSGLX.SampRate(meta))
+        chan_list = np.arange(int(meta['nSavedChans']))  # AP and sync channels, as saved
+        out = np.empty((chan_list.size, block_samp), dtype='float32')
+        for first in np.linspace(0, max(n_samp - block_samp, 0), n_blocks).astype(int):
+            block = readSGLX.ReadBlock(Path(ap_bin), meta, first, first + block_samp - 1)
+            volts = readSGLX.GainCorrectIM(block, chan_list, meta, dtype='float32', out=out[:, :block.shape[1]])
+            # the sync channel is not scaled, the neural channels are
+            if not np.array_equal(volts[-1], block[-1]) or not np.all(np.abs(volts[:-1]) < 1):
+                raise ValueError('Unexpected gain correction of {}.'.format(ap_bin))
+            n_bytes += block.nbytes
+    return n_bytes, n_blocks * len(paths['ap_bins'])
+
+
+def bench_extract_snippets(paths, n_spikes=5000):
+    import numpy as np
+    from utils import readSGLX
+    ground_truth = np.load(paths['ground_truth'])
+    n_bytes, n_items = 0, 0
+    for probe_id, ap_bin in enumerate(paths['ap_bins']):
+        meta = readSGLX.readMeta(Path(ap_bin))
+        spike_samples = ground_truth['imec{}_spike_samples'.format(probe_id)][:n_spikes]
+        snippets = readSGLX.ExtractSnippets(readSGLX.makeMemMapRaw(Path(ap_bin), meta), spike_samples, 20, 62)
+        n_bytes += snippets.nbytes
+        n_items += spike_samples.size
+    return n_bytes, n_items
+
+
+def bench_artifact_correction(paths):
+    import numpy as np
+    from utils import readSGLX
+    from run_artifact_correction import correct_artifacts
+    ground_truth = np.load(paths['ground_truth'])
+    n_bytes = 0
+    for probe_id, ap_bin in enumerate(paths['ap_bins']):
+        ap_bin = Path(ap_bin)
+        meta = readSGLX.readMetaInfo(ap_bin, cacheDir=None)
+        output_path = ap_bin.with_name(ap_bin.name.replace('tcat', 'tcat_corrected'))
+        correct_artifacts(ap_bin, meta, ground_truth['imec{}_artifact_times'.format(probe_id)], 4, output_path)
+        n_bytes += meta.fileSizeBytes
+        os.remove(output_path)
+    return n_bytes, len(paths['ap_bins'])
+
+
+def bench_artifact_detection(paths):
+    from utils import readSGLX
+    from run_artifact_correction import detect_artifacts
+    n_bytes = 0
+    n_intervals = 0
+    for ap_bin in paths['ap_bins']:
+        meta = readSGLX.readMetaInfo(Path(ap_bin), cacheDir=None)
+        raw = readSGLX.makeMemMapRaw(Path(ap_bin), meta.raw)
+        n_intervals += len(detect_artifacts(raw, meta.sampRate, channels=slice(0, meta.nSavedChans - 1),
+                                            saturation_level=int(meta.raw['imMaxInt']) - 1))
+        n_bytes += meta.fileSizeBytes
+    return n_bytes, n_intervals
+
+
+def bench_find_surface_channel(paths):
+    import numpy as np
+    from utils import readSGLX
+    from run_lfp_analysis import find_surface_channel
+    ground_truth = np.load(paths['ground_truth'])
+    n_bytes = 0
+    for lf_bin in paths['lf_bins']:
+        lf_bin = Path(lf_bin)
+        probe_id = int(lf_bin.name.split('.imec')[-1].split('.')[0])
+        meta = readSGLX.readMetaInfo(lf_bin, cacheDir=None)
+        ap_meta = readSGLX.readMetaInfo(lf_bin.with_name(lf_bin.name.replace('.lf.', '.ap.')), cacheDir=None)
+        geometry = ap_meta.geometry
+        params = {
+            'save_figure': False,
+            'smoothing_amount': 5,
+            'power_thresh': 2.5,
+            'diff_thresh': -0.06,
+            'freq_range_gamma': [0, 10],
+            'freq_range_spiking': [500, 1250],
+            'max_freq': 150,
+            'saline_range_um': [float(ground_truth['imec{}_surface_y'.format(probe_id)]), float(geometry[2].max()) + 1],
+            'n_passes': 10,
+            'air_gap_um': 1000,
+            'skip_s_per_pass': 1,
+            'nfft': 4096,
+            'figure_location': str(lf_bin.parent),
+        }
+        ephys_params = {'num_channels': meta.nSavedChans, 'lfp_sample_rate': meta.sampRate,
+                        'reference_channels': [191] if meta.nSavedChans > 192 else []}  # NP1.0 reference site
+        lfp_data = readSGLX.makeMemMapBest(lf_bin, meta.raw, access='channel').T
+        n_passes = min(params['n_passes'], int(lfp_data.shape[0] // (meta.sampRate * (params['skip_s_per_pass'] + 1))))
+        find_surface_channel(lfp_data, ephys_params, params, geometry[1], geometry[2], geometry[0])
+        n_bytes += n_passes * int(meta.sampRate) * meta.nSavedChans * 2
+    return n_bytes, len(paths['lf_bins'])
+
+
+def bench_waveform_metrics(paths, n_repeats=10):
+    import numpy as np
+    from utils.waveform_metrics_utils import calculate_waveform_metrics_from_avg
+    ground_truth = np.load(paths['ground_truth'])
+    n_bytes, n_items = 0, 0
+    for probe_id in range(len(paths['ap_bins'])):
+        waveforms = ground_truth['imec{}_peak_waveforms'.format(probe_id)]
+        peak_channels = ground_truth['imec{}_template_peak_channels'.format(probe_id)]
+        for _ in range(n_repeats):
+            for cluster_id, (waveform, peak_channel) in enumerate(zip(waveforms, peak_channels)):
+                calculate_waveform_metrics_from_avg(waveform, cluster_id, peak_channel, 30000.0)
+        n_bytes += n_repeats * waveforms.nbytes
+        n_items += n_repeats * len(waveforms)
+    return n_bytes, n_items
+
+
+BENCHMARKS = {
+    'read_sequential': bench_read_sequential,
+    'read_random_blocks': bench_read_random_blocks,
+    'gain_correction': bench_gain_correction,
+    'extract_snippets': bench_extract_snippets,
+    'artifact_correction': bench_artifact_correction,
+    'artifact_detection': bench_artifact_detection,
+    'find_surface_channel': bench_find_surface_channel,
+    'waveform_metrics': bench_waveform_metrics,
+}
+
+
+def run_benchmark(name, paths):
+    """
+    Run one benchmark; meant to be called in a fresh worker process.
+    :param name: (str) key of BENCHMARKS
+    :param paths: (dict) synthetic recording paths
+    :return: (dict) timings and memory
+    """
+    logger.remove()  # keep worker output quiet, including progress bars
+    sys.stdout = open(os.devnull, 'w')
+    rss_before = _rss_mb()
+    start_time = time.perf_counter()
+    n_bytes, n_items = BENCHMARKS[name](paths)
+    elapsed = time.perf_counter() - start_time
+    return {
+        'benchmark': name,
+        'seconds': elapsed,
+        'megabytes': n_bytes / 2 ** 20,
+        'mb_per_s': n_bytes / 2 ** 20 / elapsed if elapsed > 0 else float('nan'),
+        'items': n_items,
+        'items_per_s': n_items / elapsed if elapsed > 0 else float('nan'),
+        'rss_before_mb': rss_before,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+# ---------------- REPORT ----------------
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compare results to a baseline report.
+    :param results: (list) benchmark results
+    :param baseline: (dict) previous report
+    :param tolerance: (float) relative tolerance, e.g. 0.1 for 10%
+    :return: (list) regression messages
+    """
+    previous = {r['benchmark']: r for r in baseline['results']}
+    regressions = []
+    for res in results:
+        old = previous.get(res['benchmark'])
+        if old is None:
+            continue
+        if res['mb_per_s'] < old['mb_per_s'] * (1 - tolerance):
+            regressions.append('{}: throughput {:.1f} MB/s vs {:.1f} MB/s in baseline'.format(
+                res['benchmark'], res['mb_per_s'], old['mb_per_s']))
+        if res['peak_rss_mb'] and old['peak_rss_mb'] and res['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance):
+            regressions.append('{}: peak RSS {:.0f} MB vs {:.0f} MB in baseline'.format(
+                res['benchmark'], res['peak_rss_mb'], old['peak_rss_mb']))
+    return regressions
+
+
+def main(args):
+    from utils.synthetic_sglx import write_synthetic_recording
+
+    data_dir = Path(args.data_dir) if args.data_dir else Path(tempfile.mkdtemp(prefix='sglx_bench_'))
+    logger.info(f"Writing synthetic recording ({args.duration} s, {args.channels} channels, probes {args.probes}) to {data_dir}")
+    start_time = time.perf_counter()
+    paths = write_synthetic_recording(data_dir, duration_s=args.duration, probe_models=tuple(args.probes),
+                                      n_channels=args.channels, seed=args.seed)
+    logger.info(f"Synthetic recording written in {time.perf_counter() - start_time:.1f} s")
+    paths = {k: [str(p) for p in v] if isinstance(v, list) else str(v) for k, v in paths.items()}
+
+    names = args.benchmarks or list(BENCHMARKS.keys())
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    try:
+        for name in names:
+            for repeat in range(args.repeats):
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as executor:
+                    try:
+                        res = executor.submit(run_benchmark, name, paths).result()
+                    except Exception as e:
+                        logger.error(f"{name} FAILED: {e}")
+                        continue
+                res['repeat'] = repeat
+                results.append(res)
+                logger.info(f"{name:<22} {res['seconds']:8.2f} s {res['mb_per_s']:10.1f} MB/s "
+                            f"{res['items_per_s']:10.1f} items/s peak RSS {res['peak_rss_mb'] or float('nan'):8.0f} MB")
+    finally:
+        if not args.keep_data and not args.data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'duration_s': args.duration,
+        'n_channels': args.channels,
+        'probes': args.probes,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.success(f"Benchmark report written → {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for msg in regressions:
+            logger.error(f"REGRESSION {msg}")
+        if regressions:
+            sys.exit(1)
+        logger.success("No regression against baseline")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline steps on synthetic SpikeGLX data")
+    parser.add_argument("--duration", type=float, default=60.0, help="Recording duration in s (default: 60)")
+    parser.add_argument("--channels", type=int, default=384, help="Saved neural channels per probe (default: 384)")
+    parser.add_argument("--probes", nargs="+", default=["NP1.0"], choices=["NP1.0", "NP2.0"],
+                        help="Probe model of each probe (default: NP1.0)")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS.keys()),
+                        help="Benchmarks to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=1, help="Repeats of each benchmark (default: 1)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic data")
+    parser.add_argument("--data-dir", help="Folder for synthetic data (default: temporary folder, deleted after)")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the temporary synthetic data")
+    parser.add_argument("--output", help="Path of the JSON report")
+    parser.add_argument("--baseline", help="JSON report to compare against; exits with 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative regression tolerance (default: 0.1)")
+    main(parser.parse_args())
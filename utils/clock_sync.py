@@ -0,0 +1,151 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: clock_sync.py
+@time: 10/16/2026 4:20 PM
+@description: Clock alignment between SpikeGLX streams from the edges of the shared sync square wave (TPrime in NumPy).
+"""
+
+# Imports
+import numpy as np
+from dataclasses import dataclass
+from pathlib import Path
+from loguru import logger
+
+
+@dataclass(frozen=True)
+class ClockMap:
+    """
+    Piecewise-linear mapping from the clock of one stream (from) to the clock of another (to), through pairs of
+    matching sync edge times. Times before the first or after the last edge are extrapolated with the end segments.
+    """
+    from_edges: np.ndarray
+    to_edges: np.ndarray
+
+    @property
+    def n_edges(self):
+        return self.from_edges.size
+
+    @property
+    def drift_ppm(self):
+        """Overall clock rate difference of the to-stream relative to the from-stream, in ppm."""
+        if self.n_edges < 2:
+            return 0.0
+        slope = (self.to_edges[-1] - self.to_edges[0]) / (self.from_edges[-1] - self.from_edges[0])
+        return (slope - 1) * 1e6
+
+    def __call__(self, times):
+        return map_times(times, self)
+
+
+def load_edges(edges_path):
+    """
+    Load sync edge times (in s) written by CatGT, e.g. *.ap.xd_384_6_500.txt or *.nidq.xa_0_0.txt.
+    :param edges_path: (str or Path) path to edge file
+    :return: (np.ndarray) sorted edge times
+    """
+    return np.sort(np.loadtxt(edges_path, ndmin=1))
+
+
+def load_event_times(events_path):
+    """
+    Load event times (in s) from a .txt or .npy file, as accepted by TPrime.
+    :param events_path: (str or Path) path to event file
+    :return: (np.ndarray) event times
+    """
+    if Path(events_path).suffix == '.npy':
+        return np.load(events_path).ravel().astype('float64')
+    return np.loadtxt(events_path, ndmin=1)
+
+
+def save_event_times(events_path, times):
+    """
+    Save event times (in s) as .npy or .txt depending on the file extension, as TPrime does.
+    :param events_path: (str or Path) output path
+    :param times: (np.ndarray) event times
+    :return:
+    """
+    if Path(events_path).suffix == '.npy':
+        np.save(events_path, times)
+    else:
+        np.savetxt(events_path, times, fmt='%.6f')
+    return
+
+
+def _nearest_index(edges, times):
+    """Index of the nearest edge of each time, edges sorted."""
+    idx = np.clip(np.searchsorted(edges, times), 1, edges.size - 1)
+    return np.where(np.abs(times - edges[idx - 1]) <= np.abs(edges[idx] - times), idx - 1, idx)
+
+
+def fit_clock_map(from_edges, to_edges, sync_period=1.0):
+    """
+    Pair the sync edges of two streams and return the piecewise-linear clock mapping between them.
+    Each to-stream edge is paired with the nearest from-stream edge after correcting for the drift between clocks;
+    pairs whose offset differs from the linear drift by more than a quarter period (missing or spurious edges) are
+    dropped. As with TPrime, the streams must start within half a sync period of each other.
+    :param from_edges: (np.ndarray) sync edge times in the from-stream clock, in s
+    :param to_edges: (np.ndarray) sync edge times in the to-stream clock, in s
+    :param sync_period: (float) period of the sync square wave in s
+    :return: (ClockMap)
+    """
+    from_edges = np.sort(np.asarray(from_edges, dtype='float64'))
+    to_edges = np.sort(np.asarray(to_edges, dtype='float64'))
+    if from_edges.size < 2 or to_edges.size < 2:
+        raise ValueError('At least two sync edges are needed in each stream, got {} and {}.'.format(
+            from_edges.size, to_edges.size))
+
+    # Nearest from-stream edge for each to-stream edge, then offsets between clocks unwrapped over sync periods,
+    # so that drift of more than half a period over a long session does not pair edges of different periods
+    offset = from_edges[_nearest_index(from_edges, to_edges)] - to_edges
+    steps = np.round(np.diff(offset) / sync_period)
+    offset -= sync_period * np.concatenate([[0], np.cumsum(steps)])
+    nearest_idx = _nearest_index(from_edges, to_edges + offset)
+    nearest = from_edges[nearest_idx]
+
+    # Drop pairs off the linear drift of the offset (missing or spurious edges) and from-stream edges paired twice
+    offset = nearest - to_edges
+    elapsed = to_edges - to_edges[0]
+    drift = np.polyval(np.polyfit(elapsed, offset, 1), elapsed)
+    keep = np.abs(offset - drift) < sync_period / 4
+    keep[1:] &= np.diff(nearest_idx) > 0
+    if keep.sum() < 2:
+        raise ValueError('Fewer than two matching sync edges between streams.')
+    n_dropped = keep.size - keep.sum()
+    if n_dropped:
+        logger.debug('Dropped {} unmatched sync edges.'.format(n_dropped))
+    return ClockMap(from_edges=nearest[keep], to_edges=to_edges[keep])
+
+
+def map_times(times, clock_map):
+    """
+    Map times from the from-stream clock to the to-stream clock. Vectorized: one np.searchsorted over the edges.
+    :param times: (np.ndarray) times in the from-stream clock, in s
+    :param clock_map: (ClockMap) mapping between clocks
+    :return: (np.ndarray) float64 times in the to-stream clock, same shape as times
+    """
+    times = np.asarray(times, dtype='float64')
+    from_edges, to_edges = clock_map.from_edges, clock_map.to_edges
+    seg = np.searchsorted(from_edges, times, side='right') - 1
+    np.clip(seg, 0, from_edges.size - 2, out=seg)
+
+    # Local rate of each segment, applied from its first edge
+    slopes = np.diff(to_edges) / np.diff(from_edges)
+    return to_edges[seg] + (times - from_edges[seg]) * slopes[seg]
+
+
+def align_events(events_path, from_edges_path, to_edges_path, output_path, sync_period=1.0):
+    """
+    Map an event file from one stream to another and save it, the equivalent of one TPrime -events argument.
+    :param events_path: (str or Path) event times in the from-stream clock (.txt or .npy)
+    :param from_edges_path: (str or Path) sync edge file of the from-stream
+    :param to_edges_path: (str or Path) sync edge file of the to-stream
+    :param output_path: (str or Path) output event file (.txt or .npy)
+    :param sync_period: (float) period of the sync square wave in s
+    :return: (np.ndarray) mapped event times
+    """
+    clock_map = fit_clock_map(load_edges(from_edges_path), load_edges(to_edges_path), sync_period)
+    times = map_times(load_event_times(events_path), clock_map)
+    save_event_times(output_path, times)
+    return times
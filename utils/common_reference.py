@@ -0,0 +1,159 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: common_reference.py
+@time: 10/16/2026 7:50 PM
+@description: Streaming high-pass filter and global common median/average referencing of SpikeGLX AP data (the
+equivalent of CatGT -gblcar), written to a new file or applied on the fly when data are read.
+"""
+
+# Imports
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.signal import butter, sosfiltfilt
+
+from utils import readSGLX
+
+
+def highpass_sos(sample_rate, highpass_hz=300., order=3):
+    """
+    Butterworth high-pass filter, as second-order sections.
+    :param sample_rate: sampling rate in Hz
+    :param highpass_hz: cutoff frequency in Hz, None for no filter
+    :param order: filter order, applied forward and backward (zero phase)
+    :return: (np.ndarray) second-order sections, or None
+    """
+    if highpass_hz is None:
+        return None
+    return butter(order, highpass_hz, btype='highpass', fs=sample_rate, output='sos')
+
+
+def filter_block(data, core, n_neural, sos=None, reference='median'):
+    """
+    High-pass filter and re-reference a block of samples, and keep its core. The samples around the core (overlap)
+    are only used to absorb the edge effects of the filter.
+    :param data: (np.ndarray) int16 block (channels x samples), neural channels first
+    :param core: (slice) samples of the block to return
+    :param n_neural: number of neural channels; the following channels (e.g. sync) are copied unchanged
+    :param sos: (np.ndarray) high-pass filter, see highpass_sos, or None
+    :param reference: 'median' or 'mean' over neural channels at each sample, or None
+    :return: (np.ndarray) int16 core (channels x core samples)
+    """
+    neural = data[:n_neural].astype('float32')
+    if sos is not None and neural.shape[1] > 1:
+        padlen = min(3 * (2 * len(sos) + 1), neural.shape[1] - 1)
+        neural = sosfiltfilt(sos, neural, axis=1, padlen=padlen).astype('float32')
+    neural = neural[:, core]
+    if reference == 'median':
+        neural -= np.median(neural, axis=0, keepdims=True)
+    elif reference == 'mean':
+        neural -= neural.mean(axis=0, keepdims=True)
+    elif reference is not None:
+        raise ValueError('Unknown reference {}, must be median, mean or None.'.format(reference))
+
+    out = np.empty((data.shape[0], neural.shape[1]), dtype='int16')
+    np.clip(np.rint(neural), -32768, 32767, out=out[:n_neural], casting='unsafe')
+    out[n_neural:] = data[n_neural:, core]
+    return out
+
+
+def filtered_chunks(chunks, n_neural, sos=None, reference='median'):
+    """
+    Lazily filter and re-reference a stream of chunks, e.g. from readSGLX.StreamChunks with overlapSamp set.
+    :param chunks: iterable of readSGLX.RawChunk
+    :param n_neural: number of neural channels
+    :param sos: (np.ndarray) high-pass filter, see highpass_sos, or None
+    :param reference: 'median', 'mean' or None
+    :return: generator of readSGLX.RawChunk holding only the filtered core of each chunk
+    """
+    for chunk in chunks:
+        yield readSGLX.RawChunk(chunk.firstSamp + chunk.core.start, slice(0, chunk.core.stop - chunk.core.start),
+                                filter_block(chunk.data, chunk.core, n_neural, sos, reference))
+
+
+def write_filtered(chunks, output_path, n_neural, sos=None, reference='median', n_workers=4):
+    """
+    Filter and re-reference a stream of chunks in a process pool, and write the result sequentially to a binary
+    file (time-major int16, as SpikeGLX). At most 2 x n_workers chunks are held in memory.
+    :param chunks: iterable of readSGLX.RawChunk, e.g. from readSGLX.StreamChunks with overlapSamp set
+    :param output_path: path to the output .bin file
+    :param n_neural: number of neural channels
+    :param sos: (np.ndarray) high-pass filter, see highpass_sos, or None
+    :param reference: 'median', 'mean' or None
+    :param n_workers: number of processes
+    :return: (int) number of samples written
+    """
+    n_samples = 0
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as executor, open(output_path, 'wb') as f:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(filter_block, chunk.data, chunk.core, n_neural, sos, reference))
+            if len(pending) >= 2 * n_workers:
+                block = pending.popleft().result()
+                np.ascontiguousarray(block.T).tofile(f)
+                n_samples += block.shape[1]
+        while pending:
+            block = pending.popleft().result()
+            np.ascontiguousarray(block.T).tofile(f)
+            n_samples += block.shape[1]
+    return n_samples
+
+
+class FilteredRaw:
+    """
+    Read-only view of a binary file, high-pass filtered and re-referenced when read, sliced like the memmap of
+    readSGLX.makeMemMapRaw: rawData[channels, timepoints] with a slice of timepoints. Each read covers all channels
+    (needed for the reference) and overlap_samples on each side of the requested samples.
+    """
+
+    def __init__(self, bin_path, meta, highpass_hz=300., order=3, reference='median', overlap_samples=3000):
+        """
+        :param bin_path: path to .bin (or compressed) file
+        :param meta: (dict) metadata of the file
+        :param highpass_hz: cutoff frequency in Hz, None for no filter
+        :param order: filter order
+        :param reference: 'median', 'mean' or None
+        :param overlap_samples: samples read on each side of the requested samples
+        """
+        self._raw = readSGLX.openRaw(bin_path, meta)
+        self.shape = self._raw.shape
+        self.dtype = np.dtype('int16')
+        self.ndim = 2
+        if meta['typeThis'] == 'imec':
+            self.n_neural = sum(readSGLX.ChannelCountsIM(meta)[:2])  # AP or LF channels, without sync
+        else:
+            self.n_neural = self.shape[0]
+        self.sos = highpass_sos(readSGLX.SampRate(meta), highpass_hz, order)
+        self.reference = reference
+        self.overlap_samples = int(overlap_samples)
+
+    def close(self):
+        if hasattr(self._raw, 'close'):
+            self._raw.close()
+
+    def __getitem__(self, item):
+        if not isinstance(item, tuple):
+            item = (item,)
+        chan_index = item[0]
+        samp_index = item[1] if len(item) > 1 else slice(None)
+        if np.isscalar(samp_index):
+            samp_index = int(samp_index) % self.shape[1]
+            return self[chan_index, samp_index:samp_index + 1][..., 0]
+        if not isinstance(samp_index, slice):
+            raise TypeError('FilteredRaw only supports a slice or an int of timepoints.')
+        start, stop, step = samp_index.indices(self.shape[1])
+        stop = max(stop, start)
+
+        first = max(start - self.overlap_samples, 0)
+        last = min(stop + self.overlap_samples, self.shape[1])
+        data = np.asarray(self._raw[:, first:last])
+        block = filter_block(data, slice(start - first, stop - first), self.n_neural, self.sos, self.reference)
+        return block[chan_index, ::step]
+
+    def __array__(self, dtype=None):
+        data = self[:, :]
+        return data if dtype is None else data.astype(dtype)
@@ -315,11 +315,21 @@ def _save_motion_figure(motion, figures_folder: Path):
 def collect_all_jobs(
     data_root: Path,
     use_lfp: bool = False,
+    use_index: bool = False,
 ):
     data_root = Path(data_root)
     pattern   = "*corrected*.lf.bin" if use_lfp else "*corrected*.ap.bin"
     jobs      = []
 
+    if use_index:
+        # Query the session index instead of walking the data root
+        from utils import session_index
+        index = session_index.get_session_index(data_root)
+        for bin_file in session_index.query_files(index, pattern=pattern):
+            jobs.append((bin_file, bin_file.parent / "dredge"))
+            log.info("Queued: %s", bin_file.relative_to(data_root))
+        return jobs
+
     for mouse_dir in sorted(data_root.iterdir())[20:30]:
         if not mouse_dir.is_dir():
             continue
@@ -357,9 +367,10 @@ def run_all(
     overwrite: bool = False,
     skip_existing: bool = True,
     ram_threshold_gb: float = 12.0,
+    use_index: bool = False,
 ):
     data_root = Path(data_root)
-    jobs = collect_all_jobs(data_root, use_lfp=use_lfp)
+    jobs = collect_all_jobs(data_root, use_lfp=use_lfp, use_index=use_index)
 
     if not jobs:
         log.warning("No corrected .bin files found under %s", data_root)
@@ -0,0 +1,172 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: event_schema.py
+@time: 10/16/2026 6:40 PM
+@description: Event schema of the NI channels, shared by event extraction (CatGT) and alignment (TPrime), and
+manifests recording what was extracted or aligned so that only changed events are processed again.
+"""
+
+# Imports
+import os
+import json
+import hashlib
+from loguru import logger
+
+# Name of the NI sync square wave in the schema, extracted but not aligned
+SYNC_EVENT = 'nidq_sync'
+
+# Schema used when the config has no events section, as previously hard-coded
+DEFAULT_EVENTS = {
+    'nidq_sync': {'kind': 'xa', 'word': 0, 'thresh1': 1, 'thresh2': 0, 'ms': 0, 'align': False},
+    'trial_start_times': {'kind': 'xa', 'word': 1, 'thresh1': 4, 'thresh2': 0, 'ms': 0},
+    'auditory_stim_times': {'kind': 'xa', 'word': 2, 'thresh1': 1, 'thresh2': 1, 'ms': 0},
+    'whisker_stim_times': {'kind': 'xa', 'word': 3, 'thresh1': 1, 'thresh2': 1, 'ms': 0},
+    'cam0_frame_times': {'kind': 'xa', 'word': 5, 'thresh1': 2, 'thresh2': 0, 'ms': 0},
+    'cam1_frame_times': {'kind': 'xa', 'word': 6, 'thresh1': 2, 'thresh2': 0, 'ms': 0},
+    'piezo_licks': {'kind': 'xa', 'word': 7, 'thresh1': 0.005, 'thresh2': 0.010, 'ms': 0},
+    'valve_times': {'kind': 'xa', 'word': 4, 'thresh1': 2, 'thresh2': 0, 'ms': 0, 'mice': ['AB']},
+    'context_transition_on': {'kind': 'xa', 'word': 4, 'thresh1': 2, 'thresh2': 0, 'ms': 0, 'mice': ['PB']},
+    'context_transition_off': {'kind': 'xia', 'word': 4, 'thresh1': 2, 'thresh2': 0, 'ms': 0, 'mice': ['PB']},
+}
+
+# Manifest of the extracted events, in the catgt_ epoch folder
+EXTRACTION_MANIFEST = 'catgt_events.json'
+
+# Fields of an event that change its extraction
+EXTRACTION_FIELDS = ('kind', 'word', 'thresh1', 'thresh2', 'ms')
+
+
+def load_event_schema(events, epoch_name):
+    """
+    Events of a session from the config events section: name to CatGT extraction parameters of an NI channel.
+    Each event has a kind ('xa' rising or 'xia' falling edges of an analog channel), a word (NI channel), the
+    thresholds thresh1 and thresh2 in V and the pulse duration ms (0 for any duration) of CatGT -xa/-xia, whether it
+    is aligned (default True), and optionally the mouse name prefixes (mice) it applies to.
+    :param events: (dict) config events section, or None for the default schema
+    :param epoch_name: epoch name, starting with the mouse name
+    :return: (dict) event name to parameters, in config order
+    """
+    events = DEFAULT_EVENTS if events is None else events
+    if SYNC_EVENT not in events:
+        raise ValueError('The event schema needs a {} event for the NI sync square wave.'.format(SYNC_EVENT))
+
+    schema = {}
+    suffixes = {}
+    for name, spec in events.items():
+        mice = spec.get('mice')
+        if mice and not any(epoch_name.startswith(prefix) for prefix in mice):
+            continue
+        if spec.get('kind', 'xa') not in ('xa', 'xia'):
+            raise ValueError('Event {}: kind must be xa or xia, got {}.'.format(name, spec['kind']))
+        schema[name] = {'kind': spec.get('kind', 'xa'),
+                        'word': int(spec['word']),
+                        'thresh1': float(spec['thresh1']),
+                        'thresh2': float(spec.get('thresh2', 0)),
+                        'ms': float(spec.get('ms', 0)),
+                        'align': bool(spec.get('align', name != SYNC_EVENT))}
+
+        # CatGT names the output file from kind, word and ms: two events cannot share them
+        suffix = event_suffix(schema[name])
+        if suffix in suffixes:
+            raise ValueError('Events {} and {} are both extracted to {}.'.format(suffixes[suffix], name, suffix))
+        suffixes[suffix] = name
+    return schema
+
+
+def catgt_arg(spec):
+    """
+    CatGT command line argument extracting an event from the NI stream.
+    :param spec: (dict) event parameters, see load_event_schema
+    :return: (str) e.g. '-xa=0,0,3,1,1,0'
+    """
+    return '-{}=0,0,{},{:g},{:g},{:g}'.format(spec['kind'], spec['word'], spec['thresh1'], spec['thresh2'],
+                                              spec['ms'])
+
+
+def event_suffix(spec):
+    """
+    Suffix of the file CatGT writes for an event, e.g. 'xa_3_0'.
+    :param spec: (dict) event parameters, see load_event_schema
+    :return: (str)
+    """
+    return '{}_{}_{:g}'.format(spec['kind'], spec['word'], spec['ms'])
+
+
+def event_file_name(run_name, spec):
+    """
+    Name of the file CatGT writes for an event.
+    :param run_name: run name with gate index, e.g. MOUSENAME_gX
+    :param spec: (dict) event parameters, see load_event_schema
+    :return: (str) e.g. 'MOUSENAME_gX_tcat.nidq.xa_3_0.txt'
+    """
+    return '{}_tcat.nidq.{}.txt'.format(run_name, event_suffix(spec))
+
+
+def spec_key(spec):
+    """
+    Hash of the extraction parameters of an event.
+    :param spec: (dict) event parameters, see load_event_schema
+    :return: (str) hex digest
+    """
+    fields = {field: spec[field] for field in EXTRACTION_FIELDS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def inputs_key(input_paths, *params):
+    """
+    Content hash of input files and parameters.
+    :param input_paths: (list) paths to the input files
+    :param params: parameters, hashed by their string representation
+    :return: (str) hex digest
+    """
+    digest = hashlib.sha1('|'.join(str(param) for param in params).encode('utf-8'))
+    for path in input_paths:
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).digest())
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Load a manifest of processed events.
+    :param manifest_path: path to the JSON manifest
+    :return: (dict) event or file name to key, empty if there is no manifest
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def update_manifest(manifest_path, keys):
+    """
+    Add or replace entries of a manifest of processed events.
+    :param manifest_path: path to the JSON manifest
+    :param keys: (dict) event or file name to key
+    :return:
+    """
+    manifest = load_manifest(manifest_path)
+    manifest.update(keys)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return
+
+
+def changed_events(schema, manifest_path, event_dir, run_name):
+    """
+    Events to extract again: those whose file is missing or whose parameters changed since they were extracted.
+    :param schema: (dict) event name to parameters, see load_event_schema
+    :param manifest_path: path to the extraction manifest
+    :param event_dir: folder of the extracted event files
+    :param run_name: run name with gate index, e.g. MOUSENAME_gX
+    :return: (list) event names
+    """
+    manifest = load_manifest(manifest_path)
+    changed = [name for name, spec in schema.items()
+               if manifest.get(name) != spec_key(spec)
+               or not os.path.exists(os.path.join(event_dir, event_file_name(run_name, spec)))]
+    if changed:
+        logger.info('Events to extract: {}.'.format(changed))
+    return changed
@@ -0,0 +1,68 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: event_store.py
+@time: 10/16/2026 5:40 PM
+@description: Session event store: all aligned event times of a session in one uncompressed .npz, read without copy.
+"""
+
+# Imports
+import struct
+import zipfile
+import numpy as np
+from pathlib import Path
+
+
+def write_event_store(store_path, events):
+    """
+    Write aligned event arrays of a session to one uncompressed .npz file.
+    :param store_path: (str or Path) path to the .npz file
+    :param events: (dict) name to array, e.g. 'imec0_spike_times', 'imec0_spike_clusters', 'trial_start_times'
+    :return:
+    """
+    store_path = Path(store_path)
+    tmp_path = store_path.with_name(store_path.stem + '.tmp.npz')
+    np.savez(tmp_path, **{name: np.ascontiguousarray(array) for name, array in events.items()})
+    tmp_path.replace(store_path)
+    return
+
+
+def load_event_store(store_path, mmap=True):
+    """
+    Load a session event store. With mmap, each array is a read-only memmap of its bytes in the .npz file, so that
+    arrays are only read from disk when accessed.
+    :param store_path: (str or Path) path to the .npz file
+    :param mmap: (bool) memory-map the arrays instead of reading them
+    :return: (dict) name to array
+    """
+    if not mmap:
+        with np.load(store_path) as store:
+            return {name: store[name] for name in store.files}
+
+    events = {}
+    with zipfile.ZipFile(store_path) as zf, open(store_path, 'rb') as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('{} is compressed, cannot memory-map {}.'.format(store_path, info.filename))
+
+            # Array data start after the local file header and the .npy header
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            name = info.filename[:-len('.npy')]
+            if dtype.hasobject:
+                raise ValueError('Cannot memory-map object array {}.'.format(name))
+            if int(np.prod(shape)) == 0:
+                events[name] = np.empty(shape, dtype=dtype)
+            else:
+                events[name] = np.memmap(store_path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return events
@@ -23,9 +23,19 @@ the 'meta' dictionary will make your data handling
 much easier!
 
 """
+import os
+import re
+import json
+import hashlib
 import numpy as np
 import matplotlib.pyplot as plt
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache, cached_property
 from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, Optional, Tuple
 from tkinter import Tk
 from tkinter import filedialog
 
@@ -59,6 +69,155 @@ def readMeta(binFullPath):
     return (metaDict)
 
 
+# Parsed, immutable view of a SpikeGLX meta file.
+# Numeric entries needed by the pipeline are converted once, when the file
+# is read; the original string dictionary stays available as 'raw' (read
+# only) so it can still be passed to the other helpers of this module,
+# e.g. OriginalChans(info.raw).
+# Instances are obtained with readMetaInfo(), which memoizes them.
+#
+@dataclass(frozen=True)
+class MetaInfo:
+    metaPath: Path
+    mtimeNs: int
+    raw: Mapping[str, str]
+    typeThis: str
+    sampRate: float
+    nSavedChans: int
+    fileSizeBytes: int
+    nFileSamp: int
+    chanCounts: Tuple[int, ...]  # (AP, LF, SY) for imec, (MN, MA, XA, DW) for nidq
+    firstSample: int
+    syncPeriod: Optional[float]
+    probeType: Optional[int]
+    probePartNumber: Optional[str]
+    imroTbl: Optional[str]
+
+    @property
+    def binPath(self):
+        return self.metaPath.with_suffix('.bin')
+
+    @property
+    def duration(self):
+        return self.nFileSamp / self.sampRate
+
+    @property
+    def isImec(self):
+        return self.typeThis == 'imec'
+
+    # index of the sync channel (imec) or of the first digital word (nidq)
+    @property
+    def syncChan(self):
+        return sum(self.chanCounts[:-1])
+
+    # int16 -> volts conversion factor of every saved channel
+    @cached_property
+    def conv(self):
+        return ChanConvIM(self.raw) if self.isImec else ChanConvNI(self.raw)
+
+    # (APgain, LFgain) indexed by acquired channel ID, see ChanGainsIM
+    @cached_property
+    def gains(self):
+        APgain, LFgain = ChanGainsIM(self.raw)
+        APgain.setflags(write=False)
+        LFgain.setflags(write=False)
+        return (APgain, LFgain)
+
+    # (shankInd, xCoord, yCoord, connected) of the saved AP channels, in um
+    @cached_property
+    def geometry(self):
+        from utils.sglx_meta_to_coords import geomMapToGeom, shankMapToGeom
+        if 'snsGeomMap' in self.raw:
+            geom = geomMapToGeom(self.raw)
+        else:
+            geom = shankMapToGeom(self.raw)
+        shankInd, xCoord, yCoord, connected = geom[3:7]
+        for arr in (shankInd, xCoord, yCoord, connected):
+            arr.setflags(write=False)
+        return (shankInd, xCoord, yCoord, connected)
+
+
+def _metaInfoFromDict(metaPath, mtimeNs, metaDict):
+    typeThis = metaDict.get('typeThis', 'imec')
+    nSavedChans = int(metaDict['nSavedChans'])
+    fileSizeBytes = int(metaDict['fileSizeBytes'])
+    if typeThis == 'imec':
+        chanCounts = ChannelCountsIM(metaDict)
+    else:
+        chanCounts = ChannelCountsNI(metaDict)
+    return MetaInfo(
+        metaPath=Path(metaPath),
+        mtimeNs=mtimeNs,
+        raw=MappingProxyType(dict(metaDict)),
+        typeThis=typeThis,
+        sampRate=SampRate(metaDict),
+        nSavedChans=nSavedChans,
+        fileSizeBytes=fileSizeBytes,
+        nFileSamp=int(fileSizeBytes / (2 * nSavedChans)),
+        chanCounts=chanCounts,
+        firstSample=int(metaDict.get('firstSample', 0)),
+        syncPeriod=float(metaDict['syncSourcePeriod']) if 'syncSourcePeriod' in metaDict else None,
+        probeType=int(metaDict['imDatPrb_type']) if 'imDatPrb_type' in metaDict else None,
+        probePartNumber=metaDict.get('imDatPrb_pn'),
+        imroTbl=metaDict.get('imroTbl'),
+    )
+
+
+# In-process cache of MetaInfo, keyed by meta path, mtime and size
+_metaInfoCache = {}
+
+# Default folder of the on-disk sidecar cache. It is kept on the local
+# disk on purpose: the meta files themselves live on the network share.
+DEFAULT_META_CACHE_DIR = Path.home() / '.ephys_utils' / 'meta_cache'
+
+
+def _sidecarPath(metaPath, cacheDir):
+    digest = hashlib.sha1(str(metaPath.resolve()).encode('utf-8')).hexdigest()
+    return Path(cacheDir) / '{}_{}.json'.format(metaPath.stem, digest[:16])
+
+
+# Return a MetaInfo for the meta file matching binFullPath (.bin or .meta).
+# Results are memoized by path and modification time, in memory and in a
+# JSON sidecar in cacheDir (set cacheDir=None to disable the sidecar), so a
+# batch scan only stats each meta file once it has been parsed before.
+# Raises FileNotFoundError when the meta file is missing.
+#
+def readMetaInfo(binFullPath, cacheDir=DEFAULT_META_CACHE_DIR):
+    binFullPath = Path(binFullPath)
+    metaPath = Path(binFullPath.parent / (binFullPath.stem + '.meta'))
+    st = os.stat(metaPath)
+    key = (str(metaPath), st.st_mtime_ns, st.st_size)
+    info = _metaInfoCache.get(key)
+    if info is not None:
+        return (info)
+
+    metaDict = None
+    sidecar = _sidecarPath(metaPath, cacheDir) if cacheDir is not None else None
+    if sidecar is not None and sidecar.exists():
+        try:
+            with sidecar.open() as f:
+                cached = json.load(f)
+            if cached['mtimeNs'] == st.st_mtime_ns and cached['size'] == st.st_size:
+                metaDict = cached['meta']
+        except (OSError, ValueError, KeyError):
+            metaDict = None
+
+    if metaDict is None:
+        metaDict = readMeta(metaPath)
+        if sidecar is not None:
+            try:
+                sidecar.parent.mkdir(parents=True, exist_ok=True)
+                with sidecar.open('w') as f:
+                    json.dump({'metaPath': str(metaPath), 'mtimeNs': st.st_mtime_ns,
+                               'size': st.st_size, 'meta': metaDict}, f)
+            except OSError:
+                pass  # the sidecar is only an optimization
+
+    info = _metaInfoFromDict(metaPath, st.st_mtime_ns, metaDict)
+    _metaInfoCache[key] = info
+    return (info)
+
+
 # Return sample rate as python float.
 # On most systems, this will be implemented as C++ double.
 # Use python command sys.float_info to get properties of float on your system.
@@ -206,6 +365,81 @@ def ChanGainsIM(meta):
     return (APgain, LFgain)
 
 
+# Meta entries that determine the per-channel conversion factors.
+# The conversion vectors are cached on these values, so that converting
+# many blocks of the same file does not re-parse the imro table each time.
+#
+_convKeysNI = ('typeThis', 'niAiRangeMax', 'snsMnMaXaDw', 'niMNGain',
+               'niMAGain', 'nSavedChans')
+_convKeysIM = ('typeThis', 'imMaxInt', 'imAiRangeMax', 'snsSaveChanSubset',
+               'nSavedChans', 'acqApLfSy', 'imDatPrb_type', 'imroTbl',
+               'imChan0apGain', 'imChan0lfGain')
+
+
+def _convItems(meta, keys):
+    return tuple((k, meta[k]) for k in keys if k in meta)
+
+
+@lru_cache(maxsize=64)
+def _chanConvNI(metaItems):
+    meta = dict(metaItems)
+    MN, MA, XA, DW = ChannelCountsNI(meta)
+    fI2V = Int2Volts(meta)
+    gains = np.ones(int(meta['nSavedChans']))
+    gains[:MN] = float(meta['niMNGain']) if MN > 0 else 1
+    gains[MN:MN + MA] = float(meta['niMAGain']) if MA > 0 else 1
+    conv = fI2V / gains
+    conv.setflags(write=False)
+    return (conv)
+
+
+@lru_cache(maxsize=64)
+def _chanConvIM(metaItems):
+    meta = dict(metaItems)
+    # Look up gain with acquired channel ID
+    chans = OriginalChans(meta)
+    APgain, LFgain = ChanGainsIM(meta)
+    nAP = len(APgain)
+    nLF = len(LFgain)  # 0 for NP2.0, whose sync channel follows the AP channels
+    fI2V = Int2Volts(meta)
+
+    # channels that are neither AP nor LF (e.g. sync) are left unscaled
+    conv = np.ones(len(chans))
+    isAP = chans < nAP
+    isLF = (chans >= nAP) & (chans < nAP + nLF)
+    conv[isAP] = fI2V / APgain[chans[isAP]]
+    conv[isLF] = fI2V / LFgain[chans[isLF] - nAP]
+    conv.setflags(write=False)
+    return (conv)
+
+
+# Return the conversion factor (int16 -> volts) of every saved channel of
+# a nidq file, as a read-only float64 vector of length nSavedChans.
+#
+def ChanConvNI(meta):
+    return (_chanConvNI(_convItems(meta, _convKeysNI)))
+
+
+# Return the conversion factor (int16 -> volts) of every saved channel of
+# an imec file, as a read-only float64 vector of length nSavedChans.
+#
+def ChanConvIM(meta):
+    return (_chanConvIM(_convItems(meta, _convKeysIM)))
+
+
+# Multiply each row of dataArray by the matching conversion factor with a
+# single broadcast multiply. The result is written into out when given
+# (which may be dataArray itself for an in-place conversion of float data),
+# otherwise into a new array of the requested dtype.
+#
+def _applyConv(dataArray, conv, dtype, out):
+    if out is None:
+        out = np.empty(dataArray.shape, dtype=dtype)
+    conv = conv.astype(out.dtype, copy=False)
+    np.multiply(dataArray, conv[:, np.newaxis], out=out, casting='unsafe')
+    return (out)
+
+
 # Having accessed a block of raw nidq data using makeMemMapRaw, convert
 # values to gain-corrected voltage. The conversion is only applied to the
 # saved-channel indices in chanList. Remember, saved-channel indices are
@@ -214,22 +448,14 @@ def ChanGainsIM(meta):
 # [0:MN-1]  all MN channels (MN from ChannelCountsNI)
 # [2,6,20]  just these three channels (zero based, as they appear in SGLX).
 #
-def GainCorrectNI(dataArray, chanList, meta):
-    MN, MA, XA, DW = ChannelCountsNI(meta)
-    fI2V = Int2Volts(meta)
-    # print statements used for testing...
-    # print("NI fI2V: %.3e" % (fI2V))
-    # print("NI ChanGainNI: %.3f" % (ChanGainNI(0, MN, MA, meta)))
-
-    # make array of floats to return. dataArray contains only the channels
-    # in chanList, so output matches that shape
-    convArray = np.zeros(dataArray.shape, dtype=float)
-    for i in range(0, len(chanList)):
-        j = chanList[i]  # index into timepoint
-        conv = fI2V / ChanGainNI(j, MN, MA, meta)
-        # dataArray contains only the channels in chanList
-        convArray[i, :] = dataArray[i, :] * conv
-    return (convArray)
+# dtype sets the output precision ('float32' halves the memory of the
+# default float64), out is an optional preallocated output buffer.
+#
+def GainCorrectNI(dataArray, chanList, meta, dtype='float', out=None):
+    # dataArray contains only the channels in chanList, so the
+    # conversion vector is indexed the same way
+    conv = ChanConvNI(meta)[np.asarray(chanList, dtype=int)]
+    return (_applyConv(dataArray, conv, dtype, out))
 
 
 # Having accessed a block of raw imec data using makeMemMapRaw, convert
@@ -242,31 +468,14 @@ def GainCorrectNI(dataArray, chanList, meta):
 # Remember that for an lf file, the saved channel indices (fetched by
 # OriginalChans) will be in the range 384-767 for a standard 3A or 3B probe.
 #
-def GainCorrectIM(dataArray, chanList, meta):
-    # Look up gain with acquired channel ID
-    chans = OriginalChans(meta)
-    APgain, LFgain = ChanGainsIM(meta)
-    nAP = len(APgain)
-    nNu = nAP * 2
-
-    # Common conversion factor
-    fI2V = Int2Volts(meta)
-
-    # make array of floats to return. dataArray contains only the channels
-    # in chanList, so output matches that shape
-    convArray = np.zeros(dataArray.shape, dtype='float')
-    for i in range(0, len(chanList)):
-        j = chanList[i]  # index into timepoint
-        k = chans[j]  # acquisition index
-        if k < nAP:
-            conv = fI2V / APgain[k]
-        elif k < nNu:
-            conv = fI2V / LFgain[k - nAP]
-        else:
-            conv = 1
-        # The dataArray contains only the channels in chanList
-        convArray[i, :] = dataArray[i, :] * conv
-    return (convArray)
+# dtype sets the output precision ('float32' halves the memory of the
+# default float64), out is an optional preallocated output buffer.
+#
+def GainCorrectIM(dataArray, chanList, meta, dtype='float', out=None):
+    # dataArray contains only the channels in chanList, so the
+    # conversion vector is indexed the same way
+    conv = ChanConvIM(meta)[np.asarray(chanList, dtype=int)]
+    return (_applyConv(dataArray, conv, dtype, out))
 
 
 # Return memmap for the raw data
@@ -281,6 +490,525 @@ def makeMemMapRaw(binFullPath, meta):
     return (rawData)
 
 
+# Return the paths (.cbin, .ch) of the compressed version of a binary file,
+# e.g. run_g0_tcat.imec0.ap.bin -> run_g0_tcat.imec0.ap.cbin/.ch
+# The .meta file is shared with the uncompressed file.
+#
+def CompressedPaths(binFullPath):
+    binFullPath = Path(binFullPath)
+    stem = binFullPath.stem
+    return (binFullPath.with_name(stem + '.cbin'), binFullPath.with_name(stem + '.ch'))
+
+
+# Return True if binFullPath should be read from its compressed version:
+# either it is a .cbin itself, or only the compressed file exists.
+#
+def IsCompressed(binFullPath):
+    binFullPath = Path(binFullPath)
+    if binFullPath.suffix == '.cbin':
+        return (True)
+    return (not binFullPath.exists() and CompressedPaths(binFullPath)[0].exists())
+
+
+# Losslessly compress a SpikeGLX binary file with mtscomp (chunked,
+# per-channel time-difference followed by zlib, with a seek index of the
+# chunk offsets stored in the .ch JSON file). int16 Neuropixels data
+# typically compresses 2-3x. The original file is left untouched.
+#
+def CompressBin(binFullPath, meta, chunkDuration=1., nThreads=None, check=True):
+    import mtscomp
+    cbinPath, chPath = CompressedPaths(binFullPath)
+    mtscomp.compress(binFullPath, cbinPath, chPath,
+                     sample_rate=SampRate(meta),
+                     n_channels=int(meta['nSavedChans']),
+                     dtype=np.int16,
+                     chunk_duration=chunkDuration,
+                     n_threads=nThreads,
+                     check_after_compress=check,
+                     quiet=True)
+    return (cbinPath, chPath)
+
+
+# Read-only random access to a compressed binary file, sliced like the
+# memmap returned by makeMemMapRaw: rawData[channels, timepoints].
+# Only the chunks covering the requested samples are decompressed (the
+# most recent ones are cached by the mtscomp reader). Sample indices can
+# be a slice, an int or an integer array of any shape; the channel index
+# is applied as an outer selection, e.g. rawData[:, idx] with a 2D idx
+# returns an array of shape (nChan,) + idx.shape, as for the memmap.
+#
+class CompressedRaw:
+    def __init__(self, binFullPath, meta):
+        import mtscomp
+        cbinPath, chPath = CompressedPaths(binFullPath)
+        if Path(binFullPath).suffix == '.cbin':
+            cbinPath = Path(binFullPath)
+        self._reader = mtscomp.Reader()
+        self._reader.open(cbinPath, chPath)
+        self.shape = (int(self._reader.n_channels), int(self._reader.n_samples))
+        self.dtype = np.dtype(self._reader.dtype)
+        self.ndim = 2
+
+    def close(self):
+        self._reader.close()
+
+    def _gather(self, sampIdx):
+        # decompress each needed chunk once, then scatter its samples
+        flat = np.asarray(sampIdx, dtype='int64').ravel()
+        flat = np.where(flat < 0, flat + self.shape[1], flat)
+        if flat.size and (flat.min() < 0 or flat.max() >= self.shape[1]):
+            raise IndexError('sample index out of bounds for axis 1 with size {}'.format(self.shape[1]))
+        bounds = np.asarray(self._reader.chunk_bounds)
+        chunkIds = np.searchsorted(bounds, flat, side='right') - 1
+        out = np.empty((self.shape[0], flat.size), dtype=self.dtype)
+        for chunkIdx in np.unique(chunkIds):
+            pos = np.flatnonzero(chunkIds == chunkIdx)
+            chunkStart = int(bounds[chunkIdx])
+            chunk = self._reader[chunkStart:int(bounds[chunkIdx + 1])]
+            out[:, pos] = chunk[flat[pos] - chunkStart, :].T
+        return (out.reshape((self.shape[0],) + np.shape(sampIdx)))
+
+    def __getitem__(self, item):
+        if not isinstance(item, tuple):
+            item = (item,)
+        chanIdx = item[0]
+        sampIdx = item[1] if len(item) > 1 else slice(None)
+        if isinstance(sampIdx, slice):
+            data = self._reader[sampIdx].T
+        elif np.isscalar(sampIdx):
+            data = self._reader[int(sampIdx)]
+        else:
+            data = self._gather(sampIdx)
+        return (data[chanIdx])
+
+    def __array__(self, dtype=None):
+        data = self[:, :]
+        return (data if dtype is None else data.astype(dtype))
+
+
+# Return an object sliced like makeMemMapRaw for binFullPath, reading the
+# compressed version transparently when IsCompressed(binFullPath).
+#
+def openRaw(binFullPath, meta):
+    if IsCompressed(binFullPath):
+        return (CompressedRaw(binFullPath, meta))
+    return (makeMemMapRaw(binFullPath, meta))
+
+
+# Return the path of the channel-major copy of a binary file,
+# e.g. run_g0_tcat.imec0.lf.bin -> run_g0_tcat.imec0.lf.chanmajor.bin
+#
+def ChanMajorPath(binFullPath):
+    binFullPath = Path(binFullPath)
+    return (binFullPath.with_name(binFullPath.stem + '.chanmajor.bin'))
+
+
+# Return True if binFullPath has a channel-major copy that is complete and
+# more recent than the original file.
+#
+def HasChanMajor(binFullPath, meta):
+    cmPath = ChanMajorPath(binFullPath)
+    if not cmPath.exists():
+        return (False)
+    nChan = int(meta['nSavedChans'])
+    nFileSamp = int(int(meta['fileSizeBytes']) / (2 * nChan))
+    srcPath = CompressedPaths(binFullPath)[0] if IsCompressed(binFullPath) else Path(binFullPath)
+    cmStat = cmPath.stat()
+    return (cmStat.st_size == 2 * nChan * nFileSamp
+            and cmStat.st_mtime >= srcPath.stat().st_mtime)
+
+
+# Write a channel-major copy of a binary file: the samples of each channel
+# are stored contiguously, i.e. a C-ordered [channels X timepoints] array.
+# Reading one channel over the whole recording then touches only that
+# channel's pages, instead of every page of the interleaved file.
+# The copy is written from sequential chunks of the original (StreamChunks),
+# to a temporary file that is renamed once complete.
+#
+def WriteChanMajor(binFullPath, meta, chunkSamp=262144, overwrite=False):
+    cmPath = ChanMajorPath(binFullPath)
+    if not overwrite and HasChanMajor(binFullPath, meta):
+        return (cmPath)
+
+    nChan = int(meta['nSavedChans'])
+    nFileSamp = int(int(meta['fileSizeBytes']) / (2 * nChan))
+    tmpPath = cmPath.with_name(cmPath.name + '.tmp')
+    cmData = np.memmap(tmpPath, dtype='int16', mode='w+',
+                       shape=(nChan, nFileSamp), order='C')
+    for chunk in StreamChunks(binFullPath, meta, chunkSamp):
+        first = chunk.firstSamp + chunk.core.start
+        cmData[:, first:first + chunk.core.stop - chunk.core.start] = chunk.data[:, chunk.core]
+    cmData.flush()
+    del cmData
+    os.replace(tmpPath, cmPath)
+    return (cmPath)
+
+
+# Return memmap of the channel-major copy written by WriteChanMajor. It is
+# indexed exactly like makeMemMapRaw: rawData[channels, timepoints].
+#
+def makeMemMapChanMajor(binFullPath, meta):
+    nChan = int(meta['nSavedChans'])
+    nFileSamp = int(int(meta['fileSizeBytes']) / (2 * nChan))
+    rawData = np.memmap(ChanMajorPath(binFullPath), dtype='int16', mode='r',
+                        shape=(nChan, nFileSamp), offset=0, order='C')
+    return (rawData)
+
+
+# Return the memmap best suited to an access pattern, indexed as
+# rawData[channels, timepoints] whichever layout is used:
+# - 'time': blocks of consecutive samples over many channels -> original file
+# - 'channel': long stretches of few channels -> channel-major copy, if
+#   it exists (or is created, when makeCopy is True), else original file
+#
+def makeMemMapBest(binFullPath, meta, access='time', makeCopy=False):
+    if access == 'channel':
+        if makeCopy:
+            WriteChanMajor(binFullPath, meta)
+        if HasChanMajor(binFullPath, meta):
+            return (makeMemMapChanMajor(binFullPath, meta))
+    elif access != 'time':
+        raise ValueError('unrecognized access pattern: {}'.format(access))
+    return (openRaw(binFullPath, meta))
+
+
+# Read samples firstSamp..lastSamp (inclusive) of a binary file into a
+# C-contiguous int16 array [channels X timepoints], with one seek and one
+# sequential read (the GIL is released during the read, so several files
+# can be read concurrently from threads). Samples outside the file are
+# not returned: the block is clipped to the file.
+#
+# - rawData optionally reads from an open handle (e.g. CompressedRaw) kept
+#   by the caller, instead of opening the file on each call
+#
+def ReadBlock(binFullPath, meta, firstSamp, lastSamp, chanList=None, rawData=None):
+    if rawData is not None or IsCompressed(binFullPath):
+        ownRaw = rawData is None
+        if ownRaw:
+            rawData = CompressedRaw(binFullPath, meta)
+        firstSamp = max(int(firstSamp), 0)
+        lastSamp = min(int(lastSamp), rawData.shape[1] - 1)
+        chanSel = slice(None) if chanList is None else chanList
+        data = np.ascontiguousarray(rawData[chanSel, firstSamp:lastSamp + 1])
+        if ownRaw:
+            rawData.close()
+        return (data)
+
+    nChan = int(meta['nSavedChans'])
+    nFileSamp = int(int(meta['fileSizeBytes']) / (2 * nChan))
+    firstSamp = max(int(firstSamp), 0)
+    lastSamp = min(int(lastSamp), nFileSamp - 1)
+    nSamp = max(lastSamp - firstSamp + 1, 0)
+    with open(binFullPath, 'rb') as f:
+        f.seek(firstSamp * nChan * 2)
+        data = np.fromfile(f, dtype='int16', count=nSamp * nChan).reshape((-1, nChan))
+    if chanList is not None:
+        data = data[:, chanList]
+    return (np.ascontiguousarray(data.T))
+
+
+# Gather event-triggered snippets from rawData (anything sliced like the
+# makeMemMapRaw memmap, e.g. CompressedRaw) into an array
+# [channels X events X timepoints] covering eventSamp - preSamp up to
+# eventSamp + postSamp (excluded) for every event.
+#
+# Events are sorted and grouped: windows separated by less than maxGapSamp
+# samples (default: one window length) are read with a single contiguous
+# slice of rawData, then copied into the output, so thousands of nearby
+# stimuli cost a few sequential reads instead of a fancy-indexed copy of
+# the whole (channels X events X window) index array. A group spans at
+# most maxGroupSamp samples (or one window, if longer), so dense event
+# trains are read in bounded blocks instead of one block covering them all.
+#
+# - chanList optionally restricts the saved channels returned
+# - out is an optional preallocated int16 buffer of the output shape
+# - padMode sets the values of samples outside the file: 'edge' repeats
+#   the first/last sample of the file, 'zero' fills with zeros
+#
+def ExtractSnippets(rawData, eventSamps, preSamp, postSamp, chanList=None, out=None,
+                    padMode='edge', maxGapSamp=None, maxGroupSamp=262144):
+    eventSamps = np.asarray(eventSamps, dtype='int64').ravel()
+    nEvent = eventSamps.size
+    nWin = int(preSamp) + int(postSamp)
+    nChan, nFileSamp = rawData.shape
+    chanSel = slice(None) if chanList is None else np.asarray(chanList, dtype=int)
+    nOut = nChan if chanList is None else len(chanSel)
+    if out is None:
+        out = np.empty((nOut, nEvent, nWin), dtype=rawData.dtype)
+    elif out.shape != (nOut, nEvent, nWin):
+        raise ValueError('out must have shape {}'.format((nOut, nEvent, nWin)))
+    if padMode not in ('edge', 'zero'):
+        raise ValueError('unrecognized padMode: {}'.format(padMode))
+    if nEvent == 0 or nWin <= 0:
+        return (out)
+    if maxGapSamp is None:
+        maxGapSamp = nWin
+
+    # sort windows and split them into groups of overlapping/nearby windows
+    starts = eventSamps - int(preSamp)
+    order = np.argsort(starts, kind='stable')
+    sortedStarts = starts[order]
+    runStop = np.maximum.accumulate(sortedStarts + nWin)
+    newGroup = np.ones(nEvent, dtype=bool)
+    newGroup[1:] = sortedStarts[1:] > runStop[:-1] + maxGapSamp
+    groupFirst = np.flatnonzero(newGroup)
+    groupStop = np.append(groupFirst[1:], nEvent)
+
+    # split groups spanning more than maxGroupSamp samples
+    groups = []
+    for g0, g1 in zip(groupFirst, groupStop):
+        while g1 - g0 > 1 and runStop[g1 - 1] - sortedStarts[g0] > maxGroupSamp:
+            cut = g0 + max(int(np.searchsorted(runStop[g0:g1], sortedStarts[g0] + maxGroupSamp, side='right')), 1)
+            groups.append((g0, cut))
+            g0 = cut
+        groups.append((g0, g1))
+
+    win = np.arange(nWin)
+    for g0, g1 in groups:
+        # one contiguous read per group, clipped to the file
+        readFirst = min(max(int(sortedStarts[g0]), 0), nFileSamp - 1)
+        readStop = max(min(int(runStop[g1 - 1]), nFileSamp), readFirst + 1)
+        block = np.asarray(rawData[chanSel, readFirst:readStop])
+
+        sampIdx = sortedStarts[g0:g1, np.newaxis] + win
+        pos = np.clip(sampIdx, 0, nFileSamp - 1) - readFirst
+        pos = np.clip(pos, 0, block.shape[1] - 1)
+        snippets = block[:, pos]
+        if padMode == 'zero':
+            outside = (sampIdx < 0) | (sampIdx >= nFileSamp)
+            if outside.any():
+                snippets[:, outside] = 0
+        out[:, order[g0:g1], :] = snippets
+    return (out)
+
+
+# One stream of a MultiStreamReader: name is 'nidq' or 'imecN'.
+# (a, b) map reference-clock seconds to stream seconds: tStream = a * tRef + b
+#
+SyncedStream = namedtuple('SyncedStream', ['name', 'binPath', 'meta', 'a', 'b'])
+
+
+# Reader over all the streams of a CatGT run folder (catgt_<run>_gN): the
+# nidq.bin and the binary file of every *_imecN probe folder.
+# Times are given in seconds of the reference stream clock (default imec0,
+# as for TPrime); every stream is mapped to it by a linear fit of the sync
+# edges extracted by CatGT (nidq xa_0_0 and imec ap xd_*_6_500 files).
+# Each file is read from its own thread, so reading a window from 4-6
+# probes overlaps their I/O instead of serializing it.
+#
+# - band is 'ap' or 'lf' for the probes
+# - preferCorrected uses the tcat_corrected binaries when they exist
+# - compressed files are opened once, and their chunk index and cached
+#   chunks reused by every read until close(); a reader is therefore not
+#   meant to be shared by several calling threads
+#
+class MultiStreamReader:
+    def __init__(self, catgtDir, band='ap', refStream='imec0', preferCorrected=True,
+                 includeNidq=True, syncPeriod=1.0):
+        self.catgtDir = Path(catgtDir)
+        self.band = band
+        self.syncPeriod = syncPeriod
+        self.streams = {}
+
+        edgeTimes = {}
+        if includeNidq or refStream == 'nidq':
+            niBins = sorted(self.catgtDir.glob('*.nidq.bin'))
+            niEdges = sorted(self.catgtDir.glob('*.nidq.xa_0_0.txt'))
+            if niBins and niEdges:
+                edgeTimes['nidq'] = np.loadtxt(niEdges[0], ndmin=1)
+                self.streams['nidq'] = (niBins[0], readMetaInfo(niBins[0]).raw)
+
+        for probeDir in sorted(self.catgtDir.glob('*_imec*')):
+            if not probeDir.is_dir():
+                continue
+            probeId = int(re.search(r'imec(\d+)$', probeDir.name).group(1))
+            bins = sorted(probeDir.glob('*.imec{}.{}.bin'.format(probeId, band)))
+            bins += [c.with_suffix('.bin') for c in sorted(probeDir.glob('*.imec{}.{}.cbin'.format(probeId, band)))
+                     if c.with_suffix('.bin') not in bins]
+            edges = sorted(probeDir.glob('*.imec{}.ap.xd_*_6_500.txt'.format(probeId)))
+            if not bins or not edges:
+                continue
+            corrected = [b for b in bins if 'corrected' in b.name]
+            original = [b for b in bins if 'corrected' not in b.name]
+            if preferCorrected and corrected:
+                binPath = corrected[0]
+            else:
+                binPath = (original or corrected)[0]
+            name = 'imec{}'.format(probeId)
+            edgeTimes[name] = np.loadtxt(edges[0], ndmin=1)
+            self.streams[name] = (binPath, readMetaInfo(binPath).raw)
+
+        if refStream not in self.streams:
+            raise ValueError('reference stream {} not found in {}'.format(refStream, catgtDir))
+        self.refStream = refStream
+
+        refEdges = edgeTimes[refStream]
+        for name, (binPath, meta) in list(self.streams.items()):
+            a, b = self._fitClock(refEdges, edgeTimes[name])
+            self.streams[name] = SyncedStream(name, binPath, meta, a, b)
+
+        self._raws = {name: CompressedRaw(stream.binPath, stream.meta) for name, stream in self.streams.items()
+                      if IsCompressed(stream.binPath)}
+        self._pool = ThreadPoolExecutor(max_workers=max(len(self.streams), 1))
+
+    # Linear fit of stream edge times against matching reference edge times
+    def _fitClock(self, refEdges, edges):
+        if edges is refEdges or len(edges) < 2 or len(refEdges) < 2:
+            return (1.0, 0.0)
+        # pair each reference edge with the nearest stream edge, and keep
+        # pairs within a quarter period of the median offset
+        idx = np.clip(np.searchsorted(edges, refEdges), 1, len(edges) - 1)
+        left = edges[idx - 1]
+        right = edges[idx]
+        nearest = np.where(np.abs(refEdges - left) <= np.abs(right - refEdges), left, right)
+        offset = nearest - refEdges
+        keep = np.abs(offset - np.median(offset)) < self.syncPeriod / 4
+        a, b = np.polyfit(refEdges[keep], nearest[keep], 1)
+        return (float(a), float(b))
+
+    def close(self):
+        self._pool.shutdown()
+        for rawData in self._raws.values():
+            rawData.close()
+        self._raws = {}
+
+    def __enter__(self):
+        return (self)
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Return the first sample of each stream matching reference time tRef
+    def toSample(self, name, tRef):
+        stream = self.streams[name]
+        tStream = stream.a * np.asarray(tRef) + stream.b
+        return (np.round(tStream * SampRate(stream.meta)).astype('int64'))
+
+    # Return {stream: (firstSamp, data)} for the window [tStart, tStop) in
+    # reference-clock seconds, data being int16 [channels X timepoints].
+    # chanLists optionally maps stream names to saved-channel lists.
+    def readWindow(self, tStart, tStop, streams=None, chanLists=None):
+        streams = list(self.streams) if streams is None else streams
+        chanLists = chanLists or {}
+        futures = {}
+        for name in streams:
+            stream = self.streams[name]
+            firstSamp = int(self.toSample(name, tStart))
+            nSamp = int(round((tStop - tStart) * stream.a * SampRate(stream.meta)))
+            futures[name] = (firstSamp, self._pool.submit(ReadBlock, stream.binPath, stream.meta, firstSamp,
+                                                           firstSamp + nSamp - 1, chanLists.get(name),
+                                                           self._raws.get(name)))
+        return ({name: (firstSamp, fut.result()) for name, (firstSamp, fut) in futures.items()})
+
+    # Event-triggered extraction: return {stream: (firstSamps, snippets)} with
+    # snippets of shape [channels X events X timepoints] around each event
+    # time (reference clock). Each stream is read in its own thread.
+    def readEvents(self, eventTimes, preSec, postSec, streams=None, chanLists=None):
+        streams = list(self.streams) if streams is None else streams
+        chanLists = chanLists or {}
+        eventTimes = np.asarray(eventTimes, dtype=float)
+
+        def readStream(name):
+            stream = self.streams[name]
+            sRate = SampRate(stream.meta)
+            firstSamps = self.toSample(name, eventTimes - preSec)
+            nSamp = int(round((preSec + postSec) * stream.a * sRate))
+            # events clipped at the file edges are padded with zeros
+            rawData = self._raws[name] if name in self._raws else makeMemMapRaw(stream.binPath, stream.meta)
+            snippets = ExtractSnippets(rawData, firstSamps, 0, nSamp,
+                                       chanList=chanLists.get(name), padMode='zero')
+            return (firstSamps, snippets)
+
+        futures = {name: self._pool.submit(readStream, name) for name in streams}
+        return ({name: fut.result() for name, fut in futures.items()})
+
+
+# One block yielded by StreamChunks.
+# - firstSamp is the file sample index of data[:, 0]
+# - core is the slice of data (along time) that belongs to this chunk only;
+#   the samples outside core are the overlap shared with the neighbours.
+# - data is a C-contiguous int16 array [channels X timepoints]
+#
+RawChunk = namedtuple('RawChunk', ['firstSamp', 'core', 'data'])
+
+
+# Generator reading a binary file sequentially in fixed-size time chunks.
+# Every byte of the file is read once, in file order, so memory use is
+# bounded by (chunkSamp + 2 * overlapSamp) * nSavedChans * 2 bytes and
+# the OS read-ahead works in our favour, unlike fancy indexing of the
+# Fortran memmap returned by makeMemMapRaw.
+#
+# - chunkSamp is the number of new samples in each chunk
+# - overlapSamp extra samples are added on each side of the chunk, when
+#   available (clipped at firstSamp/lastSamp)
+# - chanList is an optional list of saved-channel indices to keep
+# - firstSamp, lastSamp (inclusive) restrict the range of samples read
+# Compressed files (see CompressBin) are decompressed chunk by chunk.
+#
+def StreamChunks(binFullPath, meta, chunkSamp, overlapSamp=0, chanList=None,
+                 firstSamp=0, lastSamp=None):
+    nChan = int(meta['nSavedChans'])
+    nFileSamp = int(int(meta['fileSizeBytes']) / (2 * nChan))
+    if lastSamp is None or lastSamp > nFileSamp - 1:
+        lastSamp = nFileSamp - 1
+    chunkSamp = int(chunkSamp)
+    overlapSamp = int(overlapSamp)
+    if chunkSamp <= 0:
+        raise ValueError('chunkSamp must be a positive number of samples.')
+    if chanList is not None:
+        chanList = np.asarray(chanList, dtype=int)
+
+    if IsCompressed(binFullPath):
+        # decompressed chunk by chunk; overlaps are served from the reader cache
+        rawData = CompressedRaw(binFullPath, meta)
+        lastSamp = min(lastSamp, rawData.shape[1] - 1)
+        chanSel = slice(None) if chanList is None else chanList
+        for coreFirst in range(firstSamp, lastSamp + 1, chunkSamp):
+            coreStop = min(coreFirst + chunkSamp, lastSamp + 1)
+            blockFirst = max(coreFirst - overlapSamp, firstSamp)
+            blockStop = min(coreStop + overlapSamp, lastSamp + 1)
+            data = np.ascontiguousarray(rawData[chanSel, blockFirst:blockStop])
+            yield RawChunk(blockFirst, slice(coreFirst - blockFirst, coreStop - blockFirst), data)
+        rawData.close()
+        return
+
+    # buf holds time-major samples [timepoints X channels], starting at bufFirst
+    buf = np.zeros((0, nChan), dtype='int16')
+    bufFirst = firstSamp
+    truncated = False
+    with open(binFullPath, 'rb') as f:
+        f.seek(firstSamp * nChan * 2)
+        for coreFirst in range(firstSamp, lastSamp + 1, chunkSamp):
+            coreStop = min(coreFirst + chunkSamp, lastSamp + 1)
+            blockFirst = max(coreFirst - overlapSamp, firstSamp)
+            blockStop = min(coreStop + overlapSamp, lastSamp + 1)
+
+            # drop samples no longer needed, then read ahead up to blockStop
+            buf = buf[blockFirst - bufFirst:]
+            bufFirst = blockFirst
+            nNew = blockStop - (bufFirst + buf.shape[0])
+            if nNew > 0:
+                newData = np.fromfile(f, dtype='int16', count=nNew * nChan)
+                newData = newData.reshape((-1, nChan))
+                buf = np.concatenate((buf, newData), axis=0) if buf.shape[0] else newData
+                if newData.shape[0] < nNew:
+                    # file shorter than announced by fileSizeBytes
+                    truncated = True
+                    blockStop = bufFirst + buf.shape[0]
+                    coreStop = min(coreStop, blockStop)
+                    if coreStop <= coreFirst:
+                        break
+
+            block = buf[:blockStop - bufFirst]
+            if chanList is not None:
+                block = block[:, chanList]
+            data = np.ascontiguousarray(block.T)
+            core = slice(coreFirst - blockFirst, coreStop - blockFirst)
+            yield RawChunk(blockFirst, core, data)
+            if truncated:
+                break
+
+
 # Return an array [lines X timepoints] of uint8 values for a
 # specified set of digital lines.
 #
@@ -291,22 +1019,10 @@ def makeMemMapRaw(binFullPath, meta):
 #
 def ExtractDigital(rawData, firstSamp, lastSamp, dwReq, dLineList, meta):
     # Get channel index of requested digital word dwReq
-    if meta['typeThis'] == 'imec':
-        AP, LF, SY = ChannelCountsIM(meta)
-        if SY == 0:
-            print("No imec sync channel saved.")
-            digArray = np.zeros((0), 'uint8')
-            return (digArray)
-        else:
-            digCh = AP + LF + dwReq
-    else:
-        MN, MA, XA, DW = ChannelCountsNI(meta)
-        if dwReq > DW - 1:
-            print("Maximum digital word in file = %d" % (DW - 1))
-            digArray = np.zeros((0), 'uint8')
-            return (digArray)
-        else:
-            digCh = MN + MA + XA + dwReq
+    digCh = DigitalChan(dwReq, meta)
+    if digCh is None:
+        digArray = np.zeros((0), 'uint8')
+        return (digArray)
 
     selectData = np.ascontiguousarray(rawData[digCh, firstSamp:lastSamp + 1], 'int16')
     nSamp = lastSamp - firstSamp + 1
@@ -326,6 +1042,168 @@ def ExtractDigital(rawData, firstSamp, lastSamp, dwReq, dLineList, meta):
     return (digArray)
 
 
+# Return the saved-channel index of digital word dwReq, or None (with a
+# message, as ExtractDigital) when the word is not in the file.
+#
+def DigitalChan(dwReq, meta):
+    if meta['typeThis'] == 'imec':
+        AP, LF, SY = ChannelCountsIM(meta)
+        if SY == 0:
+            print("No imec sync channel saved.")
+            return (None)
+        return (AP + LF + dwReq)
+    else:
+        MN, MA, XA, DW = ChannelCountsNI(meta)
+        if dwReq > DW - 1:
+            print("Maximum digital word in file = %d" % (DW - 1))
+            return (None)
+        return (MN + MA + XA + dwReq)
+
+
+# Streaming alternative to ExtractDigital for long recordings: return the
+# rising and falling edges of a set of digital lines, as sample indices.
+# The digital word is read chunk by chunk with StreamChunks and the
+# requested bits are masked directly on the 16-bit word, so memory use
+# does not grow with the recording length.
+#
+# - dwReq, dLineList as in ExtractDigital
+# - returns a dictionary {line: (rising, falling)} of int64 arrays. An edge
+#   at sample i means the line changed state between samples i-1 and i; the
+#   state at firstSamp is taken as the initial state (no edge reported).
+#
+def ExtractDigitalEdges(binFullPath, meta, dwReq, dLineList, firstSamp=0,
+                        lastSamp=None, chunkSamp=1048576):
+    digCh = DigitalChan(dwReq, meta)
+    if digCh is None:
+        return ({})
+
+    masks = np.array([1 << int(line) for line in dLineList], dtype='uint16')
+    rising = [[] for _ in dLineList]
+    falling = [[] for _ in dLineList]
+    prevState = None
+    for chunk in StreamChunks(binFullPath, meta, chunkSamp, chanList=[digCh],
+                              firstSamp=firstSamp, lastSamp=lastSamp):
+        word = chunk.data[0].view('uint16')
+        state = (word[np.newaxis, :] & masks[:, np.newaxis]) != 0
+        if prevState is None:
+            prevState = state[:, 0]
+        # transitions relative to the last sample of the previous chunk
+        change = np.diff(state, axis=1, prepend=prevState[:, np.newaxis]).astype(bool)
+        for i in range(len(dLineList)):
+            edges = np.flatnonzero(change[i])
+            up = state[i, edges]
+            rising[i].append(edges[up] + chunk.firstSamp)
+            falling[i].append(edges[~up] + chunk.firstSamp)
+        prevState = state[:, -1]
+
+    edgeDict = {}
+    for i, line in enumerate(dLineList):
+        edgeDict[line] = (np.concatenate(rising[i]).astype('int64') if rising[i] else np.zeros(0, 'int64'),
+                          np.concatenate(falling[i]).astype('int64') if falling[i] else np.zeros(0, 'int64'))
+    return (edgeDict)
+
+
+# Return the times (in seconds) of the rising edges of pulses whose width
+# matches pulseMs within a relative tolerance, as CatGT does for its
+# -xd=js,ip,word,bit,millisecs option. pulseMs = 0 keeps every pulse.
+# These are the values CatGT writes to its xd_*.txt edge files, e.g.
+# xd_384_6_500.txt for the imec sync pulse on line 6.
+#
+def DigitalPulseTimes(rising, falling, sRate, pulseMs=0, tolerance=0.2):
+    rising = np.asarray(rising)
+    falling = np.asarray(falling)
+    if pulseMs > 0 and rising.size > 0:
+        # pair each rising edge with the next falling edge
+        iFall = np.searchsorted(falling, rising, side='right')
+        complete = iFall < falling.size
+        rising = rising[complete]
+        width = (falling[iFall[complete]] - rising) * 1000 / sRate
+        keep = np.abs(width - pulseMs) <= tolerance * pulseMs
+        rising = rising[keep]
+    return (rising / sRate)
+
+
+# Streaming equivalent of CatGT -xa/-xia on analog channels: return the
+# times (in seconds) of the leading edges of the pulses found on each of
+# a list of channels, reading the file once for all of them.
+#
+# - pulseSpecs is a list of (chan, thresh1, thresh2, pulseMs, inverted):
+#   chan is a saved-channel index, thresholds are in volts. A pulse starts
+#   when the signal crosses thresh1 going up (going down if inverted) and
+#   ends when it crosses back. As in CatGT, a pulse is kept if it reaches
+#   thresh2 (ignored if thresh2 is not beyond thresh1) and, if pulseMs > 0,
+#   if its width matches pulseMs within a relative tolerance.
+# - a pulse in progress at the start of the file is not reported; one in
+#   progress at the end is only reported when pulseMs = 0.
+# Thresholds are converted to int16 counts so that chunks are compared
+# without conversion to volts.
+#
+def ExtractAnalogPulses(binFullPath, meta, pulseSpecs, chunkSamp=1048576,
+                        tolerance=0.2):
+    conv = ChanConvIM(meta) if meta['typeThis'] == 'imec' else ChanConvNI(meta)
+    sRate = SampRate(meta)
+    chans = sorted(set(int(spec[0]) for spec in pulseSpecs))
+    row = {chan: i for i, chan in enumerate(chans)}
+
+    # thresholds in counts; thresh2 only applies beyond thresh1
+    nSpec = len(pulseSpecs)
+    thresh1 = np.array([spec[1] / conv[int(spec[0])] for spec in pulseSpecs])
+    thresh2 = np.array([spec[2] / conv[int(spec[0])] for spec in pulseSpecs])
+    checkPeak = np.array([spec[2] < spec[1] if spec[4] else spec[2] > spec[1]
+                          for spec in pulseSpecs], dtype=bool)
+
+    # per spec: edges and running count of samples beyond thresh2 at each edge
+    ups = [[] for _ in range(nSpec)]
+    downs = [[] for _ in range(nSpec)]
+    peakAtUp = [[] for _ in range(nSpec)]
+    peakAtDown = [[] for _ in range(nSpec)]
+    peakTotal = np.zeros(nSpec, dtype='int64')
+    prevState = [None] * nSpec
+    nSamp = 0
+    for chunk in StreamChunks(binFullPath, meta, chunkSamp, chanList=chans):
+        nSamp = chunk.firstSamp + chunk.data.shape[1]
+        for i, spec in enumerate(pulseSpecs):
+            data = chunk.data[row[int(spec[0])]]
+            state = data < thresh1[i] if spec[4] else data > thresh1[i]
+            if prevState[i] is None:
+                prevState[i] = state[0]
+            change = np.flatnonzero(np.diff(state, prepend=prevState[i]))
+            up = change[state[change]]
+            down = change[~state[change]]
+            ups[i].append(up + chunk.firstSamp)
+            downs[i].append(down + chunk.firstSamp)
+            if checkPeak[i]:
+                peak = data <= thresh2[i] if spec[4] else data >= thresh2[i]
+                peakCum = np.concatenate(([0], np.cumsum(peak, dtype='int64'))) + peakTotal[i]
+                peakAtUp[i].append(peakCum[up])
+                peakAtDown[i].append(peakCum[down])
+                peakTotal[i] = peakCum[-1]
+            prevState[i] = state[-1]
+
+    pulseTimes = []
+    for i, spec in enumerate(pulseSpecs):
+        up = np.concatenate(ups[i]) if ups[i] else np.zeros(0, 'int64')
+        down = np.concatenate(downs[i]) if downs[i] else np.zeros(0, 'int64')
+
+        # pair each leading edge with the next trailing edge, or the file end
+        iDown = np.searchsorted(down, up, side='right')
+        complete = iDown < down.size
+        end = np.full(up.size, nSamp, dtype='int64')
+        end[complete] = down[iDown[complete]]
+        keep = np.ones(up.size, dtype=bool)
+        if checkPeak[i]:
+            peakUp = np.concatenate(peakAtUp[i]) if peakAtUp[i] else np.zeros(0, 'int64')
+            peakDown = np.concatenate(peakAtDown[i]) if peakAtDown[i] else np.zeros(0, 'int64')
+            peakEnd = np.full(up.size, peakTotal[i], dtype='int64')
+            peakEnd[complete] = peakDown[iDown[complete]]
+            keep &= peakEnd > peakUp
+        if spec[3] > 0:
+            width = (end - up) * 1000 / sRate
+            keep &= complete & (np.abs(width - spec[3]) <= tolerance * spec[3])
+        pulseTimes.append(up[keep] / sRate)
+    return (pulseTimes)
+
+
 # Sample calling program to get a file from the user,
 # read metadata fetch sample rate, voltage conversion
 # values for this file and channel, and plot a small range
@@ -0,0 +1,320 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: session_index.py
+@time: 10/16/2026 9:12 AM
+@description: Index of SpikeGLX recordings under a data root, for fast batch session discovery.
+"""
+
+# Imports
+import os
+import json
+import time
+from pathlib import Path
+from loguru import logger
+
+from utils import readSGLX
+
+
+INDEX_FILE_NAME = 'session_index.json'
+
+# Output folders of the pipeline that never contain SpikeGLX binaries
+SKIP_DIRS = {'kilosort2', 'kilosort4', 'cwaves', 'dredge', 'dredge_fast', 'depth', 'motion', 'figures',
+             'sync_event_times', '.phy', '__pycache__'}
+
+
+def _walk_bin_files(data_root, session_dirs=None):
+    """
+    Walk data_root once with os.scandir and yield (bin_entry, meta_entry) pairs of SpikeGLX files.
+    :param data_root: (Path) root folder to scan
+    :param session_dirs: (list) if given, session folders (Ephys and catgt_* folders) are appended to it, also those
+        without binary files
+    :return: generator of (os.DirEntry, os.DirEntry)
+    """
+    stack = [str(data_root)]
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            logger.warning('Cannot list {}: {}'.format(folder, e))
+            continue
+
+        metas = {}
+        bins = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in SKIP_DIRS:
+                    stack.append(entry.path)
+                if session_dirs is not None and (entry.name == 'Ephys' or entry.name.startswith('catgt_')):
+                    session_dirs.append(entry.path)
+            elif entry.name.endswith('.meta'):
+                metas[entry.name[:-len('.meta')]] = entry
+            elif entry.name.endswith('.bin') or entry.name.endswith('.cbin'):
+                bins.append(entry)
+
+        for entry in bins:
+            stem = entry.name.rsplit('.', 1)[0]
+            if stem in metas:
+                yield entry, metas[stem]
+
+
+def _session_path(bin_path):
+    """
+    Return the session folder a binary file belongs to: the catgt_* folder for processed data,
+    the Ephys folder for raw data, else the parent folder.
+    :param bin_path: (Path) path to binary file
+    :return: (Path) session folder
+    """
+    for parent in bin_path.parents:
+        if parent.name.startswith('catgt_'):
+            return parent
+    for parent in bin_path.parents:
+        if parent.name == 'Ephys':
+            return parent
+    return bin_path.parent
+
+
+def _stream_name(file_name):
+    """
+    Return stream name ('imecN.ap', 'imecN.lf', 'nidq') from a SpikeGLX file name.
+    :param file_name: (str) binary file name
+    :return: (str)
+    """
+    parts = file_name.split('.')
+    for i, part in enumerate(parts):
+        if part.startswith('imec') and i + 1 < len(parts):
+            return '{}.{}'.format(part, parts[i + 1])
+        if part == 'nidq':
+            return 'nidq'
+    return 'unknown'
+
+
+def _index_file(bin_entry, meta_entry, data_root):
+    """
+    Stat and validate one .bin/.meta pair.
+    :param bin_entry: (os.DirEntry) binary file
+    :param meta_entry: (os.DirEntry) meta file
+    :param data_root: (Path) root of the index
+    :return: (dict) index record
+    """
+    bin_path = Path(bin_entry.path)
+    bin_stat = bin_entry.stat()
+    meta_stat = meta_entry.stat()
+    rel_path = bin_path.relative_to(data_root)
+
+    record = {
+        'path': str(rel_path),
+        'mouse_id': rel_path.parts[0],
+        'session_path': str(_session_path(bin_path).relative_to(data_root)),
+        'stream': _stream_name(bin_path.name),
+        'corrected': 'corrected' in bin_path.name,
+        'compressed': bin_path.suffix == '.cbin',
+        'bin_size': bin_stat.st_size,
+        'bin_mtime_ns': bin_stat.st_mtime_ns,
+        'meta_mtime_ns': meta_stat.st_mtime_ns,
+        'valid': True,
+        'problem': '',
+    }
+
+    try:
+        meta = readSGLX.readMetaInfo(bin_path)
+    except (OSError, KeyError, ValueError, IndexError) as e:
+        record.update(valid=False, problem='unreadable meta file: {}'.format(e))
+        return record
+
+    record.update(sample_rate=meta.sampRate,
+                  n_saved_chans=meta.nSavedChans,
+                  n_samples=meta.nFileSamp,
+                  duration_s=meta.duration)
+
+    # Validate file sizes against metadata (compressed files only checked for channel count)
+    if meta.fileSizeBytes % (2 * meta.nSavedChans) != 0:
+        record.update(valid=False, problem='fileSizeBytes is not a multiple of 2 x nSavedChans')
+    elif not record['compressed'] and bin_stat.st_size != meta.fileSizeBytes:
+        record.update(valid=False, problem='file size {} differs from fileSizeBytes {}'.format(
+            bin_stat.st_size, meta.fileSizeBytes))
+    return record
+
+
+def _new_session(mouse_id):
+    """Empty session summary."""
+    return {'mouse_id': mouse_id, 'probes': [], 'has_nidq': False, 'has_bin': False, 'duration_s': 0.0,
+            'sample_rates': {}, 'valid': True}
+
+
+def _summarize_sessions(files, session_paths=()):
+    """
+    Summarize indexed files per session: probe count, duration and sample rates.
+    :param files: (list) index records
+    :param session_paths: (list) relative paths of session folders, kept even if they have no binary files
+        (e.g. once the binaries were deleted)
+    :return: (dict) session summaries keyed by relative session path
+    """
+    sessions = {}
+    for session_path in session_paths:
+        sessions[session_path] = _new_session(Path(session_path).parts[0])
+    for record in files:
+        session = sessions.setdefault(record['session_path'], _new_session(record['mouse_id']))
+        session['has_bin'] = True
+        stream = record['stream']
+        if stream == 'nidq':
+            session['has_nidq'] = True
+        elif stream.endswith('.ap'):
+            probe = stream.split('.')[0]
+            if probe not in session['probes']:
+                session['probes'].append(probe)
+        if 'sample_rate' in record:
+            session['sample_rates'][stream] = record['sample_rate']
+            session['duration_s'] = max(session['duration_s'], record['duration_s'])
+        session['valid'] = session['valid'] and record['valid']
+
+    for session in sessions.values():
+        session['probes'] = sorted(session['probes'])
+        session['n_probes'] = len(session['probes'])
+    return sessions
+
+
+def session_index_path(data_root, mouse_id=None):
+    """
+    Path of the session index file: data_root/session_index.json, or data_root/mouse_id/session_index.json for the
+    index of one mouse.
+    :param data_root: (str or Path) root folder
+    :param mouse_id: (str) mouse name, None for the whole data root
+    :return: (Path)
+    """
+    if mouse_id is None:
+        return Path(data_root) / INDEX_FILE_NAME
+    return Path(data_root, mouse_id) / INDEX_FILE_NAME
+
+
+def build_session_index(data_root, previous=None, mouse_id=None):
+    """
+    Build the session index of a data root, or of one mouse folder of it, and save it (see session_index_path).
+    Each .bin/.meta pair is stat'ed once; meta files unchanged since the previous index are not re-read.
+    Session folders (Ephys and catgt_* folders) without binary files are also indexed.
+    :param data_root: (str or Path) root folder e.g. raw_data_path or output_path of the config
+    :param previous: (dict) previous index to update incrementally, loaded from disk if None
+    :param mouse_id: (str) only walk data_root/mouse_id, None for the whole data root
+    :return: (dict) index, with paths relative to data_root
+    """
+    data_root = Path(data_root)
+    walk_root = data_root if mouse_id is None else data_root / mouse_id
+    if previous is None:
+        previous = load_session_index(data_root, mouse_id=mouse_id) or {}
+    previous_files = {f['path']: f for f in previous.get('files', [])}
+
+    if not walk_root.is_dir():
+        logger.warning('{} not found.'.format(walk_root))
+        return {'data_root': str(data_root), 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'files': [],
+                'sessions': {}}
+
+    start_time = time.time()
+    files = []
+    session_dirs = []
+    n_reused = 0
+    for bin_entry, meta_entry in _walk_bin_files(walk_root, session_dirs):
+        rel_path = str(Path(bin_entry.path).relative_to(data_root))
+        old = previous_files.get(rel_path)
+        if old is not None:
+            bin_stat = bin_entry.stat()
+            if (old['bin_size'] == bin_stat.st_size and old['bin_mtime_ns'] == bin_stat.st_mtime_ns
+                    and old['meta_mtime_ns'] == meta_entry.stat().st_mtime_ns):
+                files.append(old)
+                n_reused += 1
+                continue
+        files.append(_index_file(bin_entry, meta_entry, data_root))
+
+    index = {
+        'data_root': str(data_root),
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'files': files,
+        'sessions': _summarize_sessions(files, [str(Path(d).relative_to(data_root)) for d in session_dirs]),
+    }
+
+    index_path = session_index_path(data_root, mouse_id)
+    tmp_path = index_path.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+    n_invalid = sum(1 for f in files if not f['valid'])
+    logger.info('Indexed {} files ({} unchanged, {} invalid) in {} sessions under {} in {:.1f} s.'.format(
+        len(files), n_reused, n_invalid, len(index['sessions']), walk_root, time.time() - start_time))
+    return index
+
+
+def load_session_index(data_root, mouse_id=None):
+    """
+    Load the session index of a data root, or of one mouse folder of it.
+    :param data_root: (str or Path) root folder
+    :param mouse_id: (str) mouse name, None for the index of the whole data root
+    :return: (dict) index, or None if there is no index
+    """
+    index_path = session_index_path(data_root, mouse_id)
+    if not index_path.exists():
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def get_session_index(data_root, max_age_hours=24, mouse_id=None):
+    """
+    Load the session index of a data root, or of one mouse folder of it, rebuilding it if missing or older than
+    max_age_hours.
+    :param data_root: (str or Path) root folder
+    :param max_age_hours: (float) maximum age of the index file before it is updated
+    :param mouse_id: (str) mouse name, None for the index of the whole data root
+    :return: (dict) index
+    """
+    index_path = session_index_path(data_root, mouse_id)
+    if index_path.exists() and time.time() - index_path.stat().st_mtime < max_age_hours * 3600:
+        return load_session_index(data_root, mouse_id=mouse_id)
+    return build_session_index(data_root, mouse_id=mouse_id)
+
+
+def query_sessions(index, mouse_id=None, processed=None, valid_only=True):
+    """
+    Return session folders of an index.
+    :param index: (dict) session index
+    :param mouse_id: (str) keep only this mouse, if given
+    :param processed: (bool) True for catgt_* folders, False for raw Ephys folders, None for both
+    :param valid_only: (bool) skip sessions with files failing validation
+    :return: (list) of absolute session Paths
+    """
+    data_root = Path(index['data_root'])
+    sessions = []
+    for session_path, session in sorted(index['sessions'].items()):
+        if mouse_id is not None and session['mouse_id'] != mouse_id:
+            continue
+        if valid_only and not session['valid']:
+            continue
+        is_processed = Path(session_path).name.startswith('catgt_')
+        if processed is not None and is_processed != processed:
+            continue
+        sessions.append(data_root / session_path)
+    return sessions
+
+
+def query_files(index, mouse_id=None, pattern=None, valid_only=True):
+    """
+    Return binary files of an index.
+    :param index: (dict) session index
+    :param mouse_id: (str) keep only this mouse, if given
+    :param pattern: (str) glob-style pattern matched against the file name, e.g. '*corrected*.ap.bin'
+    :param valid_only: (bool) skip files failing validation
+    :return: (list) of absolute file Paths
+    """
+    data_root = Path(index['data_root'])
+    files = []
+    for record in index['files']:
+        if mouse_id is not None and record['mouse_id'] != mouse_id:
+            continue
+        if valid_only and not record['valid']:
+            continue
+        path = data_root / record['path']
+        if pattern is not None and not path.match(pattern):
+            continue
+        files.append(path)
+    return sorted(files)
@@ -39,20 +39,14 @@ import scipy.io
 # The string values are converted to numbers using the "int" and "float"
 # fucntions. Note that python 3 has no size limit for integers.
 #
+# Parsing is delegated to readSGLX.readMetaInfo, which memoizes meta files,
+# so that a file already read by another pipeline stage is not parsed again.
+#
 def readMeta(metaPath):
     metaDict = {}
     if metaPath.exists():
-        # print("meta file present")
-        with metaPath.open() as f:
-            mdatList = f.read().splitlines()
-            # convert the list entries into key value pairs
-            for m in mdatList:
-                csList = m.split(sep='=')
-                if csList[0][0] == '~':
-                    currKey = csList[0][1:len(csList[0])]
-                else:
-                    currKey = csList[0]
-                metaDict.update({currKey: csList[1]})
+        from utils.readSGLX import readMetaInfo
+        metaDict = dict(readMetaInfo(metaPath).raw)
     else:
         print("no meta file")
 
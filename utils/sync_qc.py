@@ -0,0 +1,121 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: sync_qc.py
+@time: 10/16/2026 6:05 PM
+@description: Quality of the clock alignment between SpikeGLX streams, from the matching of their sync edges.
+"""
+
+# Imports
+import json
+import numpy as np
+from loguru import logger
+
+from utils import clock_sync
+
+
+def sync_quality(from_edges, to_edges, sync_period=1.0):
+    """
+    Quality metrics of the clock alignment of one stream (from) to a reference stream (to).
+    Vectorized over all sync edges:
+        - rate_ppm, offset_s: linear fit of reference edge times on stream edge times
+        - residual_*_ms: residuals of each matched edge to the piecewise-linear map through its two neighbours,
+          i.e. the error of the alignment at a sync edge if that edge were missing
+        - linear_residual_max_ms: largest deviation from the linear fit, i.e. non-linear clock drift
+        - drift_max_ms: range of the offset between clocks over the session
+        - missing/extra edges: reference/stream edges without a match, and gaps between consecutive edges
+    :param from_edges: (np.ndarray) sync edge times of the stream, in s
+    :param to_edges: (np.ndarray) sync edge times of the reference stream, in s
+    :param sync_period: (float) period of the sync square wave in s
+    :return: (dict) metrics
+    """
+    from_edges = np.sort(np.asarray(from_edges, dtype='float64'))
+    to_edges = np.sort(np.asarray(to_edges, dtype='float64'))
+    clock_map = clock_sync.fit_clock_map(from_edges, to_edges, sync_period)
+    f, t = clock_map.from_edges, clock_map.to_edges
+
+    # Linear clock model
+    slope, intercept = np.polyfit(f - f[0], t, 1)
+    linear_residual = t - (slope * (f - f[0]) + intercept)
+
+    # Leave-one-out residuals of the piecewise-linear map
+    if f.size > 2:
+        predicted = t[:-2] + (f[1:-1] - f[:-2]) * (t[2:] - t[:-2]) / (f[2:] - f[:-2])
+        residual = t[1:-1] - predicted
+    else:
+        residual = np.zeros(1)
+
+    # Gaps between consecutive edges, in periods
+    from_gaps = np.round(np.diff(from_edges) / sync_period)
+    to_gaps = np.round(np.diff(to_edges) / sync_period)
+
+    return {
+        'n_stream_edges': int(from_edges.size),
+        'n_reference_edges': int(to_edges.size),
+        'n_matched_edges': int(f.size),
+        'matched_fraction': float(f.size / min(from_edges.size, to_edges.size)),
+        'extra_stream_edges': int(from_edges.size - f.size),
+        'missing_stream_edges': int(to_edges.size - f.size),
+        'stream_gaps': int(np.count_nonzero(from_gaps > 1)),
+        'reference_gaps': int(np.count_nonzero(to_gaps > 1)),
+        'rate_ppm': float((slope - 1) * 1e6),
+        'offset_s': float(intercept - f[0]),
+        'residual_rms_ms': float(np.sqrt(np.mean(residual ** 2)) * 1e3),
+        'residual_max_ms': float(np.abs(residual).max() * 1e3),
+        'linear_residual_max_ms': float(np.abs(linear_residual).max() * 1e3),
+        'drift_max_ms': float(np.ptp(t - f) * 1e3),
+        'duration_s': float(f[-1] - f[0]),
+    }
+
+
+def check_sync_quality(report, max_residual_ms=0.5, min_matched_fraction=0.99):
+    """
+    List the streams whose alignment is out of tolerance.
+    :param report: (dict) stream name to metrics, see sync_quality
+    :param max_residual_ms: (float) tolerance on the largest edge residual, in ms
+    :param min_matched_fraction: (float) smallest fraction of sync edges matched between streams
+    :return: (list) failure messages, empty if all streams are within tolerance
+    """
+    failures = []
+    for stream, metrics in report.items():
+        if metrics['residual_max_ms'] > max_residual_ms:
+            failures.append('{}: sync edge residual {:.3f} ms > {} ms'.format(
+                stream, metrics['residual_max_ms'], max_residual_ms))
+        if metrics['matched_fraction'] < min_matched_fraction:
+            failures.append('{}: {:.1%} of sync edges matched < {:.1%}'.format(
+                stream, metrics['matched_fraction'], min_matched_fraction))
+    return failures
+
+
+def run_sync_qc(tostream_edges_path, fromstreams, sync_period, output_path, max_residual_ms=0.5,
+                min_matched_fraction=0.99):
+    """
+    Compute the sync quality of each stream relative to the reference stream, write it to a JSON file and raise
+    if any stream is out of tolerance.
+    :param tostream_edges_path: path to sync edge times of the reference stream
+    :param fromstreams: (dict) stream name to sync edge times file
+    :param sync_period: (float) period of the sync square wave in s
+    :param output_path: path to the JSON report
+    :param max_residual_ms: (float) tolerance on the largest edge residual, in ms
+    :param min_matched_fraction: (float) smallest fraction of sync edges matched between streams
+    :return: (dict) stream name to metrics
+    """
+    to_edges = clock_sync.load_edges(tostream_edges_path)
+    report = {}
+    for stream, edges_path in fromstreams.items():
+        report[str(stream)] = sync_quality(clock_sync.load_edges(edges_path), to_edges, sync_period)
+        metrics = report[str(stream)]
+        logger.info('Sync QC stream {}: {}/{} edges matched, rate {:+.2f} ppm, drift {:.2f} ms, '
+                    'max residual {:.3f} ms.'.format(stream, metrics['n_matched_edges'], metrics['n_stream_edges'],
+                                                     metrics['rate_ppm'], metrics['drift_max_ms'],
+                                                     metrics['residual_max_ms']))
+
+    failures = check_sync_quality(report, max_residual_ms, min_matched_fraction)
+    with open(output_path, 'w') as f:
+        json.dump({'reference': str(tostream_edges_path), 'sync_period': sync_period,
+                   'max_residual_ms': max_residual_ms, 'min_matched_fraction': min_matched_fraction,
+                   'passed': not failures, 'streams': report}, f, indent=2)
+    if failures:
+        raise ValueError('Sync QC failed, see {}: {}'.format(output_path, '; '.join(failures)))
+    return report
@@ -0,0 +1,551 @@
+#! /usr/bin/env/python3
+"""
+@author: Axel Bisi
+@project: ephys_utils
+@file: synthetic_sglx.py
+@time: 10/16/2026 2:05 PM
+@description: Synthetic SpikeGLX recordings (CatGT output layout) with known ground truth, for benchmarks.
+"""
+
+# Imports
+import os
+import numpy as np
+from pathlib import Path
+from loguru import logger
+from scipy.signal import lfilter
+
+
+# Probe models: part number, imro/gain conventions and site layout.
+# NP2.0 is a 4-shank probe (NP2013) with all channels on shank 0, bank 0, as in the SpikeGLX default imro table.
+PROBE_MODELS = {
+    'NP1.0': {
+        'imDatPrb_type': 0,
+        'imDatPrb_pn': 'PRB_1_4_0480_1',
+        'imAiRangeMax': 0.6,
+        'imMaxInt': 512,
+        'ap_gain': 500,
+        'lf_gain': 250,
+        'has_lf': True,
+        'x_pattern': [43, 11, 59, 27],
+        'row_pitch_um': 20,
+        'shank_width_um': 70,
+        'n_shanks': 1,
+        'shank_pitch_um': 0,
+    },
+    'NP2.0': {
+        'imDatPrb_type': 2013,
+        'imDatPrb_pn': 'NP2013',
+        'imAiRangeMax': 0.62,
+        'imMaxInt': 2048,
+        'ap_gain': 100,
+        'lf_gain': None,
+        'has_lf': False,
+        'x_pattern': [27, 59],
+        'row_pitch_um': 15,
+        'shank_width_um': 70,
+        'n_shanks': 4,
+        'shank_pitch_um': 250,
+    },
+}
+
+N_ACQ_CHANNELS = 384
+IMEC_SAMPLE_RATE = 30000.0
+LFP_DECIMATION = 12
+NIDQ_SAMPLE_RATE = 25000.0
+NIDQ_RANGE_V = 5.0
+SYNC_BIT = 6
+
+# NI analog (XA) channels, matching the -xa options of run_catgt
+NIDQ_SYNC_CHAN = 0
+NIDQ_TRIAL_CHAN = 1
+NIDQ_WHISKER_CHAN = 3
+NIDQ_CAMERA_CHANS = (5, 6)
+NIDQ_PIEZO_CHAN = 7
+NIDQ_N_XA = 8
+
+
+def probe_geometry(probe_model, n_channels=N_ACQ_CHANNELS):
+    """
+    Site coordinates of the first n_channels sites of a single-shank probe.
+    :param probe_model: (str) key of PROBE_MODELS
+    :param n_channels: (int) number of channels
+    :return: (np.ndarray, np.ndarray) x and y coordinates in um
+    """
+    model = PROBE_MODELS[probe_model]
+    chans = np.arange(n_channels)
+    x = np.asarray(model['x_pattern'], dtype=float)[chans % len(model['x_pattern'])]
+    y = (chans // 2) * float(model['row_pitch_um'])
+    return x, y
+
+
+def _imro_table(probe_model):
+    """
+    Build the imro table string of a probe model, all sites in bank 0 (and shank 0), with the external reference.
+    NP1.0 entries are (channel bank reference apgain lfgain apfilter), NP2.0 4-shank entries are
+    (channel shank bank reference electrode).
+    :param probe_model: (str) key of PROBE_MODELS
+    :return: (str)
+    """
+    model = PROBE_MODELS[probe_model]
+    entries = ['({},{})'.format(model['imDatPrb_type'], N_ACQ_CHANNELS)]
+    for ch in range(N_ACQ_CHANNELS):
+        if model['has_lf']:
+            entries.append('({} 0 0 {} {} 1)'.format(ch, model['ap_gain'], model['lf_gain']))
+        else:
+            entries.append('({} 0 0 0 {})'.format(ch, ch))
+    return ''.join(entries)
+
+
+def _geom_map(probe_model, n_channels):
+    """
+    Build the snsGeomMap string of the first n_channels sites.
+    :param probe_model: (str) key of PROBE_MODELS
+    :param n_channels: (int) number of saved neural channels
+    :return: (str)
+    """
+    model = PROBE_MODELS[probe_model]
+    x, y = probe_geometry(probe_model, n_channels)
+    entries = ['({},{},{},{})'.format(model['imDatPrb_pn'], model['n_shanks'], model['shank_pitch_um'],
+                                      model['shank_width_um'])]
+    entries += ['(0:{:g}:{:g}:1)'.format(xi, yi) for xi, yi in zip(x, y)]
+    return ''.join(entries)
+
+
+def make_imec_meta(probe_model, band, n_channels, n_samples, sample_rate=IMEC_SAMPLE_RATE, sync_period=1.0):
+    """
+    Build the metadata dict of a CatGT-processed imec binary file.
+    :param probe_model: (str) key of PROBE_MODELS
+    :param band: (str) 'ap' or 'lf'
+    :param n_channels: (int) number of saved neural channels
+    :param n_samples: (int) number of samples in the file
+    :param sample_rate: (float) sampling rate in Hz
+    :param sync_period: (float) period of the sync square wave in s
+    :return: (dict) metadata, keys without the leading '~'
+    """
+    model = PROBE_MODELS[probe_model]
+    n_saved = n_channels + 1
+    n_lf_acq = N_ACQ_CHANNELS if model['has_lf'] else 0
+    sync_orig_chan = N_ACQ_CHANNELS + n_lf_acq
+    first_orig_chan = N_ACQ_CHANNELS if band == 'lf' else 0
+
+    meta = {
+        'typeThis': 'imec',
+        'appVersion': '20230425',
+        'imSampRate': '{:g}'.format(sample_rate),
+        'imAiRangeMax': '{:g}'.format(model['imAiRangeMax']),
+        'imAiRangeMin': '{:g}'.format(-model['imAiRangeMax']),
+        'imMaxInt': str(model['imMaxInt']),
+        'imDatPrb_type': str(model['imDatPrb_type']),
+        'imDatPrb_pn': model['imDatPrb_pn'],
+        'imDatPrb_sn': '18194814{}'.format(model['imDatPrb_type']),
+        'acqApLfSy': '{},{},1'.format(N_ACQ_CHANNELS, n_lf_acq),
+        'snsApLfSy': '{},0,1'.format(n_channels) if band == 'ap' else '0,{},1'.format(n_channels),
+        'snsSaveChanSubset': '{}:{},{}'.format(first_orig_chan, first_orig_chan + n_channels - 1, sync_orig_chan),
+        'nSavedChans': str(n_saved),
+        'fileSizeBytes': str(2 * n_saved * n_samples),
+        'fileTimeSecs': '{:.6f}'.format(n_samples / sample_rate),
+        'firstSample': '0',
+        'syncSourcePeriod': '{:g}'.format(sync_period),
+        'imroTbl': _imro_table(probe_model),
+        'snsGeomMap': _geom_map(probe_model, n_channels),
+    }
+    if not model['has_lf']:
+        meta['imChan0apGain'] = str(model['ap_gain'])
+    return meta
+
+
+def make_nidq_meta(n_samples, sample_rate=NIDQ_SAMPLE_RATE, sync_period=1.0):
+    """
+    Build the metadata dict of a CatGT-processed nidq binary file (XA channels and one digital word).
+    :param n_samples: (int) number of samples in the file
+    :param sample_rate: (float) sampling rate in Hz
+    :param sync_period: (float) period of the sync square wave in s
+    :return: (dict) metadata
+    """
+    n_saved = NIDQ_N_XA + 1
+    return {
+        'typeThis': 'nidq',
+        'appVersion': '20230425',
+        'niSampRate': '{:g}'.format(sample_rate),
+        'niAiRangeMax': '{:g}'.format(NIDQ_RANGE_V),
+        'niAiRangeMin': '{:g}'.format(-NIDQ_RANGE_V),
+        'niMNGain': '200',
+        'niMAGain': '1',
+        'snsMnMaXaDw': '0,0,{},1'.format(NIDQ_N_XA),
+        'snsSaveChanSubset': 'all',
+        'nSavedChans': str(n_saved),
+        'fileSizeBytes': str(2 * n_saved * n_samples),
+        'fileTimeSecs': '{:.6f}'.format(n_samples / sample_rate),
+        'firstSample': '0',
+        'syncSourcePeriod': '{:g}'.format(sync_period),
+        'syncNiChanType': '1',
+        'syncNiChan': str(NIDQ_SYNC_CHAN),
+        'syncNiThresh': '1.1',
+    }
+
+
+def write_meta(meta_path, meta):
+    """
+    Write a metadata dict as a SpikeGLX .meta file.
+    :param meta_path: (Path) output path
+    :param meta: (dict) metadata
+    :return:
+    """
+    with open(meta_path, 'w') as f:
+        for key, val in meta.items():
+            if key in ['imroTbl', 'muxTbl', 'snsChanMap', 'snsShankMap', 'snsGeomMap']:
+                f.write('~{}={}\n'.format(key, val))
+            else:
+                f.write('{}={}\n'.format(key, val))
+    return
+
+
+def make_unit_templates(rng, x, y, n_units, sample_rate, duration_ms=2.0, n_template_chans=12):
+    """
+    Make spatio-temporal spike templates: a biphasic waveform decaying with distance to a random soma position.
+    :param rng: (np.random.Generator) random generator
+    :param x: (np.ndarray) site x coordinates in um
+    :param y: (np.ndarray) site y coordinates in um
+    :param n_units: (int) number of units
+    :param sample_rate: (float) sampling rate in Hz
+    :param duration_ms: (float) template duration in ms
+    :param n_template_chans: (int) number of channels spanned by each template
+    :return: (list) of (channels, template in uV of shape (n_template_chans, n_samples), peak channel)
+    """
+    n_samples = int(duration_ms * sample_rate / 1000)
+    t = np.arange(n_samples) / sample_rate * 1e3 - 0.5  # ms, trough at 0
+    n_template_chans = min(n_template_chans, x.size)
+
+    templates = []
+    for _ in range(n_units):
+        soma_x = rng.uniform(x.min(), x.max())
+        soma_y = rng.uniform(y.min(), y.max())
+        amplitude = rng.uniform(60, 300)
+        width = rng.uniform(0.12, 0.3)  # ms, narrow and broad units
+
+        waveform = -np.exp(-0.5 * (t / width) ** 2) + 0.35 * np.exp(-0.5 * ((t - 3 * width) / (2 * width)) ** 2)
+        distance = np.hypot(x - soma_x, y - soma_y)
+        chans = np.sort(np.argsort(distance)[:n_template_chans])
+        spatial = np.exp(-distance[chans] / 40.0)
+        template = amplitude * spatial[:, np.newaxis] * waveform[np.newaxis, :]
+        templates.append((chans, template.astype('float32'), int(chans[np.argmax(spatial)])))
+    return templates
+
+
+def _artifact_waveform(sample_rate, amplitude_uv, duration_ms=3.0):
+    """
+    Waveform of an induction coil artifact: a sharp transient followed by a decaying ringing.
+    :param sample_rate: (float) sampling rate in Hz
+    :param amplitude_uv: (float) peak amplitude in uV
+    :param duration_ms: (float) duration in ms
+    :return: (np.ndarray) waveform in uV
+    """
+    t = np.arange(int(duration_ms * sample_rate / 1000)) / sample_rate * 1e3
+    return (amplitude_uv * np.exp(-t / 0.6) * np.cos(2 * np.pi * t / 1.5)).astype('float32')
+
+
+def _square_wave(times, period):
+    """
+    Sync square wave (50% duty cycle, high on the first half period) at given times.
+    :param times: (np.ndarray) times in s
+    :param period: (float) period in s
+    :return: (np.ndarray) boolean
+    """
+    return np.mod(times, period) < period / 2
+
+
+def _pulses(times, onsets, width):
+    """
+    Boolean TTL pulse train at given times.
+    :param times: (np.ndarray) sorted times in s
+    :param onsets: (np.ndarray) sorted pulse onsets in s
+    :param width: (float) pulse width in s
+    :return: (np.ndarray) boolean
+    """
+    idx = np.searchsorted(onsets, times, side='right') - 1
+    valid = idx >= 0
+    high = np.zeros(times.shape, dtype=bool)
+    high[valid] = times[valid] - onsets[idx[valid]] < width
+    return high
+
+
+def _rising_edges(period, duration):
+    """
+    Rising edge times of the sync square wave.
+    :param period: (float) period in s
+    :param duration: (float) duration in s
+    :return: (np.ndarray) times in s
+    """
+    return np.arange(0, duration, period)
+
+
+def _write_imec_ap(bin_path, probe, sync_period, chunk_s, rng):
+    """
+    Write the AP-band binary file of one probe, one chunk at a time, of probe['n_samples'] samples.
+    :param bin_path: (Path) output path
+    :param probe: (dict) probe description built by write_synthetic_recording
+    :param sync_period: (float) sync period in s
+    :param chunk_s: (float) chunk duration in s
+    :param rng: (np.random.Generator) random generator
+    :return:
+    """
+    model = PROBE_MODELS[probe['model']]
+    fs = probe['sample_rate']
+    n_chan = probe['n_channels']
+    n_samples = probe['n_samples']
+    uv_per_bit = model['imAiRangeMax'] / model['imMaxInt'] / model['ap_gain'] * 1e6
+    max_int = model['imMaxInt']
+    chunk_samples = int(chunk_s * fs)
+
+    spike_samples = probe['spike_samples']
+    spike_clusters = probe['spike_clusters']
+    artifact_samples = probe['artifact_samples']
+    templates = probe['templates']
+    template_len = templates[0][1].shape[1] if templates else 0
+    artifact = _artifact_waveform(fs, probe['artifact_amplitude_uv'])
+
+    with open(bin_path, 'wb') as f:
+        for s0 in range(0, n_samples, chunk_samples):
+            s1 = min(s0 + chunk_samples, n_samples)
+            n = s1 - s0
+            block = rng.standard_normal((n_chan, n), dtype='float32') * probe['noise_uv']
+
+            # Spikes overlapping the chunk
+            i0, i1 = np.searchsorted(spike_samples, [s0 - template_len, s1])
+            for samp, clu in zip(spike_samples[i0:i1], spike_clusters[i0:i1]):
+                chans, template, _ = templates[clu]
+                a, b = max(samp, s0), min(samp + template_len, s1)
+                block[chans, a - s0:b - s0] += template[:, a - samp:b - samp]
+
+            # Artifacts on all channels, with a small per-channel gain
+            i0, i1 = np.searchsorted(artifact_samples, [s0 - artifact.size, s1])
+            for samp in artifact_samples[i0:i1]:
+                a, b = max(samp, s0), min(samp + artifact.size, s1)
+                block[:, a - s0:b - s0] += probe['artifact_gains'][:, np.newaxis] * artifact[a - samp:b - samp]
+
+            data = np.empty((n_chan + 1, n), dtype='int16')
+            np.clip(np.rint(block / uv_per_bit), -max_int, max_int - 1, out=block)
+            data[:n_chan] = block
+
+            # Sync channel: bit 6 follows the sync square wave in the probe clock
+            t = probe['t0'] + np.arange(s0, s1) / probe['true_sample_rate']
+            data[n_chan] = _square_wave(t, sync_period).astype('int16') << SYNC_BIT
+
+            np.ascontiguousarray(data.T).tofile(f)
+    return
+
+
+def _write_imec_lf(bin_path, probe, sync_period, chunk_s, rng):
+    """
+    Write the LF-band binary file of one probe: strong low-frequency signal below the brain surface, weak above.
+    :param bin_path: (Path) output path
+    :param probe: (dict) probe description built by write_synthetic_recording
+    :param sync_period: (float) sync period in s
+    :param chunk_s: (float) chunk duration in s
+    :param rng: (np.random.Generator) random generator
+    :return:
+    """
+    model = PROBE_MODELS[probe['model']]
+    fs = probe['sample_rate'] / LFP_DECIMATION
+    n_chan = probe['n_channels']
+    n_samples = probe['n_samples'] // LFP_DECIMATION
+    uv_per_bit = model['imAiRangeMax'] / model['imMaxInt'] / model['lf_gain'] * 1e6
+    max_int = model['imMaxInt']
+    chunk_samples = int(chunk_s * fs)
+
+    # Shared low-frequency signal (leaky random walk), scaled by depth
+    _, y = probe_geometry(probe['model'], n_chan)
+    amplitude = np.where(y < probe['surface_y'], 200.0, 5.0).astype('float32')[:, np.newaxis]
+    leak = np.exp(-2 * np.pi * 5.0 / fs)
+    zi = np.zeros(1)
+
+    with open(bin_path, 'wb') as f:
+        for s0 in range(0, n_samples, chunk_samples):
+            s1 = min(s0 + chunk_samples, n_samples)
+            n = s1 - s0
+            common, zi = lfilter([np.sqrt(1 - leak ** 2)], [1, -leak], rng.standard_normal(n), zi=zi)
+            block = amplitude * common.astype('float32')[np.newaxis, :]
+            block += rng.standard_normal((n_chan, n), dtype='float32') * 5.0
+
+            data = np.empty((n_chan + 1, n), dtype='int16')
+            np.clip(np.rint(block / uv_per_bit), -max_int, max_int - 1, out=block)
+            data[:n_chan] = block
+            t = probe['t0'] + np.arange(s0, s1) / (probe['true_sample_rate'] / LFP_DECIMATION)
+            data[n_chan] = _square_wave(t, sync_period).astype('int16') << SYNC_BIT
+            np.ascontiguousarray(data.T).tofile(f)
+    return
+
+
+def _write_nidq(bin_path, n_samples, sample_rate, events, sync_period, chunk_s, rng):
+    """
+    Write the nidq binary file: sync, trial start, whisker stimulus, camera and piezo XA channels.
+    :param bin_path: (Path) output path
+    :param n_samples: (int) number of samples
+    :param sample_rate: (float) sampling rate in Hz (the NI clock is the reference clock)
+    :param events: (dict) event onsets in s
+    :param sync_period: (float) sync period in s
+    :param chunk_s: (float) chunk duration in s
+    :param rng: (np.random.Generator) random generator
+    :return:
+    """
+    bits_per_volt = 32768 / NIDQ_RANGE_V
+    chunk_samples = int(chunk_s * sample_rate)
+
+    with open(bin_path, 'wb') as f:
+        for s0 in range(0, n_samples, chunk_samples):
+            s1 = min(s0 + chunk_samples, n_samples)
+            n = s1 - s0
+            t = np.arange(s0, s1) / sample_rate
+            volts = rng.standard_normal((NIDQ_N_XA, n)).astype('float32') * 0.005
+            volts[NIDQ_SYNC_CHAN] += 4.0 * _square_wave(t, sync_period)
+            volts[NIDQ_TRIAL_CHAN] += 5.0 * _pulses(t, events['trial_start'], 0.010)
+            volts[NIDQ_WHISKER_CHAN] += 3.0 * _pulses(t, events['whisker_stim'], 0.002)
+            for chan in NIDQ_CAMERA_CHANS:
+                volts[chan] += 3.3 * _pulses(t, events['camera_frames'], 0.002)
+            volts[NIDQ_PIEZO_CHAN] += rng.standard_normal(n).astype('float32') * 0.002
+
+            data = np.zeros((NIDQ_N_XA + 1, n), dtype='int16')
+            data[:NIDQ_N_XA] = np.clip(np.rint(volts * bits_per_volt), -32768, 32767)
+            np.ascontiguousarray(data.T).tofile(f)
+    return
+
+
+def write_synthetic_recording(output_dir, run_name='SYN000_20260101_000000', duration_s=60.0,
+                              probe_models=('NP1.0',), n_channels=N_ACQ_CHANNELS, n_units=30, firing_rate_hz=5.0,
+                              trial_interval_s=5.0, sync_period=1.0, chunk_s=1.0, write_lfp=True, seed=0):
+    """
+    Write a synthetic recording in the CatGT output layout: catgt_{run}_g0 with a nidq file and one folder per probe.
+    Each probe has its own clock (drift and start offset relative to the NI clock), so the sync edge files
+    are needed to map NI event times to the probe timebase, as with real data.
+    Ground truth (event times, artifact and spike samples, templates) is saved in {run}_g0_ground_truth.npz.
+    :param output_dir: (str or Path) folder in which catgt_{run}_g0 is created
+    :param run_name: (str) run name, e.g. mouse_date_time
+    :param duration_s: (float) recording duration in s
+    :param probe_models: (tuple) one PROBE_MODELS key per probe
+    :param n_channels: (int) number of saved neural channels per probe
+    :param n_units: (int) number of units per probe
+    :param firing_rate_hz: (float) mean firing rate of each unit
+    :param trial_interval_s: (float) mean interval between trial starts
+    :param sync_period: (float) sync square wave period in s
+    :param chunk_s: (float) duration of the chunks written at once, bounds memory use
+    :param write_lfp: (bool) write .lf.bin files for probes with an LF band
+    :param seed: (int) random seed
+    :return: (dict) paths to the epoch folder, binary files and ground truth file
+    """
+    rng = np.random.default_rng(seed)
+    epoch = '{}_g0'.format(run_name)
+    epoch_path = Path(output_dir, 'catgt_{}'.format(epoch))
+    epoch_path.mkdir(parents=True, exist_ok=True)
+    ground_truth = {}
+
+    # Task events in the NI (reference) clock
+    n_trials = max(int(duration_s / trial_interval_s) - 1, 1)
+    trial_start = np.sort(rng.uniform(0.5, duration_s - 1.0, n_trials))
+    whisker_stim = trial_start[rng.random(n_trials) < 0.5] + 0.5
+    events = {
+        'trial_start': trial_start,
+        'whisker_stim': whisker_stim,
+        'camera_frames': np.arange(0.0, duration_s, 0.01),
+    }
+
+    # NI stream
+    n_nidq = int(duration_s * NIDQ_SAMPLE_RATE)
+    nidq_bin = epoch_path / '{}_tcat.nidq.bin'.format(epoch)
+    _write_nidq(nidq_bin, n_nidq, NIDQ_SAMPLE_RATE, events, sync_period, chunk_s, rng)
+    write_meta(nidq_bin.with_suffix('.meta'), make_nidq_meta(n_nidq, NIDQ_SAMPLE_RATE, sync_period))
+    nidq_edges = _rising_edges(sync_period, n_nidq / NIDQ_SAMPLE_RATE)
+    np.savetxt(epoch_path / '{}_tcat.nidq.xa_{}_0.txt'.format(epoch, NIDQ_SYNC_CHAN), nidq_edges, fmt='%.6f')
+    np.savetxt(epoch_path / '{}_tcat.nidq.xa_{}_0.txt'.format(epoch, NIDQ_TRIAL_CHAN), trial_start, fmt='%.6f')
+    np.savetxt(epoch_path / '{}_tcat.nidq.xa_{}_0.txt'.format(epoch, NIDQ_WHISKER_CHAN), whisker_stim, fmt='%.6f')
+    for key, val in events.items():
+        ground_truth['nidq_{}'.format(key)] = val
+    ground_truth['nidq_sync_edges'] = nidq_edges
+
+    paths = {'epoch_path': epoch_path, 'nidq_bin': nidq_bin, 'ap_bins': [], 'lf_bins': []}
+    for probe_id, probe_model in enumerate(probe_models):
+        probe_path = epoch_path / '{}_imec{}'.format(epoch, probe_id)
+        probe_path.mkdir(exist_ok=True)
+
+        # Probe clock: t_ni = t0 + sample / true_sample_rate
+        true_sample_rate = IMEC_SAMPLE_RATE * (1 + rng.uniform(-20, 20) * 1e-6)
+        t0 = rng.uniform(0.0, 0.05)
+        n_samples = int((duration_s - t0) * true_sample_rate)
+        x, y = probe_geometry(probe_model, n_channels)
+
+        templates = make_unit_templates(rng, x, y, n_units, IMEC_SAMPLE_RATE)
+        spike_samples, spike_clusters = [], []
+        for unit in range(n_units):
+            n_spikes = rng.poisson(firing_rate_hz * n_samples / IMEC_SAMPLE_RATE)
+            spike_samples.append(rng.integers(0, n_samples, n_spikes))
+            spike_clusters.append(np.full(n_spikes, unit))
+        spike_samples = np.concatenate(spike_samples)
+        order = np.argsort(spike_samples, kind='stable')
+
+        probe = {
+            'model': probe_model,
+            'n_channels': n_channels,
+            'n_samples': n_samples,
+            'sample_rate': IMEC_SAMPLE_RATE,
+            'true_sample_rate': true_sample_rate,
+            't0': t0,
+            'noise_uv': 8.0,
+            'templates': templates,
+            'spike_samples': spike_samples[order],
+            'spike_clusters': np.concatenate(spike_clusters)[order],
+            'artifact_samples': np.round((whisker_stim - t0) * true_sample_rate).astype('int64'),
+            'artifact_amplitude_uv': 1500.0,
+            'artifact_gains': rng.uniform(0.5, 1.5, n_channels).astype('float32'),
+            'surface_y': 0.75 * y.max(),
+        }
+        probe['artifact_samples'] = probe['artifact_samples'][(probe['artifact_samples'] >= 0)
+                                                              & (probe['artifact_samples'] < n_samples)]
+
+        ap_bin = probe_path / '{}_tcat.imec{}.ap.bin'.format(epoch, probe_id)
+        logger.info('Writing synthetic {} probe imec{}: {} channels, {:.1f} s.'.format(
+            probe_model, probe_id, n_channels, n_samples / IMEC_SAMPLE_RATE))
+        _write_imec_ap(ap_bin, probe, sync_period, chunk_s, rng)
+        write_meta(ap_bin.with_suffix('.meta'), make_imec_meta(probe_model, 'ap', n_channels, n_samples,
+                                                               IMEC_SAMPLE_RATE, sync_period))
+        paths['ap_bins'].append(ap_bin)
+
+        # Sync edges in the probe timebase, as written by CatGT
+        edges_samples = np.ceil((_rising_edges(sync_period, duration_s) - t0) * true_sample_rate).astype('int64')
+        edges_samples = edges_samples[(edges_samples >= 0) & (edges_samples < n_samples)]
+        np.savetxt(probe_path / '{}_tcat.imec{}.ap.xd_{}_{}_500.txt'.format(epoch, probe_id, n_channels, SYNC_BIT),
+                   edges_samples / IMEC_SAMPLE_RATE, fmt='%.6f')
+
+        if write_lfp and PROBE_MODELS[probe_model]['has_lf']:
+            lf_bin = probe_path / '{}_tcat.imec{}.lf.bin'.format(epoch, probe_id)
+            _write_imec_lf(lf_bin, probe, sync_period, chunk_s, rng)
+            write_meta(lf_bin.with_suffix('.meta'), make_imec_meta(probe_model, 'lf', n_channels,
+                                                                   n_samples // LFP_DECIMATION,
+                                                                   IMEC_SAMPLE_RATE / LFP_DECIMATION, sync_period))
+            paths['lf_bins'].append(lf_bin)
+
+        key = 'imec{}_'.format(probe_id)
+        ground_truth[key + 'sync_edges'] = edges_samples / IMEC_SAMPLE_RATE
+        ground_truth[key + 'artifact_samples'] = probe['artifact_samples']
+        ground_truth[key + 'artifact_times'] = probe['artifact_samples'] / IMEC_SAMPLE_RATE
+        ground_truth[key + 'spike_samples'] = probe['spike_samples']
+        ground_truth[key + 'spike_clusters'] = probe['spike_clusters']
+        ground_truth[key + 'template_peak_channels'] = np.array([t[2] for t in templates])
+        ground_truth[key + 'peak_waveforms'] = np.array([t[1][list(t[0]).index(t[2])] for t in templates])
+        ground_truth[key + 'surface_y'] = probe['surface_y']
+
+    paths['ground_truth'] = epoch_path / '{}_ground_truth.npz'.format(epoch)
+    np.savez(paths['ground_truth'], **ground_truth)
+    logger.info('Synthetic recording written to {}.'.format(epoch_path))
+    return paths
+
+
+def main():
+    """
+    Write a short two-probe synthetic recording in the current folder.
+    :return:
+    """
+    write_synthetic_recording(os.getcwd(), duration_s=10.0, probe_models=('NP1.0', 'NP2.0'))
+    return
+
+
+if __name__ == '__main__':
+    main()